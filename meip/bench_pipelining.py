@@ -0,0 +1,32 @@
+import os, sys, time, django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "meip.settings")
+django.setup()
+
+from validator.smtp_session import SMTPSessionProber
+from validator.tests import FakeSMTPServer
+
+# Per-address latency of one SMTP session, with and without PIPELINING, against
+# a local fake MX that waits RTT seconds per client write (one network round trip).
+# Usage: python bench_pipelining.py [addresses] [rtt_ms]
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+RTT = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+SENDER = "bench@meta-insyt.com"
+
+emails = [f"user{i}@acme.com" for i in range(COUNT)]
+print(f"{COUNT} addresses, {RTT * 1000:.0f} ms simulated RTT")
+
+timings = {}
+for label, pipelining in (("lockstep", False), ("pipelined", True)):
+    server = FakeSMTPServer(catch_all=True, pipelining=pipelining, latency=RTT)
+    try:
+        started = time.perf_counter()
+        results = SMTPSessionProber(server.address, SENDER).probe(emails)
+        elapsed = time.perf_counter() - started
+    finally:
+        server.stop()
+    assert len(results) == COUNT and all(r[0] for r in results.values())
+    timings[label] = elapsed
+    print(f"{label:>10}: {elapsed:6.2f}s total, {elapsed / COUNT * 1000:6.1f} ms/address, {server.writes} round trips")
+
+print(f"Speedup: {timings['lockstep'] / timings['pipelined']:.1f}x")
@@ -129,6 +129,22 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Slow, rate-limited WHOIS backfill runs on its own queue: celery -A meip worker -Q whois --concurrency 1
+CELERY_TASK_ROUTES = {
+    'validator.tasks.enrich_whois_task': {'queue': 'whois'},
+}
+# Batches fan out as a chord of process_chunk_task (addresses grouped by domain, at most
+# this many per chunk) so every running worker shares one large upload
+BATCH_CHUNK_SIZE = env.int('BATCH_CHUNK_SIZE', default=2000)
+# SMTP sessions a chunk runs at once on its own thread pool (ValidationBatch.max_in_flight overrides)
+BATCH_MAX_IN_FLIGHT = env.int('BATCH_MAX_IN_FLIGHT', default=100)
+# Chunk results are bulk-upserted every RESULT_BUFFER_SIZE results or RESULT_FLUSH_SECONDS
+RESULT_BUFFER_SIZE = env.int('RESULT_BUFFER_SIZE', default=200)
+RESULT_FLUSH_SECONDS = env.float('RESULT_FLUSH_SECONDS', default=2.0)
+# Chunk tasks read pause/cancel signals (validator.batch_control) at most this often
+BATCH_SIGNAL_CHECK_MS = env.int('BATCH_SIGNAL_CHECK_MS', default=250)
+# Live progress is kept in Redis (validator.progress); the batch row is updated this often
+PROGRESS_CHECKPOINT_SECONDS = env.int('PROGRESS_CHECKPOINT_SECONDS', default=30)
 
 # Redis Fallback Logic:
 # Check the configured BROKER URL, not just localhost
@@ -145,3 +161,118 @@ else:
 # MEIP Specific Config
 SMTP_LIST = ["dev@meta-insyt.com"] # Default list
 DISPOSABLE_DOMAINS_FILE = BASE_DIR / 'validator' / 'disposable_domains.txt'
+
+# Max DNS queries in flight while prefetching a batch's domains (validator.dns_async)
+DNS_PREFETCH_CONCURRENCY = env.int('DNS_PREFETCH_CONCURRENCY', default=200)
+
+# Redis for worker-shared state (validator.redis_client): DNS/catch-all cache L2, config
+# version, throttle, egress status, batch signals and progress. Opt-in: empty keeps all
+# of it in-process, so dev and test runs never touch the broker's (possibly shared) Redis.
+CACHE_REDIS_URL = env('CACHE_REDIS_URL', default='')
+DNS_CACHE_MAX_ENTRIES = env.int('DNS_CACHE_MAX_ENTRIES', default=50000)
+DNS_CACHE_MIN_TTL = 60      # seconds, floor for very short record TTLs
+DNS_CACHE_MAX_TTL = 86400   # seconds, ceiling so stale records age out within a day
+
+# Negative caching of NXDOMAIN/NoAnswer (TTL = SOA minimum, clamped). Timeouts are never cached.
+DNS_NEGATIVE_DEFAULT_TTL = 900   # used when the response carries no SOA
+DNS_NEGATIVE_MIN_TTL = 60
+DNS_NEGATIVE_MAX_TTL = 10800     # RFC 2308 recommends at most 3 hours
+DNS_PROFILE_ATTEMPTS = 2         # rebuild a domain profile whose DNS timed out this many times per batch
+
+# Upstream nameserver pool (validator.dns_pool). Empty = use /etc/resolv.conf.
+# The DNS_UPSTREAMS SystemConfig key (comma separated, editable in Management) overrides this.
+DNS_UPSTREAMS = env.list('DNS_UPSTREAMS', default=[])
+DNS_UPSTREAM_TIMEOUT = 2.0      # seconds per upstream attempt (ceiling once latency is learned)
+DNS_UPSTREAM_TIMEOUT_FACTOR = 3   # learned attempt timeout = upstream p99 x factor
+DNS_UPSTREAM_TIMEOUT_FLOOR = 0.25
+DNS_UPSTREAM_LIFETIME = 5.0     # seconds per query across all attempts
+DNS_HEDGE_DEFAULT_DELAY = 0.3   # seconds before hedging while an upstream has no p95 yet
+
+# WHOIS records are stored in the DB (validator.WhoisRecord) and refetched after this long
+WHOIS_TTL_DAYS = 30
+WHOIS_FAILURE_TTL_HOURS = 6   # failed / rate-limited lookups are retried sooner
+
+# Write SMTP/DNS verdicts immediately and backfill WHOIS fields from the 'whois' queue
+WHOIS_DEFERRED = env.bool('WHOIS_DEFERRED', default=False)
+WHOIS_TLD_MIN_INTERVAL = 2.0  # seconds between WHOIS lookups to the same TLD registry
+
+# Catch-all verdicts are probed once per domain and shared by all workers
+CATCH_ALL_TTL = 86400             # seconds
+CATCH_ALL_CACHE_MAX_ENTRIES = 50000
+CATCH_ALL_CLAIM_WAIT = 15         # seconds a worker waits for another worker's in-flight probe
+
+# Multi-recipient SMTP sessions (validator.smtp_session)
+SMTP_TIMEOUT = 5                 # seconds, connect/command timeout when SMTP_ADAPTIVE_TIMEOUTS is off
+# Per-MX timeouts learned from reply latencies (validator.mx_health.mx_latency):
+# p99 x factor, clamped to [floor, ceiling]; hosts with too few samples, or that
+# just timed out, get SMTP_TIMEOUT
+SMTP_ADAPTIVE_TIMEOUTS = env.bool('SMTP_ADAPTIVE_TIMEOUTS', default=True)
+SMTP_TIMEOUT_FACTOR = 3
+SMTP_TIMEOUT_FLOOR = 2
+SMTP_TIMEOUT_CEILING = 30
+SMTP_TIMEOUT_MIN_SAMPLES = 5
+SMTP_SESSION_CHUNK = 100         # addresses per session before results are saved
+SMTP_SESSION_MAX_RCPT = 50       # RCPTs per transaction before RSET (lowered automatically on 452)
+SMTP_SESSION_MAX_RECONNECTS = 3  # consecutive reconnects before the rest of a chunk fails
+# ESMTP PIPELINING (RFC 2920): when the MX advertises it, MAIL FROM and up to
+# SMTP_PIPELINE_DEPTH RCPTs are sent in one write instead of one round trip each
+SMTP_PIPELINING = env.bool('SMTP_PIPELINING', default=True)
+SMTP_PIPELINE_DEPTH = 20
+
+# Egress preflight (validator.egress): workers check at startup and every
+# EGRESS_PREFLIGHT_INTERVAL seconds that port 25 to well-known MX hosts is open and
+# not answered with a 5xx "blacklisted" banner. While it isn't, SMTP-stage work is
+# paused ('pause') or batches continue with DNS-only scoring ('dns_only').
+EGRESS_PREFLIGHT_ENABLED = env.bool('EGRESS_PREFLIGHT_ENABLED', default=True)
+EGRESS_PREFLIGHT_HOSTS = env.list('EGRESS_PREFLIGHT_HOSTS', default=[
+    'gmail-smtp-in.l.google.com', 'outlook-com.olc.protection.outlook.com', 'mta5.am0.yahoodns.net',
+])
+EGRESS_PREFLIGHT_INTERVAL = 300  # seconds between checks
+EGRESS_PREFLIGHT_TIMEOUT = 5     # seconds per probe connect
+EGRESS_STATUS_CHECK_SECONDS = 5  # how often workers re-read the shared status
+EGRESS_BLOCKED_ACTION = env('EGRESS_BLOCKED_ACTION', default='pause')
+
+# Asyncio RCPT prober (validator.smtp_async.check_smtp_many). Each session holds one
+# socket, so keep concurrency below the worker's open-file limit (ulimit -n).
+SMTP_ASYNC_CONCURRENCY = env.int('SMTP_ASYNC_CONCURRENCY', default=1000)
+SMTP_ASYNC_SESSION_TIMEOUT = 20  # seconds for a whole connect-to-QUIT session
+
+# SMTP session limits per MX host and per provider (validator.throttle), shared by all
+# workers through Redis. rate = new sessions/second (token bucket of size burst),
+# max_sessions = concurrent sessions. Providers are keyed by gateway/mailbox provider.
+SMTP_THROTTLE_ENABLED = env.bool('SMTP_THROTTLE_ENABLED', default=True)
+SMTP_THROTTLE_MX = {"rate": 2.0, "burst": 10, "max_sessions": 5}
+SMTP_THROTTLE_PROVIDERS = {
+    "google": {"rate": 10.0, "burst": 50, "max_sessions": 50},
+    "microsoft": {"rate": 5.0, "burst": 20, "max_sessions": 20},
+    "proofpoint": {"rate": 2.0, "burst": 10, "max_sessions": 10},
+    "mimecast": {"rate": 2.0, "burst": 10, "max_sessions": 10},
+    "barracuda": {"rate": 1.0, "burst": 5, "max_sessions": 5},
+}
+SMTP_THROTTLE_LEASE_TTL = 300   # seconds before a crashed worker's session slot is reclaimed
+SMTP_THROTTLE_CAP_RETRY = 0.25  # seconds to wait when a session cap is full
+SMTP_THROTTLE_MAX_WAIT = 30     # seconds a single probe (check_smtp_detailed, check_smtp_many) waits for a slot
+
+# 4xx (greylisted / rate limited) results are parked and re-verified per MX by
+# tasks.retry_greylisted_task: first after the greylist window, then with backoff.
+GREYLIST_RETRY_WINDOW = 300    # seconds, typical greylisting delay
+GREYLIST_BACKOFF_FACTOR = 2
+GREYLIST_MAX_DELAY = 3600      # seconds between retries at most
+GREYLIST_MAX_ATTEMPTS = 5      # retries before the greylisted verdict becomes final
+
+# Per-MX-address circuit breaker (validator.mx_health): after this many connect failures
+# in a row the address is skipped (fail fast / fail over) for MX_BREAKER_COOLDOWN seconds.
+MX_BREAKER_FAILURES = 3
+MX_BREAKER_COOLDOWN = 60
+
+# SOCKS5 proxy pool (validator.proxy_pool). Proxies come from the PROXY_URL SystemConfig
+# value (comma separated) and are dialed per SMTP connection.
+PROXY_MAX_CONCURRENT = 20          # open SMTP connections per proxy
+PROXY_SELECTION = 'least_loaded'   # or 'round_robin'
+PROXY_ACQUIRE_TIMEOUT = 10         # seconds to wait for a free proxy slot
+
+# Senders, SystemConfig and disposable domains are cached per worker (validator.config_snapshot).
+# Management edits bump a version counter in Redis that workers check this often; without
+# Redis a snapshot is reloaded once it reaches CONFIG_SNAPSHOT_MAX_AGE.
+CONFIG_VERSION_CHECK_SECONDS = 2
+CONFIG_SNAPSHOT_MAX_AGE = 60
@@ -0,0 +1,89 @@
+import threading
+import time
+from django.conf import settings
+from .models import ValidationBatch
+from .redis_client import get_redis, mark_redis_down
+
+# Pause/cancel requests for a running batch, read by its chunk tasks
+SIGNAL_KEY = "meip:batch:{}:signal"
+
+PAUSE = "pause"
+CANCEL = "cancel"
+
+# Signals sent from this process while Redis is unavailable (eager mode, or web
+# and worker in one process). With Redis the key is the only source, since a
+# worker's local copy would outlive the clear_signal done in another process.
+_local = {}
+# Latest batch run each batch's chunks ran under in this process
+_runs = {}
+_lock = threading.Lock()
+
+
+def send_signal(batch_id, signal):
+    """Asks every chunk of a batch to stop: PAUSE (resumable) or CANCEL."""
+    r = get_redis()
+    if r is not None:
+        try:
+            r.setex(SIGNAL_KEY.format(batch_id), getattr(settings, 'BATCH_SIGNAL_TTL', 86400), signal)
+            return
+        except Exception:
+            mark_redis_down()
+    with _lock:
+        _local[batch_id] = signal
+
+
+def clear_signal(batch_id):
+    """Called when a batch (re)starts so an old pause doesn't stop the new run."""
+    with _lock:
+        _local.pop(batch_id, None)
+    r = get_redis()
+    if r is not None:
+        try:
+            r.delete(SIGNAL_KEY.format(batch_id))
+        except Exception:
+            mark_redis_down()
+
+
+class BatchControl:
+    """
+    A chunk task's view of its batch's signal. check() is cheap enough to call
+    per address: the shared signal (Redis, or the batch status when Redis is
+    down) is read at most every BATCH_SIGNAL_CHECK_MS, and once a signal is
+    seen it sticks.
+    """
+
+    def __init__(self, batch_id, interval_ms=None, run=None):
+        self.batch_id = batch_id
+        if run is not None:
+            with _lock:
+                # A newer run was started elsewhere: its clear_signal didn't reach this process
+                if run > _runs.get(batch_id, 0):
+                    _runs[batch_id] = run
+                    _local.pop(batch_id, None)
+        if interval_ms is None:
+            interval_ms = getattr(settings, 'BATCH_SIGNAL_CHECK_MS', 250)
+        self.interval = interval_ms / 1000
+        self.signal = None
+        self.checked_at = None
+
+    def check(self):
+        """PAUSE, CANCEL or None."""
+        if self.signal is None:
+            self.signal = _local.get(self.batch_id)
+        now = time.monotonic()
+        if self.signal is None and (self.checked_at is None or now - self.checked_at >= self.interval):
+            self.checked_at = now
+            self.signal = self.read_shared()
+        return self.signal
+
+    def read_shared(self):
+        r = get_redis()
+        if r is not None:
+            try:
+                raw = r.get(SIGNAL_KEY.format(self.batch_id))
+                return raw.decode() if raw else None
+            except Exception:
+                mark_redis_down()
+        # No Redis: fall back to the status written by pause_batch / cancel_batch
+        status = ValidationBatch.objects.filter(pk=self.batch_id).values_list('status', flat=True).first()
+        return {'PAUSED': PAUSE, 'CANCELLED': CANCEL}.get(status)
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from .redis_client import get_redis, mark_redis_down
+
+
+class TTLCache:
+    """
+    Two-tier cache with per-entry TTLs.
+    L1 is an in-process LRU bounded by max_entries; L2 is Redis, shared by all
+    workers and processes so a restarted or scaled-out worker starts warm.
+    Values must be JSON-serializable.
+    """
+
+    def __init__(self, namespace, max_entries=50000):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._l1 = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _redis_key(self, key):
+        return f"meip:{self.namespace}:{key}"
+
+    def _set_l1(self, key, value, expires_at):
+        with self._lock:
+            self._l1[key] = (expires_at, value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.max_entries:
+                self._l1.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._l1.move_to_end(key)
+                    self.l1_hits += 1
+                    return entry[1]
+                del self._l1[key]
+
+        r = get_redis()
+        if r is not None:
+            try:
+                raw = r.get(self._redis_key(key))
+            except Exception:
+                mark_redis_down()
+                raw = None
+            if raw is not None:
+                data = json.loads(raw)
+                if data["exp"] > now:
+                    self._set_l1(key, data["v"], data["exp"])
+                    with self._lock:
+                        self.l2_hits += 1
+                    return data["v"]
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl):
+        ttl = max(1, int(ttl))
+        expires_at = time.time() + ttl
+        self._set_l1(key, value, expires_at)
+        r = get_redis()
+        if r is not None:
+            try:
+                r.setex(self._redis_key(key), ttl, json.dumps({"v": value, "exp": expires_at}))
+            except Exception:
+                mark_redis_down()
+
+    def set_many(self, items):
+        """items: iterable of (key, value, ttl). Writes L2 in one pipeline."""
+        items = list(items)
+        now = time.time()
+        for key, value, ttl in items:
+            self._set_l1(key, value, now + max(1, int(ttl)))
+        r = get_redis()
+        if r is not None and items:
+            try:
+                pipe = r.pipeline(transaction=False)
+                for key, value, ttl in items:
+                    ttl = max(1, int(ttl))
+                    pipe.setex(self._redis_key(key), ttl, json.dumps({"v": value, "exp": now + ttl}))
+                pipe.execute()
+            except Exception:
+                mark_redis_down()
+
+    def claim(self, key, ttl):
+        """
+        Cross-worker guard: True for the one caller that gets to compute `key`
+        for the next ttl seconds (always True when Redis is unavailable).
+        """
+        r = get_redis()
+        if r is None:
+            return True
+        try:
+            return bool(r.set(self._redis_key(f"claim:{key}"), "1", nx=True, ex=max(1, int(ttl))))
+        except Exception:
+            mark_redis_down()
+            return True
+
+    def release_claim(self, key):
+        """Gives up a claim() early so the next caller can compute `key` right away."""
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            r.delete(self._redis_key(f"claim:{key}"))
+        except Exception:
+            mark_redis_down()
+
+    def delete(self, key):
+        with self._lock:
+            self._l1.pop(key, None)
+        r = get_redis()
+        if r is not None:
+            try:
+                r.delete(self._redis_key(key))
+            except Exception:
+                mark_redis_down()
+
+    def clear(self):
+        """Drops the in-process tier only; L2 entries expire on their own."""
+        with self._lock:
+            self._l1.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.l1_hits + self.l2_hits + self.misses
+            return {
+                "entries": len(self._l1),
+                "max_entries": self.max_entries,
+                "l1_hits": self.l1_hits,
+                "l2_hits": self.l2_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.l1_hits + self.l2_hits) / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,90 @@
+import threading
+import time
+from django.conf import settings
+from .models import DisposableDomain, SMTPSender, SystemConfig
+from .redis_client import get_redis, mark_redis_down
+
+# Bumped on every management edit; workers reload their snapshot when it moves
+VERSION_KEY = "meip:config:version"
+
+# Critical disposable providers, on top of the DisposableDomain table
+DEFAULT_DISPOSABLE_DOMAINS = frozenset({
+    "mailinator.com","10minutemail.com","10minutemail.net","10minutemail.org",
+    "tempmail.com","temp-mail.org","guerrillamail.com","guerrillamail.org",
+    "yopmail.com","yopmail.net","yopmail.fr","yopmail.gq"
+})
+
+
+class ConfigSnapshot:
+    """Read-only copy of the management-editable tables (senders, SystemConfig, disposable domains)."""
+
+    def __init__(self, version, senders, system_config, disposable_domains):
+        self.version = version
+        self.senders = senders                        # tuple of active sender emails
+        self.system_config = system_config            # {key: value}
+        self.disposable_domains = disposable_domains  # frozenset, lowercase
+        self.loaded_at = time.monotonic()
+
+
+def load_snapshot(version):
+    try:
+        senders = tuple(SMTPSender.objects.filter(is_active=True).values_list('email', flat=True))
+        system_config = dict(SystemConfig.objects.values_list('key', 'value'))
+        db_domains = {d.lower() for d in DisposableDomain.objects.values_list('domain', flat=True)}
+        return ConfigSnapshot(version, senders, system_config, DEFAULT_DISPOSABLE_DOMAINS | db_domains)
+    except Exception as e:
+        print(f"[!] Could not load config snapshot ({e}). Using defaults.")
+        # version None makes the next check retry the DB
+        return ConfigSnapshot(None, (), {}, DEFAULT_DISPOSABLE_DOMAINS)
+
+
+_snapshot = None
+_checked_at = 0.0
+_local_version = 0
+_lock = threading.Lock()
+
+
+def remote_version():
+    r = get_redis()
+    if r is None:
+        return None
+    try:
+        return int(r.get(VERSION_KEY) or 0)
+    except Exception:
+        mark_redis_down()
+        return None
+
+
+def get_config():
+    """
+    The worker's current ConfigSnapshot. The shared version counter is checked
+    at most every CONFIG_VERSION_CHECK_SECONDS; without Redis the snapshot is
+    simply reloaded once it is CONFIG_SNAPSHOT_MAX_AGE seconds old.
+    """
+    global _snapshot, _checked_at
+    with _lock:
+        now = time.monotonic()
+        if _snapshot is not None and now - _checked_at < getattr(settings, 'CONFIG_VERSION_CHECK_SECONDS', 2):
+            return _snapshot
+        _checked_at = now
+        remote = remote_version()
+        version = (remote, _local_version)
+        stale = remote is None and _snapshot is not None and \
+            now - _snapshot.loaded_at >= getattr(settings, 'CONFIG_SNAPSHOT_MAX_AGE', 60)
+        if _snapshot is None or _snapshot.version != version or stale:
+            _snapshot = load_snapshot(version)
+        return _snapshot
+
+
+def bump_config_version():
+    """Call after editing senders, SystemConfig or disposable domains."""
+    global _local_version, _checked_at
+    with _lock:
+        _local_version += 1
+        _checked_at = 0.0
+    r = get_redis()
+    if r is not None:
+        try:
+            r.incr(VERSION_KEY)
+        except Exception:
+            mark_redis_down()
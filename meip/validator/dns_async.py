@@ -0,0 +1,128 @@
+import asyncio
+import ipaddress
+import time
+import dns.asyncresolver
+import dns.nameserver
+import dns.resolver
+from django.conf import settings
+from . import engine
+from .singleflight import AsyncSingleFlight
+from .dns_pool import get_upstream_pool
+
+# Records every profile needs: MX/A for the mail server, TXT for SPF, _dmarc TXT for DMARC
+PREFETCH_QUERIES = (
+    ("{domain}", "MX"),
+    ("{domain}", "A"),
+    ("{domain}", "TXT"),
+    ("_dmarc.{domain}", "TXT"),
+)
+# Just the mail server records, for depths that skip SPF/DMARC
+MAIL_SERVER_QUERIES = PREFETCH_QUERIES[:2]
+# Addresses of the MX hosts themselves
+HOST_QUERIES = (("{domain}", "A"),)
+
+
+def make_async_resolver():
+    """Async resolver mirroring the engine's sync resolver and upstream pool settings."""
+    r = dns.asyncresolver.Resolver()
+    pool = get_upstream_pool()
+    if pool is not None:
+        r.nameservers = [dns.nameserver.Do53Nameserver(u.address, u.port) for u in pool.ranked()]
+    else:
+        r.nameservers = list(engine.resolver.nameservers)
+    r.lifetime = engine.resolver.lifetime
+    r.timeout = engine.resolver.timeout
+    return r
+
+
+async def resolve_async(resolver, name, rtype):
+    """
+    Resolves one name into a dns_cache (value, ttl) pair, including NXDOMAIN/NoAnswer
+    negatives with SOA-minimum TTLs. Returns None for timeouts and other transient
+    errors so they are never cached.
+    """
+    try:
+        answer = await resolver.resolve(name, rtype)
+        return engine.answer_to_cache_entry(answer)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        return engine.negative_cache_entry(e)
+    except Exception:
+        return None
+
+
+async def prefetch_records(domains, concurrency, queries=PREFETCH_QUERIES):
+    """Resolves `queries` for every domain with at most `concurrency` queries in flight."""
+    resolver = make_async_resolver()
+    flight = AsyncSingleFlight()
+    queue = asyncio.Queue()
+    for domain in domains:
+        for name_tpl, rtype in queries:
+            queue.put_nowait((name_tpl.format(domain=domain), rtype))
+
+    results = {}
+
+    async def worker():
+        while True:
+            try:
+                name, rtype = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            value = await flight.do((name.lower(), rtype), resolve_async, resolver, name, rtype)
+            if value is not None:
+                results[(name, rtype)] = value
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, queue.qsize())))]
+    await asyncio.gather(*workers)
+    return results
+
+
+def prefetch_domains(domains, concurrency=None, dns_security=True):
+    """
+    Resolves MX, A, TXT and _dmarc TXT (only MX and A without dns_security) for all
+    domains concurrently and stores the answers in the engine's dns_cache. Domains
+    already cached are skipped. Returns the number of answers stored.
+    """
+    domains = sorted({d.lower() for d in domains if d})
+    # Anything still in the shared cache (e.g. from another worker) needs no query
+    domains = [d for d in domains if engine.dns_cache.get(engine.dns_cache_key(d, "MX")) is None]
+    if not domains:
+        return 0
+    if concurrency is None:
+        concurrency = getattr(settings, 'DNS_PREFETCH_CONCURRENCY', 200)
+
+    started = time.monotonic()
+    queries = PREFETCH_QUERIES if dns_security else MAIL_SERVER_QUERIES
+    results = asyncio.run(prefetch_records(domains, concurrency, queries))
+    engine.dns_cache.set_many(
+        (engine.dns_cache_key(name, rtype), value, ttl if "error" in value else engine.clamp_dns_ttl(ttl))
+        for (name, rtype), (value, ttl) in results.items()
+    )
+    print(f"[-] DNS prefetch: {len(domains)} domains, {len(results)} answers in {time.monotonic() - started:.1f}s")
+    return len(results)
+
+
+def prefetch_hosts(hosts, concurrency=None):
+    """
+    Resolves the A records of MX hosts (host names only, IP literals and
+    host:port test addresses need no lookup) into dns_cache, skipping cached ones.
+    """
+    names = sorted({engine.split_host_port(h)[0].lower() for h in hosts if h})
+    names = [n for n in names if not is_ip(n) and engine.dns_cache.get(engine.dns_cache_key(n, "A")) is None]
+    if not names:
+        return 0
+    if concurrency is None:
+        concurrency = getattr(settings, 'DNS_PREFETCH_CONCURRENCY', 200)
+    results = asyncio.run(prefetch_records(names, concurrency, HOST_QUERIES))
+    engine.dns_cache.set_many(
+        (engine.dns_cache_key(name, rtype), value, ttl if "error" in value else engine.clamp_dns_ttl(ttl))
+        for (name, rtype), (value, ttl) in results.items()
+    )
+    return len(results)
+
+
+def is_ip(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
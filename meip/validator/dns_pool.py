@@ -0,0 +1,315 @@
+import select
+import socket
+import threading
+import time
+from collections import deque
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+from django.conf import settings
+from .config_snapshot import get_config
+
+# An upstream with this many errors in a row is skipped for DOWN_SECONDS
+MAX_CONSECUTIVE_ERRORS = 3
+DOWN_SECONDS = 30
+# Hedge delay used until an upstream has enough latency samples for a p95
+MIN_SAMPLES_FOR_P95 = 10
+
+
+def parse_upstreams(value):
+    """'8.8.8.8, 1.1.1.1:53, [2001:4860:4860::8888]:53' -> [(address, port), ...]"""
+    if isinstance(value, str):
+        value = value.replace("\n", ",").split(",")
+    upstreams = []
+    for item in value:
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith("["):
+            address, _, port = item[1:].partition("]:")
+        elif item.count(":") == 1:
+            address, port = item.split(":")
+        else:
+            address, port = item, ""
+        upstreams.append((address.rstrip("]"), int(port or 53)))
+    return upstreams
+
+
+class Upstream:
+    """One nameserver with a rolling window of latencies and outcomes."""
+
+    def __init__(self, address, port=53, window=200):
+        self.address = address
+        self.port = port
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True = answered, False = error/timeout
+        self.consecutive_errors = 0
+        self.down_until = 0.0
+        self.queries = 0
+        self.errors = 0
+        self.ewma = None
+
+    @property
+    def family(self):
+        return socket.AF_INET6 if ":" in self.address else socket.AF_INET
+
+    def record_success(self, latency):
+        self.queries += 1
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_errors = 0
+        self.ewma = latency if self.ewma is None else 0.8 * self.ewma + 0.2 * latency
+
+    def record_error(self):
+        self.queries += 1
+        self.errors += 1
+        self.outcomes.append(False)
+        self.consecutive_errors += 1
+        if self.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+            self.down_until = time.monotonic() + DOWN_SECONDS
+
+    def is_healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def score(self):
+        """Lower is better. Unsampled upstreams score 0 so they get tried early."""
+        if self.ewma is None:
+            return 0.0
+        return self.ewma * (1 + 4 * self.error_rate())
+
+    def stats(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "address": f"{self.address}:{self.port}",
+            "healthy": self.is_healthy(),
+            "queries": self.queries,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 3),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class UpstreamPool:
+    """
+    Sends each query to the fastest healthy upstream and hedges it to the next
+    one if no answer arrives within the primary's p95 latency. Errors, SERVFAIL
+    and REFUSED fail over to the next upstream immediately. Each attempt gives
+    up after the upstream's p99 x timeout_factor (at least timeout_floor, at
+    most timeout).
+    """
+
+    def __init__(self, upstreams, timeout=2.0, lifetime=5.0, hedge_default=0.3, hedge_min=0.02,
+                 timeout_factor=3, timeout_floor=0.25):
+        self.upstreams = [Upstream(address, port) for address, port in upstreams]
+        self.timeout = timeout
+        self.timeout_factor = timeout_factor
+        self.timeout_floor = timeout_floor
+        self.lifetime = lifetime
+        self.hedge_default = hedge_default
+        self.hedge_min = hedge_min
+        self.hedged = 0
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        with self._lock:
+            healthy = [u for u in self.upstreams if u.is_healthy()]
+            down = [u for u in self.upstreams if not u.is_healthy()]
+            return sorted(healthy, key=lambda u: u.score()) + sorted(down, key=lambda u: u.down_until)
+
+    def hedge_delay(self, upstream):
+        if len(upstream.latencies) < MIN_SAMPLES_FOR_P95:
+            return self.hedge_default
+        return max(self.hedge_min, min(self.timeout, upstream.percentile(95)))
+
+    def attempt_timeout(self, upstream):
+        if len(upstream.latencies) < MIN_SAMPLES_FOR_P95:
+            return self.timeout
+        return max(self.timeout_floor, min(self.timeout, upstream.percentile(99) * self.timeout_factor))
+
+    def query(self, name, rtype):
+        """Returns (response message, upstream) for the first usable answer."""
+        request = dns.message.make_query(name, rtype)
+        wire = request.to_wire()
+        candidates = self.ranked()
+        pending = {}  # socket -> (upstream, sent_at)
+        timed_out = False
+        deadline = time.monotonic() + self.lifetime
+        next_hedge = None
+
+        def launch():
+            while candidates:
+                upstream = candidates.pop(0)
+                sock = socket.socket(upstream.family, socket.SOCK_DGRAM)
+                try:
+                    sock.setblocking(False)
+                    sock.sendto(wire, (upstream.address, upstream.port))
+                except OSError:
+                    sock.close()
+                    with self._lock:
+                        upstream.record_error()
+                    continue
+                pending[sock] = (upstream, time.monotonic())
+                return upstream
+            return None
+
+        def drop(sock, upstream=None):
+            pending.pop(sock, None)
+            sock.close()
+            if upstream is not None:
+                with self._lock:
+                    upstream.record_error()
+
+        try:
+            upstream = launch()
+            if upstream is not None:
+                next_hedge = time.monotonic() + self.hedge_delay(upstream)
+            while pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    timed_out = True
+                    break
+                for sock, (upstream, sent_at) in list(pending.items()):
+                    if now - sent_at >= self.attempt_timeout(upstream):
+                        timed_out = True
+                        drop(sock, upstream)
+                if not pending:
+                    upstream = launch()
+                    if upstream is not None:
+                        next_hedge = time.monotonic() + self.hedge_delay(upstream)
+                    continue
+
+                wake = min([deadline] + [sent_at + self.attempt_timeout(u) for u, sent_at in pending.values()])
+                if candidates and next_hedge is not None:
+                    wake = min(wake, next_hedge)
+                readable, _, _ = select.select(list(pending), [], [], max(0.0, wake - now))
+
+                for sock in readable:
+                    upstream, sent_at = pending[sock]
+                    try:
+                        data = sock.recv(65535)
+                        response = dns.message.from_wire(data)
+                    except OSError:
+                        # ICMP port unreachable and friends
+                        drop(sock, upstream)
+                        continue
+                    except Exception:
+                        continue  # garbage datagram, keep waiting
+                    if not request.is_response(response):
+                        continue
+                    if response.flags & dns.flags.TC:
+                        try:
+                            response = dns.query.tcp(request, upstream.address, timeout=self.timeout, port=upstream.port)
+                        except Exception:
+                            drop(sock, upstream)
+                            continue
+                    if response.rcode() in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+                        with self._lock:
+                            upstream.record_success(time.monotonic() - sent_at)
+                        return response, upstream
+                    drop(sock, upstream)
+
+                if candidates and next_hedge is not None and time.monotonic() >= next_hedge:
+                    hedge = launch()
+                    if hedge is not None:
+                        self.hedged += 1
+                        next_hedge = time.monotonic() + self.hedge_delay(hedge)
+                if not pending:
+                    upstream = launch()
+                    if upstream is not None:
+                        next_hedge = time.monotonic() + self.hedge_delay(upstream)
+        finally:
+            # Losers of a hedge race are closed without counting against them
+            for sock in list(pending):
+                sock.close()
+
+        if timed_out:
+            raise dns.exception.Timeout()
+        raise dns.resolver.NoNameservers(request=request, errors=[])
+
+    def resolve(self, name, rtype):
+        """Same contract as dns.resolver.Resolver.resolve (Answer, NXDOMAIN, NoAnswer, timeouts)."""
+        response, upstream = self.query(name, rtype)
+        qname = dns.name.from_text(name)
+        if response.rcode() == dns.rcode.NXDOMAIN:
+            raise dns.resolver.NXDOMAIN(qnames=[qname], responses={qname: response})
+        answer = dns.resolver.Answer(
+            qname, dns.rdatatype.from_text(rtype), dns.rdataclass.IN, response, upstream.address, upstream.port
+        )
+        if answer.rrset is None:
+            raise dns.resolver.NoAnswer(response=response)
+        return answer
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hedged_queries": self.hedged,
+                "upstreams": [u.stats() for u in self.upstreams],
+            }
+
+
+_pool = None
+_pool_config = None
+_pool_source = None
+_pool_lock = threading.Lock()
+
+
+def configured_upstreams(value=None):
+    """SystemConfig DNS_UPSTREAMS (from the config snapshot) wins over settings.DNS_UPSTREAMS."""
+    if value is None:
+        value = get_config().system_config.get("DNS_UPSTREAMS", "")
+    if value.strip():
+        return parse_upstreams(value)
+    return parse_upstreams(getattr(settings, 'DNS_UPSTREAMS', []))
+
+
+def get_upstream_pool():
+    """
+    Returns the process-wide UpstreamPool, or None when no upstreams are configured
+    (the engine then uses the system resolver). Follows the config snapshot, so
+    Management edits apply without a restart; latency stats survive as long as
+    the upstream list doesn't change.
+    """
+    global _pool, _pool_config, _pool_source
+    value = get_config().system_config.get("DNS_UPSTREAMS", "")
+    source = (value, tuple(getattr(settings, 'DNS_UPSTREAMS', [])))
+    with _pool_lock:
+        if source == _pool_source:
+            return _pool
+        _pool_source = source
+        upstreams = configured_upstreams(value)
+        if upstreams != _pool_config:
+            _pool_config = upstreams
+            _pool = UpstreamPool(
+                upstreams,
+                timeout=getattr(settings, 'DNS_UPSTREAM_TIMEOUT', 2.0),
+                lifetime=getattr(settings, 'DNS_UPSTREAM_LIFETIME', 5.0),
+                hedge_default=getattr(settings, 'DNS_HEDGE_DEFAULT_DELAY', 0.3),
+                timeout_factor=getattr(settings, 'DNS_UPSTREAM_TIMEOUT_FACTOR', 3),
+                timeout_floor=getattr(settings, 'DNS_UPSTREAM_TIMEOUT_FLOOR', 0.25),
+            ) if upstreams else None
+        return _pool
+
+
+def reset_upstream_pool():
+    """Forces the next get_upstream_pool() call to rebuild the pool."""
+    global _pool, _pool_config, _pool_source
+    with _pool_lock:
+        _pool, _pool_config, _pool_source = None, None, None
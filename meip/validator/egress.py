@@ -0,0 +1,155 @@
+import json
+import smtplib
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from .redis_client import get_redis, mark_redis_down
+
+# Latest preflight result, published by workers so every process (and the web
+# app's health API) sees the same egress state
+STATUS_KEY = "meip:egress:status"
+
+OK = "ok"
+BLOCKED = "blocked"          # port 25 connects time out or are refused
+BLACKLISTED = "blacklisted"  # connects work but MX hosts reject us with a 5xx banner
+UNKNOWN = "unknown"          # not checked yet, or no probe host could be resolved
+
+
+def probe_host(mx_host, timeout):
+    """(state, detail) for one well-known MX: a TCP connect to port 25 and its banner."""
+    from .engine import mx_addresses
+    from .proxy_pool import get_proxy_pool, ProxiedSMTP, ProxyUnavailable
+    try:
+        addresses = mx_addresses(mx_host)
+    except Exception as e:
+        return UNKNOWN, f"{mx_host}: DNS failed ({type(e).__name__})"
+    if not addresses:
+        return UNKNOWN, f"{mx_host}: no address"
+
+    ip, port = addresses[0]
+    pool = get_proxy_pool()
+    server = ProxiedSMTP(pool, timeout=timeout) if pool else smtplib.SMTP(timeout=timeout)
+    try:
+        code, msg = server.connect(ip, port)
+    except ProxyUnavailable as e:
+        return BLOCKED, f"{mx_host}: {e}"
+    except (OSError, smtplib.SMTPException) as e:
+        return BLOCKED, f"{mx_host} ({ip}:{port}): {e or 'timed out'}"
+    finally:
+        server.close()
+    banner = msg.decode(errors="replace") if isinstance(msg, bytes) else str(msg)
+    if 500 <= code < 600:
+        # e.g. "554 ... listed at zen.spamhaus.org"
+        return BLACKLISTED, f"{mx_host}: {code} {banner[:200]}"
+    return OK, f"{mx_host}: {code}"
+
+
+def run_preflight(hosts=None, timeout=None):
+    """
+    Checks the outbound SMTP path against EGRESS_PREFLIGHT_HOSTS. One reachable
+    host is enough for OK; otherwise any 5xx banner means BLACKLISTED and any
+    failed connect BLOCKED. Publishes and returns the status dict.
+    """
+    hosts = hosts if hosts is not None else getattr(settings, 'EGRESS_PREFLIGHT_HOSTS', [])
+    timeout = timeout or getattr(settings, 'EGRESS_PREFLIGHT_TIMEOUT', 5)
+    outcomes = [probe_host(host, timeout) for host in hosts]
+    states = {state for state, _ in outcomes}
+    state = next((s for s in (OK, BLACKLISTED, BLOCKED) if s in states), UNKNOWN)
+    status = {
+        "state": state,
+        "checked_at": datetime.now(dt_timezone.utc).isoformat(),
+        "action": getattr(settings, 'EGRESS_BLOCKED_ACTION', 'pause'),
+        "details": [detail for _, detail in outcomes],
+    }
+    if state != OK:
+        print(f"[!] Egress preflight: {state.upper()} ({'; '.join(status['details'])})")
+    publish(status)
+    return status
+
+
+_status = None
+_read_at = 0.0
+_lock = threading.Lock()
+
+
+def publish(status):
+    global _status, _read_at
+    with _lock:
+        _status, _read_at = status, time.monotonic()
+    r = get_redis()
+    if r is not None:
+        try:
+            # Expires if workers stop checking, so a stale "blocked" can't stick
+            r.setex(STATUS_KEY, int(getattr(settings, 'EGRESS_PREFLIGHT_INTERVAL', 300) * 3), json.dumps(status))
+        except Exception:
+            mark_redis_down()
+
+
+def egress_status():
+    """
+    The last published preflight status (state UNKNOWN if none). Redis is read
+    at most every EGRESS_STATUS_CHECK_SECONDS, so this is cheap enough to call
+    per address.
+    """
+    global _status, _read_at
+    with _lock:
+        if _status is not None and time.monotonic() - _read_at < getattr(settings, 'EGRESS_STATUS_CHECK_SECONDS', 5):
+            return _status
+    status = None
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(STATUS_KEY)
+            status = json.loads(raw) if raw else None
+        except Exception:
+            mark_redis_down()
+    with _lock:
+        if status is not None or _status is None:
+            _status = status or {"state": UNKNOWN, "checked_at": None, "action": None, "details": []}
+        _read_at = time.monotonic()
+        return _status
+
+
+def smtp_blocked():
+    """True when the last preflight found the SMTP egress path blocked or blacklisted."""
+    if not getattr(settings, 'EGRESS_PREFLIGHT_ENABLED', True):
+        return False
+    return egress_status()["state"] in (BLOCKED, BLACKLISTED)
+
+
+def refresh_if_stale():
+    """Re-runs the preflight when the last one is older than EGRESS_PREFLIGHT_INTERVAL."""
+    if not getattr(settings, 'EGRESS_PREFLIGHT_ENABLED', True):
+        return egress_status()
+    status = egress_status()
+    checked_at = status.get("checked_at")
+    age = (datetime.now(dt_timezone.utc) - datetime.fromisoformat(checked_at)).total_seconds() if checked_at else None
+    if age is None or age >= getattr(settings, 'EGRESS_PREFLIGHT_INTERVAL', 300):
+        status = run_preflight()
+    return status
+
+
+def start_preflight_loop():
+    """Worker startup: check now, then every EGRESS_PREFLIGHT_INTERVAL seconds in a daemon thread."""
+    if not getattr(settings, 'EGRESS_PREFLIGHT_ENABLED', True):
+        return None
+
+    def loop():
+        while True:
+            try:
+                run_preflight()
+            except Exception as e:
+                print(f"[!] Egress preflight error: {e}")
+            time.sleep(getattr(settings, 'EGRESS_PREFLIGHT_INTERVAL', 300))
+
+    thread = threading.Thread(target=loop, name="egress-preflight", daemon=True)
+    thread.start()
+    return thread
+
+
+def reset_egress_status():
+    """Forgets the local status; the next egress_status() re-reads Redis."""
+    global _status, _read_at
+    with _lock:
+        _status, _read_at = None, 0.0
@@ -1,33 +1,30 @@
 import dns.resolver
+import dns.rdatatype
 import tldextract
 import random
 import smtplib
 import socket
-from datetime import datetime
+import time
+import ipaddress
+from datetime import datetime, timezone as dt_timezone
 from email_validator import validate_email, EmailNotValidError
 from django.conf import settings
+from django.utils import timezone
 from functools import lru_cache
 import whois
-from .models import DisposableDomain, SMTPSender, SystemConfig
-import socks
+from .models import WhoisRecord
+from .config_snapshot import get_config
+from .cache import TTLCache
+from .singleflight import SingleFlight
+from .dns_pool import get_upstream_pool
+from .mx_health import mx_breakers, mx_latency
+from .proxy_pool import get_proxy_pool, ProxiedSMTP, ProxyUnavailable
+from .egress import smtp_blocked
 
 
-# Helper to get disposable domains
+# Disposable domains come from the worker's config snapshot (defaults + DisposableDomain table)
 def get_disposable_domains():
-    try:
-        # Hybrid approach: Start with critical ones, then add DB ones
-        defaults = {
-            "mailinator.com","10minutemail.com","10minutemail.net","10minutemail.org",
-            "tempmail.com","temp-mail.org","guerrillamail.com","guerrillamail.org",
-            "yopmail.com","yopmail.net","yopmail.fr","yopmail.gq"
-        }
-        db_domains = set(DisposableDomain.objects.values_list('domain', flat=True))
-        return defaults.union(db_domains)
-    except:
-        return {"mailinator.com"}
-
-# Load disposable domains
-# For performance, we'll cache this or load it per request, keeping it simple for now as function call
+    return get_config().disposable_domains
 
 
 ROLE_PREFIXES = {"admin","info","support","sales","contact","help","customercare","no-reply"}
@@ -45,45 +42,206 @@ resolver = dns.resolver.Resolver()
 resolver.lifetime = 5.0 # Timeout for total query
 resolver.timeout = 2.0 # Timeout per server
 
-# Save original socket execution for proxy handling
-ORIG_SOCKET = socket.socket
+# Coalesces concurrent identical DNS, WHOIS and catch-all lookups into one request
+flight = SingleFlight()
+
+# TTL-aware DNS answers shared across workers (L1 in-process, L2 Redis).
+# Values are {"records": [...]} or {"error": "NXDOMAIN" | "NoAnswer"}.
+dns_cache = TTLCache("dns", max_entries=getattr(settings, 'DNS_CACHE_MAX_ENTRIES', 50000))
+# Per-domain catch-all verdicts (True/False), probed once and shared by all workers
+catch_all_cache = TTLCache("catchall", max_entries=getattr(settings, 'CATCH_ALL_CACHE_MAX_ENTRIES', 50000))
+
+DNS_NEGATIVE_ERRORS = {"NXDOMAIN": dns.resolver.NXDOMAIN, "NoAnswer": dns.resolver.NoAnswer}
+# Timeouts and SERVFAIL say nothing about the domain and are never cached
+DNS_TRANSIENT_ERRORS = (dns.exception.Timeout, dns.resolver.NoNameservers)
+# A name that doesn't exist has no records of any type either
+NXDOMAIN_CACHE_RTYPES = ("MX", "A", "TXT")
+
+def dns_cache_key(name, rtype):
+    return f"{rtype}:{name.lower().rstrip('.')}"
+
+def clamp_dns_ttl(ttl):
+    low = getattr(settings, 'DNS_CACHE_MIN_TTL', 60)
+    high = getattr(settings, 'DNS_CACHE_MAX_TTL', 86400)
+    return max(low, min(high, int(ttl)))
+
+def record_text(rdata):
+    """Canonical text of one record: TXT strings joined, everything else as zone text."""
+    if rdata.rdtype == dns.rdatatype.TXT:
+        return b"".join(rdata.strings).decode("utf-8", "replace")
+    return rdata.to_text()
+
+def answer_to_cache_entry(answer):
+    """Converts a dnspython Answer to (cache value, ttl)."""
+    return {"records": [record_text(r) for r in answer]}, answer.rrset.ttl
+
+def cache_dns_entry(name, rtype, value, ttl):
+    dns_cache.set(dns_cache_key(name, rtype), value, clamp_dns_ttl(ttl))
+
+def soa_negative_ttl(response):
+    """RFC 2308 negative TTL: min(SOA TTL, SOA MINIMUM) from the authority section."""
+    if response is None:
+        return None
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum)
+    return None
 
-@lru_cache(maxsize=10000)
-def has_mail_server(domain):
+def negative_cache_entry(exc):
+    """Converts an NXDOMAIN/NoAnswer exception to (cache value, ttl), TTL from the zone's SOA."""
+    if isinstance(exc, dns.resolver.NXDOMAIN):
+        error = "NXDOMAIN"
+        responses = list(exc.kwargs.get("responses", {}).values())
+        response = responses[0] if responses else None
+    else:
+        error = "NoAnswer"
+        response = exc.kwargs.get("response")
+    ttl = soa_negative_ttl(response)
+    if ttl is None:
+        ttl = getattr(settings, 'DNS_NEGATIVE_DEFAULT_TTL', 900)
+    low = getattr(settings, 'DNS_NEGATIVE_MIN_TTL', 60)
+    high = getattr(settings, 'DNS_NEGATIVE_MAX_TTL', 10800)
+    return {"error": error}, max(low, min(high, int(ttl)))
+
+def negative_cache_items(name, rtype, exc):
+    """(key, value, ttl) items to cache for a negative answer; NXDOMAIN covers every rtype."""
+    value, ttl = negative_cache_entry(exc)
+    rtypes = {rtype}
+    if value["error"] == "NXDOMAIN":
+        rtypes.update(NXDOMAIN_CACHE_RTYPES)
+    return [(dns_cache_key(name, t), value, ttl) for t in rtypes]
+
+def resolve_records(name, rtype):
+    """
+    Returns the record texts for name/rtype, served from dns_cache when fresh.
+    Raises NXDOMAIN/NoAnswer for authoritative negatives (cached for the zone's
+    SOA minimum) and DNS_TRANSIENT_ERRORS for timeouts (never cached).
+    """
+    key = dns_cache_key(name, rtype)
+    hit = dns_cache.get(key)
+    if hit is not None:
+        if "error" in hit:
+            raise DNS_NEGATIVE_ERRORS[hit["error"]]()
+        return hit["records"]
+    # Concurrent misses for the same record share one query
+    return flight.do(("dns", key), _resolve_and_cache, name, rtype)
+
+def dns_resolve(name, rtype):
+    """Queries the configured upstream pool, or the system resolver when none is set."""
+    pool = get_upstream_pool()
+    if pool is not None:
+        return pool.resolve(name, rtype)
+    return resolver.resolve(name, rtype)
+
+def _resolve_and_cache(name, rtype):
+    try:
+        answer = dns_resolve(name, rtype)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        dns_cache.set_many(negative_cache_items(name, rtype, e))
+        raise
+    value, ttl = answer_to_cache_entry(answer)
+    cache_dns_entry(name, rtype, value, ttl)
+    return value["records"]
+
+def parse_mx(records):
+    """'10 mx.example.com.' texts -> hostnames sorted by preference."""
+    pairs = []
+    for r in records:
+        pref, host = r.split(None, 1)
+        pairs.append((int(pref), host))
+    return [host for _, host in sorted(pairs, key=lambda x: x[0])]
+
+def get_mx_hosts(domain):
+    """
+    Returns the domain's MX hosts sorted by preference (empty list if it has none).
+    Timeouts propagate as DNS_TRANSIENT_ERRORS.
+    """
     try:
-        resolver.resolve(domain, "MX")
+        return parse_mx(resolve_records(domain, "MX"))
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return []
+
+def has_a_record(domain):
+    """True/False for an authoritative answer. Timeouts propagate as DNS_TRANSIENT_ERRORS."""
+    try:
+        resolve_records(domain, "A")
         return True
-    except:
-        try:
-            resolver.resolve(domain, "A")
-            return True
-        except:
-            return False
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return False
 
-@lru_cache(maxsize=5000)
-def get_domain_age(domain):
+def has_mail_server(domain):
+    try:
+        return bool(get_mx_hosts(domain)) or has_a_record(domain)
+    except DNS_TRANSIENT_ERRORS:
+        return False
+
+def _first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+def get_whois_record(domain):
+    """
+    Returns the WhoisRecord for domain, fetching WHOIS only when the stored one is
+    older than WHOIS_TTL_DAYS (WHOIS_FAILURE_TTL_HOURS for failed lookups).
+    """
+    domain = domain.lower()
+    record = get_stored_whois_record(domain)
+    if record is not None:
+        return record
+    return flight.do(("whois", domain), _fetch_whois_record, domain)
+
+def get_stored_whois_record(domain):
+    """Fresh WhoisRecord from the DB, or None. Never queries WHOIS."""
+    ttl_days = getattr(settings, 'WHOIS_TTL_DAYS', 30)
+    failure_ttl_hours = getattr(settings, 'WHOIS_FAILURE_TTL_HOURS', 6)
+    try:
+        record = WhoisRecord.objects.filter(domain=domain.lower()).first()
+        if record and record.is_fresh(ttl_days, failure_ttl_hours):
+            return record
+    except Exception:
+        pass
+    return None
+
+def _fetch_whois_record(domain):
     # This can be slow and rate-limited.
+    defaults = {"creation_date": None, "country": None, "registrar": None,
+                "lookup_ok": True, "fetched_at": timezone.now()}
     try:
         w = whois.whois(domain)
-        c = w.creation_date
-        if isinstance(c, list): c = c[0]
-        if not c: return None
+        c = _first(w.creation_date)
         if isinstance(c, datetime):
-             return (datetime.now() - c).days
-        return None
-    except:
-        return None
+            defaults["creation_date"] = c if timezone.is_aware(c) else timezone.make_aware(c, dt_timezone.utc)
+        country, registrar = _first(w.country), _first(w.registrar)
+        defaults["country"] = str(country)[:100] if country else None
+        defaults["registrar"] = str(registrar)[:255] if registrar else None
+    except Exception:
+        defaults["lookup_ok"] = False
+    try:
+        record, _ = WhoisRecord.objects.update_or_create(domain=domain, defaults=defaults)
+    except Exception:
+        # DB unavailable: still hand the caller what we fetched
+        record = WhoisRecord(domain=domain, **defaults)
+    return record
+
+def get_whois_info(domain):
+    """Single (cached) WHOIS lookup returning (domain_age_days, country)."""
+    record = get_whois_record(domain)
+    return record.age_days, record.country
+
+def get_domain_age(domain):
+    age, _ = get_whois_info(domain)
+    return age
+
+def provider_from_mx(mx_host):
+    if not mx_host: return "Unknown"
+    mx = mx_host.lower()
+    if "google" in mx: return "Google Workspace"
+    if "outlook" in mx or "microsoft" in mx: return "Microsoft 365"
+    if "zoho" in mx: return "Zoho"
+    return "Custom"
 
-@lru_cache(maxsize=5000)
 def get_provider(domain):
-    try:
-        mx = str(resolver.resolve(domain, "MX")[0].exchange).lower()
-        if "google" in mx: return "Google Workspace"
-        if "outlook" in mx or "microsoft" in mx: return "Microsoft 365"
-        if "zoho" in mx: return "Zoho"
-        return "Custom"
-    except:
-        return "Unknown"
+    mx_hosts = get_mx_hosts(domain)
+    return provider_from_mx(mx_hosts[0] if mx_hosts else None)
 
 def is_disposable(email):
     return base_domain(email).lower() in get_disposable_domains()
@@ -92,16 +250,18 @@ def is_role_based(email):
     return email.split('@')[0].lower() in ROLE_PREFIXES
 
 def check_dns_security(domain):
-    """Returns (spf_status, dmarc_status) strings"""
+    """
+    Returns (spf_status, dmarc_status) strings.
+    "None" means the record doesn't exist; "Unknown" means the lookup timed out.
+    """
     spf_status = "None"
     dmarc_status = "None"
 
     try:
         # DMARC Check
         # Use our configured resolver
-        dmarc_records = resolver.resolve(f"_dmarc.{domain}", "TXT")
-        for r in dmarc_records:
-            txt = str(r).strip('"')
+        dmarc_records = resolve_records(f"_dmarc.{domain}", "TXT")
+        for txt in dmarc_records:
             if txt.startswith("v=DMARC1"):
                 # Parse policy
                 if "p=reject" in txt: dmarc_status = "Reject"
@@ -109,14 +269,15 @@ def check_dns_security(domain):
                 elif "p=none" in txt: dmarc_status = "Monitor"
                 else: dmarc_status = "Present"
                 break
-    except:
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
         pass
+    except DNS_TRANSIENT_ERRORS:
+        dmarc_status = "Unknown"
         
     try:
         # SPF Check
-        spf_records = resolver.resolve(domain, "TXT")
-        for r in spf_records:
-            txt = str(r).strip('"')
+        spf_records = resolve_records(domain, "TXT")
+        for txt in spf_records:
             if txt.startswith("v=spf1"):
                 if "-all" in txt: spf_status = "HardFail"
                 elif "~all" in txt: spf_status = "SoftFail"
@@ -124,8 +285,10 @@ def check_dns_security(domain):
                 elif "+all" in txt: spf_status = "AllowAll"
                 else: spf_status = "Present"
                 break
-    except:
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
         pass
+    except DNS_TRANSIENT_ERRORS:
+        spf_status = "Unknown"
         
     return spf_status, dmarc_status
 
@@ -159,88 +322,321 @@ def detect_firewall_info(mx_host, banner=None):
     return detect_spam_filter(mx_host, banner)
 
 
-def check_catch_all(domain):
+# Stages each validation depth runs (syntax, typo and MX checks always run)
+VALIDATION_DEPTHS = {
+    # List hygiene: syntax + MX only
+    "fast": {"dns_security": False, "whois": False, "catch_all": False, "smtp": False},
+    # Campaigns: DNS + SMTP, no WHOIS
+    "standard": {"dns_security": True, "whois": False, "catch_all": True, "smtp": True},
+    # Manual deep inspection: everything
+    "deep": {"dns_security": True, "whois": True, "catch_all": True, "smtp": True},
+    # Used instead of standard/deep while outbound port 25 is blocked (validator.egress)
+    "dns": {"dns_security": True, "whois": False, "catch_all": False, "smtp": False},
+}
+DEFAULT_VALIDATION_DEPTH = "deep"
+
+ASIAN_COUNTRIES = {"CN", "JP", "KR", "IN", "SG", "TH", "MY", "ID", "PH", "VN", "HK", "TW"}
+
+def is_asian_country(country):
+    return country in ASIAN_COUNTRIES if country else False
+
+
+class DomainProfile:
+    """
+    Domain-level intelligence (MX/A, SPF/DMARC, provider, firewall, WHOIS).
+    Resolved once per domain and shared by every address of that domain in a batch.
+    """
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.mx_hosts = []
+        self.has_a = False
+        self.spf_status = "None"
+        self.dmarc_status = "None"
+        self.provider = "Unknown"
+        self.firewall_info = None
+        self.domain_age_days = None
+        self.country = None
+        # Set when MX/A lookups timed out: the domain's existence is unknown, not negative
+        self.dns_error = None
+        # WHOIS left for the background enrichment queue (validator.tasks.enrich_whois_task)
+        self.whois_pending = False
+        # Catch-all verdict once probed (None = not probed yet)
+        self.catch_all = None
+        self.attempts = 1
+
+    @property
+    def mx_host(self):
+        return self.mx_hosts[0] if self.mx_hosts else None
+
+    @property
+    def has_mail_server(self):
+        return bool(self.mx_hosts) or self.has_a
+
+    @property
+    def is_asian_region(self):
+        return is_asian_country(self.country)
+
+    def __repr__(self):
+        return f"<DomainProfile {self.domain} mx={self.mx_host} provider={self.provider}>"
+
+
+def build_domain_profile(domain, defer_whois=False, depth=DEFAULT_VALIDATION_DEPTH):
+    """
+    Runs the domain-level checks of `depth` exactly once and returns a DomainProfile.
+    With defer_whois, only an already stored WHOIS record is used; otherwise the
+    profile is flagged whois_pending and WHOIS is left to the background queue.
+    """
+    stages = VALIDATION_DEPTHS[depth]
+    profile = DomainProfile(domain)
+    try:
+        profile.mx_hosts = get_mx_hosts(domain)
+        if not profile.mx_hosts:
+            profile.has_a = has_a_record(domain)
+    except DNS_TRANSIENT_ERRORS as e:
+        profile.dns_error = type(e).__name__
+    if not profile.has_mail_server:
+        return profile
+
+    profile.provider = provider_from_mx(profile.mx_host)
+    profile.firewall_info = detect_firewall_info(profile.mx_host)
+    if stages["dns_security"]:
+        profile.spf_status, profile.dmarc_status = check_dns_security(domain)
+    if stages["whois"]:
+        if defer_whois:
+            record = get_stored_whois_record(domain)
+            if record is None:
+                profile.whois_pending = True
+            else:
+                profile.domain_age_days, profile.country = record.age_days, record.country
+        else:
+            profile.domain_age_days, profile.country = get_whois_info(domain)
+    return profile
+
+
+def get_domain_profile(domain, profiles=None, defer_whois=False, depth=DEFAULT_VALIDATION_DEPTH):
+    """
+    Returns the profile for domain, building it only if `profiles` doesn't hold it yet.
+    Profiles whose DNS timed out are rebuilt for later addresses, up to DNS_PROFILE_ATTEMPTS.
+    """
+    if profiles is None:
+        return build_domain_profile(domain, defer_whois, depth)
+    profile = profiles.get(domain)
+    max_attempts = getattr(settings, 'DNS_PROFILE_ATTEMPTS', 2)
+    if profile is None or (profile.dns_error and profile.attempts < max_attempts):
+        attempts = profile.attempts + 1 if profile else 1
+        profile = build_domain_profile(domain, defer_whois, depth)
+        profile.attempts = attempts
+        profiles[domain] = profile
+    return profile
+
+
+def get_cached_catch_all(domain):
+    """Stored catch-all verdict for domain (True/False), or None if unknown or expired."""
+    return catch_all_cache.get(domain.lower())
+
+def store_catch_all(domain, code):
+    """
+    Caches the verdict for a probe that got a definitive answer: 250 means the
+    domain accepts everything, 5xx means it rejects unknown users. Greylisting,
+    timeouts and connection errors prove nothing and are not cached.
+    """
+    if code == 250 or 500 <= code < 600:
+        catch_all_cache.set(domain.lower(), code == 250, getattr(settings, 'CATCH_ALL_TTL', 86400))
+
+def check_catch_all(domain, mx_hosts=None):
     """Probes a random non-existent address to see if domain accepts everything."""
+    cached = get_cached_catch_all(domain)
+    if cached is not None:
+        return cached
+    return flight.do(("catch_all", domain.lower()), _probe_catch_all, domain, mx_hosts)
+
+def _probe_catch_all(domain, mx_hosts=None):
     import uuid
-    random_user = f"verify_{uuid.uuid4().hex[:8]}@{domain}"
-    success, code, _, _ = check_smtp_detailed(random_user)
+    # Another worker may be probing this domain right now; wait for its verdict,
+    # or take over as soon as it gives up its claim without one
+    wait = getattr(settings, 'CATCH_ALL_CLAIM_WAIT', 15)
+    claimed = catch_all_cache.claim(domain.lower(), wait)
+    if not claimed:
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.5)
+            cached = get_cached_catch_all(domain)
+            if cached is not None:
+                return cached
+            claimed = catch_all_cache.claim(domain.lower(), wait)
+            if claimed:
+                break
+    try:
+        random_user = f"verify_{uuid.uuid4().hex[:8]}@{domain}"
+        success, code, _, _ = check_smtp_detailed(random_user, mx_hosts=mx_hosts)
+        store_catch_all(domain, code)
+    finally:
+        # Inconclusive probes (4xx, 999) cache nothing; don't leave waiters hanging on the claim
+        if claimed:
+            catch_all_cache.release_claim(domain.lower())
     # If a random user is accepted (250), it's a catch-all.
     return success
 
-def check_smtp_detailed(email):
-    """Detailed SMTP check returning (is_success, code, message, banner)"""
+def get_smtp_senders():
+    """Active sender addresses from the config snapshot, falling back to settings.SMTP_LIST."""
+    db_senders = get_config().senders
+    if db_senders:
+        return list(db_senders)
+    # Strictly use settings, no hardcode fallback
+    return list(getattr(settings, 'SMTP_LIST', []))
+
+def prepare_smtp_sender():
+    """
+    Picks a sender (DB pool, falling back to settings.SMTP_LIST). Returns None
+    when no sender is configured at all. Proxies are applied per connection by
+    connect_mx, never process-wide.
+    """
+    smtp_list = get_smtp_senders()
+    if not smtp_list:
+        return None
+    return random.choice(smtp_list)
+
+def helo_host_for(smtp_sender):
+    """HELO hostname derived from the sender's domain."""
     try:
-        try:
-            # 1. Get senders from DB
-            db_senders = list(SMTPSender.objects.filter(is_active=True).values_list('email', flat=True))
-            if db_senders:
-                smtp_list = db_senders
-            else:
-                # Strictly use settings, no hardcode fallback
-                smtp_list = getattr(settings, 'SMTP_LIST', [])
-                if not smtp_list: raise ValueError("No SMTP Senders available")
-        except Exception:
-             # Fallback if DB fails
-             smtp_list = getattr(settings, 'SMTP_LIST', [])
-             if not smtp_list: raise ValueError("No SMTP Senders available")
-
-        smtp_sender = random.choice(smtp_list)
-        
-        # PROXY Handling (Simplified for brevity, assumes logic matches check_smtp)
-        proxy_config = SystemConfig.objects.filter(key="PROXY_URL").first()
-        if proxy_config and proxy_config.value:
-            try:
-                import socks
-                socks.set_default_proxy() 
-                socket.socket = ORIG_SOCKET 
-                p_url = proxy_config.value.replace("socks5://", "").replace("http://", "")
-                if "@" in p_url:
-                    auth, end = p_url.split("@")
-                    user, pwd = auth.split(":")
-                    host, port = end.split(":")
-                else:
-                    user, pwd = None, None
-                    host, port = p_url.split(":")
-                socks.set_default_proxy(socks.SOCKS5, host, int(port), True, user, pwd)
-                socket.socket = socks.socksocket
-            except:
-                socket.socket = ORIG_SOCKET
-        else:
-             if socket.socket != ORIG_SOCKET:
-                 socket.socket = ORIG_SOCKET
-                 
+         return smtp_sender.split("@")[1]
     except:
-         # Final safety net if logic above fails
-         smtp_list = getattr(settings, 'SMTP_LIST', [])
-         if smtp_list:
-             smtp_sender = random.choice(smtp_list)
-         else:
-             return False, 999, "Configuration Error: No Senders", ""
-
-         if socket.socket != ORIG_SOCKET:
-             socket.socket = ORIG_SOCKET
+         return socket.getfqdn()
+
+def greet(server, helo_host):
+    """
+    EHLO, falling back to HELO for servers that refuse it. Returns True when
+    the server advertises PIPELINING (RFC 2920) and SMTP_PIPELINING is on.
+    """
+    code, _ = server.ehlo(helo_host)
+    if code != 250:
+        server.helo(helo_host)
+        return False
+    return server.has_extn("pipelining") and getattr(settings, 'SMTP_PIPELINING', True)
+
+
+def send_commands(server, commands, pipelining):
+    """
+    Sends SMTP command lines and yields their (code, message) replies in order.
+    With pipelining they all go out in one write and the replies are read back
+    as they arrive: one round trip instead of one per command.
+    """
+    if not pipelining:
+        for line in commands:
+            yield server.docmd(line)
+        return
+    server.send("".join(f"{line}\r\n" for line in commands))
+    for _ in commands:
+        yield server.getreply()
+
+
+class MXUnavailable(OSError):
+    """No MX address could be connected to (all failed, or their circuit breakers are open)."""
+
+
+def split_host_port(mx_host, default_port=25):
+    """'mx.acme.com.' -> ('mx.acme.com', 25); 'host:2525' -> ('host', 2525), like smtplib.connect."""
+    if mx_host.count(":") == 1:
+        host, port = mx_host.split(":")
+        return host, int(port)
+    return mx_host.rstrip("."), default_port
+
+def mx_addresses(mx_host):
+    """[(ip, port)] to try for one MX host, from the DNS cache. Empty if it has no A records."""
+    host, port = split_host_port(mx_host)
+    try:
+        ipaddress.ip_address(host)
+        return [(host, port)]
+    except ValueError:
+        pass
+    try:
+        return [(ip, port) for ip in resolve_records(host, "A")]
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, *DNS_TRANSIENT_ERRORS):
+        return []
+
+def connect_mx(mx_hosts, timeout=None):
+    """
+    Connects to the first reachable MX address in preference order, failing over
+    to lower-priority hosts. Addresses whose circuit breaker is open are skipped
+    without a connect attempt. With proxies configured each connection is dialed
+    through the proxy pool. Without an explicit timeout each host gets its
+    learned one (mx_latency.timeout_for). Returns (server, banner, mx_host); raises
+    MXUnavailable when nothing could be reached (ProxyUnavailable if no proxy could).
+    """
+    pool = get_proxy_pool()
+    errors = []
+    for mx_host in mx_hosts:
+        host_timeout = timeout or mx_latency.timeout_for(mx_host)
+        for ip, port in mx_addresses(mx_host):
+            address = f"{ip}:{port}"
+            if not mx_breakers.allow(address, mx_host):
+                errors.append(f"{address} circuit open")
+                continue
+            server = ProxiedSMTP(pool, timeout=host_timeout) if pool else smtplib.SMTP(timeout=host_timeout)
+            started = time.monotonic()
+            try:
+                code, msg = server.connect(ip, port)
+                if code != 220:
+                    raise smtplib.SMTPConnectError(code, msg)
+            except ProxyUnavailable:
+                server.close()
+                raise
+            except (OSError, smtplib.SMTPException) as e:
+                server.close()
+                if isinstance(e, socket.timeout):
+                    mx_latency.record_timeout(mx_host, host_timeout)
+                mx_breakers.record_failure(address, mx_host, e)
+                errors.append(f"{address} {e}")
+                continue
+            elapsed = time.monotonic() - started
+            mx_breakers.record_success(address, mx_host, elapsed)
+            mx_latency.record(mx_host, elapsed)
+            return server, str(msg), mx_host
+    raise MXUnavailable("; ".join(errors) or "No reachable MX address")
+
+def check_smtp_detailed(email, mx_hosts=None):
+    """
+    Detailed SMTP check returning (is_success, code, message, banner).
+    Pass mx_hosts (sorted by preference) to skip the MX lookup.
+    """
+    smtp_sender = prepare_smtp_sender()
+    if smtp_sender is None:
+        return False, 999, "Configuration Error: No Senders", ""
          
     try:
-        domain = email.split("@")[1]
-        mx_records = resolver.resolve(domain, 'MX')
-        mx_records = sorted(mx_records, key=lambda x: x.preference)
-        mx_host = str(mx_records[0].exchange)
-        
+        if not mx_hosts:
+            domain = email.split("@")[1]
+            mx_hosts = parse_mx(resolve_records(domain, 'MX'))
         # Determine HELO hostname from sender
-        try:
-             helo_host = smtp_sender.split("@")[1]
-        except:
-             helo_host = socket.getfqdn()
-
-        server = smtplib.SMTP(timeout=5)
-        # Capture banner
-        connect_code, connect_msg = server.connect(mx_host)
-        banner = str(connect_msg)
-        
-        server.helo(helo_host)
-        server.mail(smtp_sender)
-        code, msg = server.rcpt(email)
-        server.quit()
+        helo_host = helo_host_for(smtp_sender)
+
+        from .throttle import throttle
+        # Each MX is dialed under its own lease, so failover counts against the host we talk to
+        errors = []
+        for mx_host in mx_hosts:
+            lease = throttle.acquire(mx_host, timeout=getattr(settings, 'SMTP_THROTTLE_MAX_WAIT', 30))
+            if lease is None:
+                # Reported like a remote 421 so the address is retried later
+                return False, 421, f"Rate limited locally for {mx_host}", ""
+            try:
+                server, banner, _ = connect_mx([mx_host])
+                break
+            except MXUnavailable as e:
+                lease.release()
+                errors.append(str(e))
+            except BaseException:
+                lease.release()
+                raise
+        else:
+            raise MXUnavailable("; ".join(errors) or "No reachable MX address")
+        with lease:
+            pipelining = greet(server, helo_host)
+            _, (code, msg) = send_commands(server, [
+                f"MAIL FROM:{smtplib.quoteaddr(smtp_sender)}",
+                f"RCPT TO:{smtplib.quoteaddr(email)}",
+            ], pipelining)
+            server.quit()
         return code == 250, code, msg, banner
     except (socket.timeout, socket.error, smtplib.SMTPException, dns.exception.Timeout) as e:
         return False, 999, str(e), ""
@@ -260,7 +656,8 @@ def calculate_rtpc_score(email_data):
 
     current_score = 100
 
-    if not email_data.get('smtp_check_success'):
+    # Fast validation skips SMTP entirely; that is not a negative signal
+    if not email_data.get('smtp_check_success') and not email_data.get('smtp_skipped'):
         # If greylisted (soft bounce), penalty is less severe
         if email_data.get('is_greylisted'):
             current_score -= 20
@@ -301,7 +698,31 @@ def calculate_rtpc_score(email_data):
     return max(0, min(100, current_score))
 
 
-def validate_email_single(email):
+def is_smtp_candidate(email):
+    """Cheap pre-check: would validate_email_single get as far as the SMTP stage?"""
+    try:
+        validate_email(email, check_deliverability=False)
+    except EmailNotValidError:
+        return False
+    dom = base_domain(email)
+    if not dom:
+        return False
+    typo_fix = suggest_domain_typo(dom)
+    return not (typo_fix and typo_fix != dom)
+
+
+def validate_email_single(email, profiles=None, defer_whois=False, depth=DEFAULT_VALIDATION_DEPTH, smtp_result=None):
+    """
+    Validates one address. Batch callers pass a dict of DomainProfiles keyed by
+    domain, shared across the batch, so domain-level checks run once per domain.
+    defer_whois leaves domain_age_days/is_asian_region for enrich_whois_task.
+    depth is a VALIDATION_DEPTHS key selecting which stages run.
+    smtp_result is an (is_success, code, message, banner) tuple already obtained
+    for this address (e.g. from a shared SMTP session), replacing the RCPT probe.
+    """
+    if depth not in VALIDATION_DEPTHS:
+        depth = DEFAULT_VALIDATION_DEPTH
+    stages = VALIDATION_DEPTHS[depth]
     out = {
         "email": email,
         "syntax_valid": False,
@@ -315,6 +736,7 @@ def validate_email_single(email):
         "provider": None,
         "smtp_check": "Unknown",
         "smtp_check_success": False,
+        "smtp_skipped": False,
         "has_anti_spam": False,
         "has_spf": False,
         "has_dmarc": False,
@@ -352,23 +774,28 @@ def validate_email_single(email):
         out["reason"] = "Invalid domain"
         return out
         
-    has_ms = has_mail_server(dom)
+    profile = get_domain_profile(dom, profiles, defer_whois, depth)
+
+    has_ms = profile.has_mail_server
     out["domain_valid"] = has_ms
     if not has_ms:
-        out["reason"] = "No mail server"
+        if profile.dns_error:
+            out["reason"] = f"DNS lookup failed ({profile.dns_error}), retry later"
+        else:
+            out["reason"] = "No mail server"
         return out
 
     out["is_disposable"] = is_disposable(email)
     out["is_role_based"] = is_role_based(email)
     
-    # Slow checks
-    out["domain_age_days"] = get_domain_age(dom)
-    out["provider"] = get_provider(dom)
+    # Slow checks (resolved once per domain in the profile)
+    out["domain_age_days"] = profile.domain_age_days
+    out["provider"] = profile.provider
     
-    spf_status, dmarc_status = check_dns_security(dom)
+    spf_status, dmarc_status = profile.spf_status, profile.dmarc_status
     # Map detailed status to boolean for backward compatibility/scoring
-    out["has_spf"] = spf_status != "None"
-    out["has_dmarc"] = dmarc_status != "None"
+    out["has_spf"] = spf_status not in ("None", "Unknown")
+    out["has_dmarc"] = dmarc_status not in ("None", "Unknown")
     # Store detailed info in check_message or reason if helpful? 
     # For now, just logging it into the result object if we had fields, 
     # but sticking to requirements, we just improved the *logic* of finding them.
@@ -377,11 +804,17 @@ def validate_email_single(email):
     
     out["has_anti_spam"] = out["has_spf"] or out["has_dmarc"]
     
+    # The real address may live on a subdomain with its own MX; only reuse
+    # the profile's MX list when it was resolved for the address' own domain.
+    smtp_mx_hosts = profile.mx_hosts if email.split("@")[1].lower() == dom.lower() else None
+
     # 1. Catch-All Probe
     # Only probe if not disposable and domain is valid
     is_ca = False
-    if not out["is_disposable"]:
-        is_ca = check_catch_all(dom)
+    if not out["is_disposable"] and stages["catch_all"]:
+        if profile.catch_all is None:
+            profile.catch_all = check_catch_all(dom, mx_hosts=profile.mx_hosts)
+        is_ca = profile.catch_all
         out["is_catch_all"] = is_ca
         if is_ca:
             out["catch_all"] = "Yes"
@@ -389,38 +822,39 @@ def validate_email_single(email):
     # 2. SMTP Check
     # If catch-all, we still check, but we know 250 is meaningless. 
     # But if 550, it is definitely invalid.
-    deliverable, code, msg, banner = check_smtp_detailed(email)
+    if stages["smtp"] and smtp_result is not None:
+        deliverable, code, msg, banner = smtp_result
+    elif stages["smtp"] and smtp_blocked():
+        # Don't wait out connect timeouts that can't succeed
+        deliverable, code, msg, banner = False, None, "SMTP not checked (outbound port 25 blocked)", ""
+        out["smtp_skipped"] = True
+    elif stages["smtp"]:
+        deliverable, code, msg, banner = check_smtp_detailed(email, mx_hosts=smtp_mx_hosts)
+    else:
+        deliverable, code, msg, banner = False, None, f"SMTP not checked ({depth} validation)", ""
+        out["smtp_skipped"] = True
     out["check_message"] = msg
 
 
-    # Detect Spam Filter from MX (if valid domain)
-    if has_ms:
-        try:
-            mx_records = resolver.resolve(dom, 'MX')
-            mx_start = str(mx_records[0].exchange).lower()
-            out["spam_filter"] = detect_spam_filter(mx_start, banner)
-            # Use same logic for firewall_info
-            out["firewall_info"] = detect_firewall_info(mx_start, banner)
-        except:
-             out["spam_filter"] = None
-             out["firewall_info"] = None
+    # Detect Spam Filter from MX (the banner can reveal more than the profile saw)
+    if profile.mx_host:
+        mx_start = profile.mx_host.lower()
+        out["spam_filter"] = detect_spam_filter(mx_start, banner)
+        # Use same logic for firewall_info
+        out["firewall_info"] = detect_firewall_info(mx_start, banner)
     else:
         out["spam_filter"] = None
         out["firewall_info"] = None
 
     # Spammy & Asian region detection
     out["is_spammy"] = out["is_disposable"] # Simplified for now, or add specific logic
-    try:
-        w = whois.whois(dom)
-        country = w.country
-        asian_countries = {"CN", "JP", "KR", "IN", "SG", "TH", "MY", "ID", "PH", "VN", "HK", "TW"}
-        out["is_asian_region"] = country in asian_countries if country else False
-    except Exception:
-        out["is_asian_region"] = False
+    out["is_asian_region"] = profile.is_asian_region
 
     
     # Greylisting detection (4xx codes)
-    if code and 400 <= code < 500:
+    if out["smtp_skipped"]:
+        out["smtp_check"] = "Skipped"
+    elif code and 400 <= code < 500:
         out["is_greylisted"] = True
         out["smtp_check"] = f"Greylisted ({code})"
     else:
@@ -434,7 +868,7 @@ def validate_email_single(email):
     if score >= 81:
         out["status"] = "DELIVERABLE"
         out["recommendation"] = "SEND"
-        out["reason"] = "Passed all checks"
+        out["reason"] = "Passed DNS checks (SMTP not verified)" if out["smtp_skipped"] else "Passed all checks"
     elif score >= 51:
         out["status"] = "RISKY"
         out["recommendation"] = "DO NOT SEND" # SRS default
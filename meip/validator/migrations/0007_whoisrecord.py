@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:27
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validator', '0006_emailresult_firewall_info_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WhoisRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(max_length=255, unique=True)),
+                ('creation_date', models.DateTimeField(blank=True, null=True)),
+                ('country', models.CharField(blank=True, max_length=100, null=True)),
+                ('registrar', models.CharField(blank=True, max_length=255, null=True)),
+                ('lookup_ok', models.BooleanField(default=True)),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
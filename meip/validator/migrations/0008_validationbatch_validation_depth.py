@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validator', '0007_whoisrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='validationbatch',
+            name='validation_depth',
+            field=models.CharField(choices=[('fast', 'Fast (syntax + MX)'), ('standard', 'Standard (DNS + SMTP, no WHOIS)'), ('deep', 'Deep (everything)')], default='deep', max_length=10),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validator', '0008_validationbatch_validation_depth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GreylistRetry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mx_host', models.CharField(db_index=True, max_length=255)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_code', models.IntegerField(blank=True, null=True)),
+                ('next_attempt_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('result', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='greylist_retry', to='validator.emailresult')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validator', '0009_greylistretry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='validationbatch',
+            name='max_in_flight',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:03
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def drop_duplicate_results(apps, schema_editor):
+    """Keeps the newest EmailResult per (batch, email) so the constraint can be added."""
+    EmailResult = apps.get_model('validator', 'EmailResult')
+    duplicates = (
+        EmailResult.objects.filter(batch__isnull=False)
+        .values('batch', 'email')
+        .annotate(keep=Max('id'), rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for dup in duplicates:
+        EmailResult.objects.filter(batch=dup['batch'], email=dup['email']).exclude(id=dup['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validator', '0010_validationbatch_max_in_flight'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_results, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='emailresult',
+            constraint=models.UniqueConstraint(fields=('batch', 'email'), name='unique_result_per_batch'),
+        ),
+    ]
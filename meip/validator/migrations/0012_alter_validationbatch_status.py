@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validator', '0011_emailresult_unique_result_per_batch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='validationbatch',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('PAUSED', 'Paused'), ('CANCELLED', 'Cancelled')], default='PENDING', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validator', '0012_alter_validationbatch_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='validationbatch',
+            name='run',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from datetime import timedelta
 from django.db import models
 from django.utils import timezone
 
@@ -31,11 +32,23 @@ class ValidationBatch(models.Model):
         ('PENDING', 'Pending'),
         ('PROCESSING', 'Processing'),
         ('COMPLETED', 'Completed'),
-        ('FAILED', 'Failed')
+        ('FAILED', 'Failed'),
+        ('PAUSED', 'Paused'),
+        ('CANCELLED', 'Cancelled')
     ])
     total_emails = models.IntegerField(default=0)
     processed_emails = models.IntegerField(default=0)
     current_processing_email = models.CharField(max_length=255, blank=True, null=True, default='')
+    # Stages to run, see engine.VALIDATION_DEPTHS
+    validation_depth = models.CharField(max_length=10, default='deep', choices=[
+        ('fast', 'Fast (syntax + MX)'),
+        ('standard', 'Standard (DNS + SMTP, no WHOIS)'),
+        ('deep', 'Deep (everything)')
+    ])
+    # Addresses validated concurrently per chunk; empty uses BATCH_MAX_IN_FLIGHT
+    max_in_flight = models.PositiveIntegerField(null=True, blank=True)
+    # Bumped by every process_batch_task run; chunks and the chord callback of an older run are ignored
+    run = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"Batch {self.id} - {self.created_at}"
@@ -72,5 +85,45 @@ class EmailResult(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # One result per address and batch; tasks.ResultBuffer upserts on it
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'email'], name='unique_result_per_batch'),
+        ]
+
     def __str__(self):
         return f"{self.email} ({self.status})"
+
+class GreylistRetry(models.Model):
+    """A 4xx SMTP verdict parked for re-verification by tasks.retry_greylisted_task."""
+    result = models.OneToOneField(EmailResult, on_delete=models.CASCADE, related_name='greylist_retry')
+    mx_host = models.CharField(max_length=255, db_index=True)
+    attempts = models.IntegerField(default=0) # Retries done so far
+    last_code = models.IntegerField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.result.email} via {self.mx_host} (attempt {self.attempts + 1} at {self.next_attempt_at})"
+
+class WhoisRecord(models.Model):
+    """One WHOIS fetch per domain, shared by all workers and kept across restarts."""
+    domain = models.CharField(max_length=255, unique=True)
+    creation_date = models.DateTimeField(null=True, blank=True)
+    country = models.CharField(max_length=100, blank=True, null=True)
+    registrar = models.CharField(max_length=255, blank=True, null=True)
+    lookup_ok = models.BooleanField(default=True) # False when WHOIS failed or was rate limited
+    fetched_at = models.DateTimeField(default=timezone.now)
+
+    def is_fresh(self, ttl_days, failure_ttl_hours):
+        ttl = timedelta(days=ttl_days) if self.lookup_ok else timedelta(hours=failure_ttl_hours)
+        return timezone.now() - self.fetched_at < ttl
+
+    @property
+    def age_days(self):
+        if not self.creation_date:
+            return None
+        return (timezone.now() - self.creation_date).days
+
+    def __str__(self):
+        return f"{self.domain} ({self.registrar or 'unknown registrar'})"
@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import deque
+from django.conf import settings
+
+
+class CircuitBreaker:
+    """
+    Connect health of one MX address (ip:port). Opens after MX_BREAKER_FAILURES
+    connect failures in a row; while open, connects fail fast. After
+    MX_BREAKER_COOLDOWN seconds one trial connect is let through (half-open):
+    success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, address, mx_host, window=200):
+        self.address = address
+        self.mx_host = mx_host
+        self.latencies = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.connects = 0
+        self.failures = 0
+        self.fast_failed = 0
+        self.last_error = ""
+
+    @property
+    def state(self):
+        if self.consecutive_failures < getattr(settings, 'MX_BREAKER_FAILURES', 3):
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        self.fast_failed += 1
+        return False
+
+    def record_success(self, latency):
+        self.connects += 1
+        self.latencies.append(latency)
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self, error):
+        self.connects += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error)[:200]
+        self.trial_in_flight = False
+        if self.consecutive_failures >= getattr(settings, 'MX_BREAKER_FAILURES', 3):
+            self.open_until = time.monotonic() + getattr(settings, 'MX_BREAKER_COOLDOWN', 60)
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def stats(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "address": self.address,
+            "mx_host": self.mx_host,
+            "state": self.state,
+            "connects": self.connects,
+            "failures": self.failures,
+            "fast_failed": self.fast_failed,
+            "connect_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "connect_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class BreakerRegistry:
+    """Process-wide circuit breakers, one per MX address."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def allow(self, address, mx_host):
+        with self._lock:
+            breaker = self._breakers.get(address)
+            if breaker is None:
+                breaker = self._breakers[address] = CircuitBreaker(address, mx_host)
+            return breaker.allow()
+
+    def record_success(self, address, mx_host, latency):
+        with self._lock:
+            self._breakers.setdefault(address, CircuitBreaker(address, mx_host)).record_success(latency)
+
+    def record_failure(self, address, mx_host, error):
+        with self._lock:
+            self._breakers.setdefault(address, CircuitBreaker(address, mx_host)).record_failure(error)
+
+    def stats(self):
+        """Per-address state, worst first, so slow or dead gateways show up at the top."""
+        with self._lock:
+            rows = [b.stats() for b in self._breakers.values()]
+        return sorted(rows, key=lambda r: (r["state"] == "closed", -r["failures"], -(r["connect_p95_ms"] or 0)))
+
+    def reset(self):
+        with self._lock:
+            self._breakers.clear()
+
+
+mx_breakers = BreakerRegistry()
+
+
+class MXLatency:
+    """
+    Reply latencies per MX host (banner wait and each command reply), kept for
+    the life of the worker so every batch benefits. timeout_for() turns them into
+    a socket timeout: p99 x SMTP_TIMEOUT_FACTOR clamped to [floor, ceiling], so
+    fast hosts fail fast and slow-but-legit ones (tarpits) get the time they need.
+    Until a host has SMTP_TIMEOUT_MIN_SAMPLES samples it gets the fixed
+    SMTP_TIMEOUT. Timeouts are counted, not sampled: after one, the host gets at
+    most SMTP_TIMEOUT until it answers again, so dead hosts never climb to the ceiling.
+    """
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = {}  # mx_host -> deque of seconds
+        self.timeouts = {}  # mx_host -> timeouts hit
+        self._failing = {}  # mx_host -> timeouts since its last reply
+
+    def record(self, mx_host, seconds):
+        with self._lock:
+            self._samples.setdefault(mx_host, deque(maxlen=self._window)).append(seconds)
+            self._failing.pop(mx_host, None)
+
+    def record_timeout(self, mx_host, timeout):
+        with self._lock:
+            self.timeouts[mx_host] = self.timeouts.get(mx_host, 0) + 1
+            self._failing[mx_host] = self._failing.get(mx_host, 0) + 1
+
+    def percentile(self, mx_host, pct):
+        with self._lock:
+            ordered = sorted(self._samples.get(mx_host, ()))
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def timeout_for(self, mx_host):
+        fixed = getattr(settings, 'SMTP_TIMEOUT', 5)
+        if not getattr(settings, 'SMTP_ADAPTIVE_TIMEOUTS', True):
+            return fixed
+        floor = getattr(settings, 'SMTP_TIMEOUT_FLOOR', 2)
+        ceiling = getattr(settings, 'SMTP_TIMEOUT_CEILING', 30)
+        with self._lock:
+            count = len(self._samples.get(mx_host, ()))
+            failing = self._failing.get(mx_host, 0)
+        if count < getattr(settings, 'SMTP_TIMEOUT_MIN_SAMPLES', 5):
+            return fixed
+        p99 = self.percentile(mx_host, 99)
+        learned = max(floor, min(ceiling, p99 * getattr(settings, 'SMTP_TIMEOUT_FACTOR', 3)))
+        if failing:
+            # A host that just timed out gets one fixed-length chance to answer
+            # (and so teach us it is slow), never a longer one
+            return max(learned, min(fixed, ceiling))
+        return learned
+
+    def stats(self):
+        with self._lock:
+            # Hosts that only ever timed out have no samples but belong here most
+            hosts = list(self._samples.keys() | self.timeouts.keys())
+        rows = []
+        for mx_host in hosts:
+            p50, p99 = self.percentile(mx_host, 50), self.percentile(mx_host, 99)
+            rows.append({
+                "mx_host": mx_host,
+                "samples": len(self._samples.get(mx_host, ())),
+                "reply_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "reply_p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+                "timeout_s": round(self.timeout_for(mx_host), 2),
+                "timeouts": self.timeouts.get(mx_host, 0),
+            })
+        return sorted(rows, key=lambda r: -r["timeout_s"])
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self.timeouts.clear()
+            self._failing.clear()
+
+
+mx_latency = MXLatency()
@@ -0,0 +1,101 @@
+import time
+from django.conf import settings
+from .redis_client import get_redis, mark_redis_down
+
+# Live progress of a running batch, one hash per batch. Chunk tasks add to it
+# with HINCRBY on every result flush; batch_status_api reads it, so polling
+# pages no longer hit the ValidationBatch row the workers write to.
+PROGRESS_KEY = "meip:batch:{}:progress"
+
+
+def ttl():
+    return getattr(settings, 'PROGRESS_TTL', 86400)
+
+
+def start(batch_id, total, done_by_status):
+    """Resets the counters when a batch (re)starts; done_by_status counts the results already saved."""
+    r = get_redis()
+    if r is None:
+        return False
+    key = PROGRESS_KEY.format(batch_id)
+    done = sum(done_by_status.values())
+    try:
+        pipe = r.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={"total": total, "processed": done, "base": done,
+                                "started_at": time.time(), "current_email": "",
+                                **{f"status:{status}": n for status, n in done_by_status.items()}})
+        pipe.expire(key, ttl())
+        pipe.execute()
+        return True
+    except Exception:
+        mark_redis_down()
+        return False
+
+
+def record(batch_id, emails_and_statuses):
+    """
+    Adds [(email, status)] just saved to the counters. Returns False when Redis
+    is unavailable, in which case the caller keeps the DB row up to date.
+    """
+    r = get_redis()
+    if r is None:
+        return False
+    key = PROGRESS_KEY.format(batch_id)
+    counts = {}
+    for _, status in emails_and_statuses:
+        counts[status] = counts.get(status, 0) + 1
+    try:
+        pipe = r.pipeline()
+        pipe.hincrby(key, "processed", len(emails_and_statuses))
+        for status, count in counts.items():
+            pipe.hincrby(key, f"status:{status}", count)
+        pipe.hset(key, "current_email", emails_and_statuses[-1][0])
+        pipe.expire(key, ttl())
+        pipe.execute()
+        return True
+    except Exception:
+        mark_redis_down()
+        return False
+
+
+def finish(batch_id):
+    """Clears the current address once a batch stops; the counters stay for the status API."""
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        r.hset(PROGRESS_KEY.format(batch_id), "current_email", "")
+    except Exception:
+        mark_redis_down()
+
+
+def read(batch_id):
+    """
+    {processed, total, current_email, per_status, emails_per_sec, eta_seconds}
+    from Redis, or None when there is no live progress for the batch.
+    """
+    r = get_redis()
+    if r is None:
+        return None
+    try:
+        raw = r.hgetall(PROGRESS_KEY.format(batch_id))
+    except Exception:
+        mark_redis_down()
+        return None
+    if not raw:
+        return None
+    fields = {k.decode(): v.decode() for k, v in raw.items()}
+    processed = int(fields.get("processed", 0))
+    total = int(fields.get("total", 0))
+    elapsed = time.time() - float(fields.get("started_at", time.time()))
+    # Rate of this run only; addresses saved before a resume don't count
+    rate = (processed - int(fields.get("base", 0))) / elapsed if elapsed > 0 else 0.0
+    return {
+        "processed": processed,
+        "total": total,
+        "current_email": fields.get("current_email", ""),
+        "per_status": {k.split(":", 1)[1]: int(v) for k, v in fields.items() if k.startswith("status:")},
+        "emails_per_sec": round(rate, 2),
+        "eta_seconds": round(max(0, total - processed) / rate) if rate > 0 else None,
+    }
@@ -0,0 +1,39 @@
+import time
+import redis
+from django.conf import settings
+
+# Seconds to wait before retrying after Redis was unreachable
+RETRY_AFTER = 30
+
+_client = None
+_down_until = 0.0
+
+
+def get_redis():
+    """
+    Shared Redis client for worker-side state (caches, counters, signals).
+    Returns None when Redis isn't configured or was unreachable recently, so
+    callers can fall back to in-process state without waiting on timeouts.
+    """
+    global _client, _down_until
+    url = getattr(settings, 'CACHE_REDIS_URL', '')
+    if not url or time.monotonic() < _down_until:
+        return None
+    if _client is not None:
+        return _client
+    try:
+        client = redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        client.ping()
+        _client = client
+        return _client
+    except Exception as e:
+        print(f"[!] Redis unavailable for cache ({e}). Using in-process state.")
+        mark_redis_down()
+        return None
+
+
+def mark_redis_down():
+    """Called when a command fails; stops Redis use until RETRY_AFTER passes."""
+    global _client, _down_until
+    _client = None
+    _down_until = time.monotonic() + RETRY_AFTER
@@ -0,0 +1,325 @@
+import asyncio
+import random
+import time
+from django.conf import settings
+from . import engine
+from .throttle import throttle
+from .proxy_pool import get_proxy_pool, ProxyUnavailable
+from .dns_async import prefetch_hosts
+
+
+async def read_reply(reader, timeout):
+    """Reads one (possibly multi-line) SMTP reply -> (code, message bytes), as smtplib does."""
+    lines = []
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line:
+            raise ConnectionError("Connection unexpectedly closed")
+        lines.append(line[4:].rstrip(b"\r\n"))
+        if line[3:4] != b"-":
+            try:
+                code = int(line[:3])
+            except ValueError:
+                code = -1
+            return code, b"\n".join(lines)
+
+
+async def send_command(reader, writer, line, timeout):
+    writer.write(line.encode() + b"\r\n")
+    await asyncio.wait_for(writer.drain(), timeout)
+    return await read_reply(reader, timeout)
+
+
+async def write_commands(writer, lines, timeout):
+    """Writes several command lines at once (RFC 2920 pipelining); read the replies in order after."""
+    writer.write(b"".join(line.encode() + b"\r\n" for line in lines))
+    await asyncio.wait_for(writer.drain(), timeout)
+
+
+async def greet_async(reader, writer, helo_host, timeout):
+    """EHLO (HELO if refused); True when the server advertises PIPELINING."""
+    code, msg = await send_command(reader, writer, f"EHLO {helo_host}", timeout)
+    if code != 250:
+        await send_command(reader, writer, f"HELO {helo_host}", timeout)
+        return False
+    extensions = [line.split(b" ", 1)[0].upper() for line in msg.split(b"\n")[1:]]
+    return b"PIPELINING" in extensions and getattr(settings, 'SMTP_PIPELINING', True)
+
+
+async def socks5_connect(host, port, proxy, timeout):
+    """
+    Opens a stream to host:port through a pooled SOCKS5 Proxy. Raises
+    ProxyUnavailable when the proxy itself can't be reached or refuses us.
+    """
+    user, pwd = proxy.user, proxy.pwd
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(proxy.host, proxy.port), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        raise ProxyUnavailable(f"Proxy failed: {str(e) or 'timed out'}")
+
+    async def read(n):
+        return await asyncio.wait_for(reader.readexactly(n), timeout)
+
+    try:
+        methods = b"\x00\x02" if user else b"\x00"
+        writer.write(b"\x05" + bytes([len(methods)]) + methods)
+        _, method = await read(2)
+        if method == 2:
+            u, p = user.encode(), (pwd or "").encode()
+            writer.write(b"\x01" + bytes([len(u)]) + u + bytes([len(p)]) + p)
+            _, status = await read(2)
+            if status != 0:
+                raise ProxyUnavailable("Proxy failed: SOCKS5 authentication failed")
+        elif method != 0:
+            raise ProxyUnavailable("Proxy failed: no offered SOCKS5 auth method accepted")
+
+        name = host.encode()
+        writer.write(b"\x05\x01\x00\x03" + bytes([len(name)]) + name + port.to_bytes(2, "big"))
+        head = await read(4)
+        if head[1] != 0:
+            raise ConnectionError(f"SOCKS5 connect failed (reply {head[1]})")
+        addr_len = {1: 4, 4: 16}.get(head[3]) or (await read(1))[0]
+        await read(addr_len + 2)
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+async def acquire_proxy(pool, timeout):
+    """Async pool.acquire(): polls for a free proxy slot without blocking the loop."""
+    deadline = time.monotonic() + timeout
+    while True:
+        proxy = pool.try_acquire()
+        if proxy is not None:
+            return proxy
+        if time.monotonic() >= deadline:
+            raise ProxyUnavailable("No proxy available (all down or at capacity)")
+        await asyncio.sleep(0.05)
+
+
+async def try_lease(mx_host):
+    """
+    Async throttle.try_acquire() -> (Lease or None, seconds to wait). The lease
+    check (a blocking Redis script call) runs on the default executor so it
+    never stalls the loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, throttle.try_acquire, mx_host)
+
+
+async def release_lease(lease):
+    await asyncio.get_running_loop().run_in_executor(None, lease.release)
+
+
+async def connect_mx_async(mx_hosts, addresses, proxy, timeout, lease=None):
+    """
+    Async counterpart of engine.connect_mx: first reachable MX address in
+    preference order, skipping open circuit breakers, dialed through proxy (a
+    pooled Proxy already acquired by the caller) or directly. `addresses` maps
+    each MX host to its [(ip, port)], resolved before the loop started: no DNS
+    or ORM work happens on the loop. Each host is dialed under its own throttle
+    lease, kept for the session on the host that answers; `lease` is one already
+    held for the first host with addresses. Returns (reader, writer, banner, lease).
+    """
+    errors = []
+    for mx_host in mx_hosts:
+        if not addresses.get(mx_host):
+            continue
+        if lease is None:
+            # Only a slot that is free right now: waiting here would eat into the session timeout
+            lease, _ = await try_lease(mx_host)
+            if lease is None:
+                errors.append(f"{mx_host} rate limited locally")
+                continue
+        try:
+            reader, writer, banner = await dial_mx_host(mx_host, addresses[mx_host], proxy, timeout, errors)
+        except BaseException:
+            await release_lease(lease)
+            raise
+        if writer is not None:
+            return reader, writer, banner, lease
+        await release_lease(lease)
+        lease = None
+    raise engine.MXUnavailable("; ".join(errors) or "No reachable MX address")
+
+
+async def dial_mx_host(mx_host, host_addresses, proxy, timeout, errors):
+    """(reader, writer, banner) from the first reachable address of one MX host, or (None, None, None)."""
+    for ip, port in host_addresses:
+        address = f"{ip}:{port}"
+        if not engine.mx_breakers.allow(address, mx_host):
+            errors.append(f"{address} circuit open")
+            continue
+        writer = None
+        started = time.monotonic()
+        try:
+            if proxy:
+                reader, writer = await socks5_connect(ip, port, proxy, timeout)
+            else:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+            code, connect_msg = await read_reply(reader, timeout)
+            if code != 220:
+                raise ConnectionError(f"({code}, {connect_msg!r})")
+        except ProxyUnavailable:
+            raise
+        except (OSError, asyncio.TimeoutError) as e:
+            if writer is not None:
+                writer.close()
+            if isinstance(e, asyncio.TimeoutError):
+                engine.mx_latency.record_timeout(mx_host, timeout)
+            error = str(e) or "timed out"
+            engine.mx_breakers.record_failure(address, mx_host, error)
+            errors.append(f"{address} {error}")
+            continue
+        elapsed = time.monotonic() - started
+        engine.mx_breakers.record_success(address, mx_host, elapsed)
+        engine.mx_latency.record(mx_host, elapsed)
+        return reader, writer, str(connect_msg)
+    return None, None, None
+
+
+async def check_smtp_async(email, mx_hosts, addresses, sender, pool=None, timeout=None, lease=None):
+    """
+    Async twin of engine.check_smtp_detailed, returning (is_success, code, message, banner).
+    Every connect and reply is bounded by timeout (by default the primary MX's
+    learned one). With a ProxyPool the session holds one proxy slot from connect
+    to QUIT. A throttle lease already taken for the primary MX is handed over
+    and released with the session.
+    """
+    timeout = timeout or engine.mx_latency.timeout_for(mx_hosts[0])
+    writer = None
+    proxy = None
+    try:
+        if pool is None:
+            # Capture banner (from whichever MX answered)
+            reader, writer, banner, lease = await connect_mx_async(mx_hosts, addresses, None, timeout, lease)
+        else:
+            # A proxy that is itself unreachable is marked and the next one tried
+            for attempt in range(len(pool.proxies)):
+                proxy = await acquire_proxy(pool, getattr(settings, 'PROXY_ACQUIRE_TIMEOUT', 10))
+                started = time.monotonic()
+                try:
+                    reader, writer, banner, lease = await connect_mx_async(mx_hosts, addresses, proxy, timeout, lease)
+                except ProxyUnavailable:
+                    # connect_mx_async gave the lease back
+                    lease = None
+                    pool.record(proxy)
+                    pool.release(proxy)
+                    proxy = None
+                    if attempt == len(pool.proxies) - 1:
+                        raise
+                    continue
+                pool.record(proxy, time.monotonic() - started)
+                break
+
+        if await greet_async(reader, writer, engine.helo_host_for(sender), timeout):
+            # MAIL, RCPT and QUIT in one round trip
+            await write_commands(writer, [f"MAIL FROM:<{sender}>", f"RCPT TO:<{email}>", "QUIT"], timeout)
+            await read_reply(reader, timeout)
+            code, msg = await read_reply(reader, timeout)
+            try:
+                await read_reply(reader, timeout)
+            except Exception:
+                pass
+            return code == 250, code, msg, banner
+
+        await send_command(reader, writer, f"MAIL FROM:<{sender}>", timeout)
+        code, msg = await send_command(reader, writer, f"RCPT TO:<{email}>", timeout)
+        try:
+            await send_command(reader, writer, "QUIT", timeout)
+        except Exception:
+            pass
+        return code == 250, code, msg, banner
+    except asyncio.TimeoutError:
+        return False, 999, "timed out", ""
+    except Exception as e:
+        return False, 999, str(e), ""
+    finally:
+        if writer is not None:
+            writer.close()
+        if proxy is not None:
+            pool.release(proxy)
+        if lease is not None:
+            await release_lease(lease)
+
+
+async def probe_emails(targets, addresses, senders, pool, concurrency, timeout, session_timeout):
+    """
+    targets: [(email, mx_hosts)], addresses: {mx_host: [(ip, port)]}. At most
+    `concurrency` sessions are open at once, and each one holds a
+    per-MX/per-provider throttle lease. A throttled address gives its slot back
+    while it waits, so other MX hosts keep the slots busy; after
+    SMTP_THROTTLE_MAX_WAIT it is reported as a local 421, like check_smtp_detailed.
+    session_timeout only starts once the lease is held.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    max_wait = getattr(settings, 'SMTP_THROTTLE_MAX_WAIT', 30)
+
+    async def probe(email, mx_hosts):
+        primary = next((mx_host for mx_host in mx_hosts if addresses.get(mx_host)), None)
+        deadline = time.monotonic() + max_wait
+        while True:
+            async with semaphore:
+                lease = wait = None
+                if primary is not None:
+                    lease, wait = await try_lease(primary)
+                if lease is not None or primary is None:
+                    try:
+                        result = await asyncio.wait_for(check_smtp_async(
+                            email, mx_hosts, addresses, random.choice(senders), pool, timeout, lease
+                        ), session_timeout)
+                    except asyncio.TimeoutError:
+                        result = (False, 999, "session timed out", "")
+                        if lease is not None:
+                            # A session cancelled before it started never released its lease
+                            await release_lease(lease)
+                    return email, result
+            if time.monotonic() + wait > deadline:
+                return email, (False, 421, f"Rate limited locally for {primary}", "")
+            await asyncio.sleep(wait)
+
+    return dict(await asyncio.gather(*(probe(email, mx_hosts) for email, mx_hosts in targets)))
+
+
+def check_smtp_many(emails, concurrency=None, timeout=None, session_timeout=None):
+    """
+    Probes all addresses concurrently on one event loop and returns
+    {email: (is_success, code, message, banner)}. MX hosts come from the engine's
+    DNS cache, so prefetch_domains() first for large lists. Call from sync code:
+    senders, the proxy pool and MX addresses are all looked up before the loop starts.
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, 'SMTP_ASYNC_CONCURRENCY', 1000)
+    if session_timeout is None:
+        session_timeout = getattr(settings, 'SMTP_ASYNC_SESSION_TIMEOUT', 20)
+
+    senders = engine.get_smtp_senders()
+    if not senders:
+        return {email: (False, 999, "Configuration Error: No Senders", "") for email in emails}
+    pool = get_proxy_pool()
+
+    results = {}
+    targets = []
+    for email in emails:
+        try:
+            mx_hosts = engine.get_mx_hosts(email.split("@")[1])
+        except Exception as e:
+            results[email] = (False, 999, str(e), "")
+            continue
+        if mx_hosts:
+            targets.append((email, mx_hosts))
+        else:
+            results[email] = (False, 999, "No MX records found", "")
+
+    if targets:
+        started = time.monotonic()
+        # Address lookups go through the DNS cache and upstream pool (Redis, ORM):
+        # do them all here, concurrently, rather than blocking the event loop
+        mx_hosts = sorted({mx_host for _, hosts in targets for mx_host in hosts})
+        prefetch_hosts(mx_hosts)
+        addresses = {mx_host: engine.mx_addresses(mx_host) for mx_host in mx_hosts}
+        results.update(asyncio.run(probe_emails(
+            targets, addresses, senders, pool, max(1, concurrency), timeout, session_timeout
+        )))
+        print(f"[-] Async SMTP: {len(targets)} probes in {time.monotonic() - started:.1f}s")
+    return results
@@ -0,0 +1,304 @@
+import itertools
+import smtplib
+import socket
+import time
+import uuid
+from collections import defaultdict, deque
+from django.conf import settings
+from .engine import (get_mx_hosts, prepare_smtp_sender, helo_host_for, base_domain, is_disposable,
+                     is_smtp_candidate, get_domain_profile, get_cached_catch_all, store_catch_all,
+                     connect_mx, greet, send_commands, MXUnavailable, VALIDATION_DEPTHS, DNS_TRANSIENT_ERRORS)
+from .mx_health import mx_latency
+from .throttle import throttle
+
+# Errors that mean the session is gone and has to be re-established
+SESSION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, socket.timeout, socket.error)
+
+
+class MXThrottled(Exception):
+    """Every MX left in iter_session_results() is over its throttle budget for `wait` more seconds."""
+
+    def __init__(self, wait):
+        super().__init__(f"MX throttled for {wait:.2f}s")
+        self.wait = wait
+
+
+class SMTPSessionProber:
+    """
+    Verifies many addresses hosted on one MX over a single SMTP session:
+    EHLO and MAIL FROM once, then one RCPT TO per address. When the server
+    advertises PIPELINING, RSET/MAIL FROM and up to pipeline_depth RCPTs go out
+    in one write. After max_rcpt recipients (or a 452 "too many recipients")
+    the transaction is RSET and restarted. Dropped sessions are reconnected
+    transparently, failing over to lower-priority MX hosts when mx_hosts lists several.
+    """
+
+    def __init__(self, mx_hosts, sender, timeout=None, max_rcpt=None, max_reconnects=None, pipeline_depth=None):
+        self.mx_hosts = [mx_hosts] if isinstance(mx_hosts, str) else list(mx_hosts)
+        self.sender = sender
+        self.helo_host = helo_host_for(sender)
+        self.timeout = timeout  # None: per-MX learned timeout (mx_latency)
+        self.max_rcpt = max_rcpt or getattr(settings, 'SMTP_SESSION_MAX_RCPT', 50)
+        self.max_reconnects = max_reconnects if max_reconnects is not None else getattr(settings, 'SMTP_SESSION_MAX_RECONNECTS', 3)
+        self.pipeline_depth = pipeline_depth or getattr(settings, 'SMTP_PIPELINE_DEPTH', 20)
+        self.server = None
+        self.banner = ""
+        self.mx_host = None
+        self.pipelining = False
+        self.txn_commands = []  # RSET / MAIL FROM still to be sent before the next RCPTs
+        self.rcpt_in_txn = 0
+        self.connects = 0
+
+    def _connect(self):
+        self.close()
+        self.connects += 1
+        # Capture banner
+        server, self.banner, self.mx_host = connect_mx(self.mx_hosts, self.timeout)
+        self.server = server
+        self.pipelining = greet(server, self.helo_host)
+        self._start_transaction(reset=False)
+
+    def _start_transaction(self, reset=True):
+        # Sent lazily with the next RCPTs, so a pipelining server sees them in the same write
+        self.txn_commands = (["RSET"] if reset else []) + [f"MAIL FROM:{smtplib.quoteaddr(self.sender)}"]
+        self.rcpt_in_txn = 0
+
+    def _reset_transaction(self):
+        self._start_transaction(reset=True)
+
+    def _rcpt_batch(self, emails):
+        """
+        Pending RSET/MAIL FROM plus RCPT TO for each address. Returns [(code, msg)]
+        for the leading addresses that got an answer: if the server hangs up part
+        way through a pipelined batch the session is closed and the rest stay pending.
+        """
+        prefix = self.txn_commands
+        self.txn_commands = []
+        commands = prefix + [f"RCPT TO:{smtplib.quoteaddr(email)}" for email in emails]
+        replies = []
+        waited_from = time.monotonic()
+        try:
+            for line, (code, msg) in zip(commands, send_commands(self.server, commands, self.pipelining)):
+                # Each reply's wait feeds this MX's latency histogram (and so its timeout)
+                now = time.monotonic()
+                mx_latency.record(self.mx_host, now - waited_from)
+                waited_from = now
+                if line.startswith("MAIL") and code != 250:
+                    raise smtplib.SMTPSenderRefused(code, msg, self.sender)
+                replies.append((code, msg))
+        except SESSION_ERRORS as e:
+            if isinstance(e, socket.timeout):
+                mx_latency.record_timeout(self.mx_host, self.server.timeout)
+            if len(replies) <= len(prefix):
+                raise
+            self.close()
+        return replies[len(prefix):]
+
+    def probe(self, emails):
+        """Returns {email: (is_success, code, message, banner)} for every address."""
+        results = {}
+        pending = deque(emails)
+        failures = 0
+        limit_retried = set()
+
+        while pending:
+            if not pending[0].isascii():
+                # Can't go on the wire without SMTPUTF8; would break a pipelined write
+                results[pending.popleft()] = (False, 999, "Non-ASCII address", self.banner)
+                continue
+            batch = [pending[0]]
+            try:
+                if self.server is None:
+                    self._connect()
+                elif self.rcpt_in_txn >= self.max_rcpt:
+                    self._reset_transaction()
+
+                if self.pipelining:
+                    room = min(self.max_rcpt - self.rcpt_in_txn, self.pipeline_depth)
+                    for email in itertools.islice(pending, 1, None):
+                        if len(batch) >= room or not email.isascii():
+                            break
+                        batch.append(email)
+
+                replies = self._rcpt_batch(batch)
+                retry = []
+                limit_hit = False
+                for email, (code, msg) in zip(batch, replies):
+                    if code == 452 and self.rcpt_in_txn > 0 and email not in limit_retried:
+                        # Per-transaction recipient limit hit: learn it and retry in a fresh transaction
+                        limit_retried.add(email)
+                        if not limit_hit:
+                            self.max_rcpt = max(1, self.rcpt_in_txn)
+                            limit_hit = True
+                        retry.append(email)
+                        continue
+                    self.rcpt_in_txn += 1
+                    results[email] = (code == 250, code, msg, self.banner)
+
+                for _ in replies:
+                    pending.popleft()
+                pending.extendleft(reversed(retry))
+                if limit_hit and self.server is not None:
+                    self._reset_transaction()
+                failures = 0
+            except MXUnavailable as e:
+                # Every MX is down or circuit-open; reconnecting now would not help
+                self.close()
+                for rest in pending:
+                    results[rest] = (False, 999, str(e), self.banner)
+                break
+            except SESSION_ERRORS as e:
+                # Addresses whose replies were lost are asked again on the new session
+                self.close()
+                failures += 1
+                if failures > self.max_reconnects:
+                    for rest in pending:
+                        results[rest] = (False, 999, str(e), self.banner)
+                    break
+            except Exception as e:
+                # Session state is unknown after an unexpected error; start over
+                self.close()
+                results[batch[0]] = (False, 999, str(e), self.banner)
+                pending.popleft()
+
+        self.quit()
+        return results
+
+    def quit(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self.close()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+        self.server = None
+
+
+def group_by_mx(emails):
+    """
+    Groups addresses by the MX hosts of their own domain (from the DNS cache).
+    Returns ({(mx_host, ...): [emails]}, [emails without a usable MX]); the key
+    is in preference order, so key[0] is the primary.
+    """
+    groups = defaultdict(list)
+    ungrouped = []
+    for email in emails:
+        try:
+            mx_hosts = get_mx_hosts(email.split("@")[1])
+        except (IndexError, *DNS_TRANSIENT_ERRORS):
+            mx_hosts = []
+        if mx_hosts:
+            groups[tuple(mx.lower() for mx in mx_hosts)].append(email)
+        else:
+            ungrouped.append(email)
+    return groups, ungrouped
+
+
+def catch_all_probe_address(domain):
+    return f"verify_{uuid.uuid4().hex[:8]}@{domain}"
+
+
+def probe_mx_group(mx_hosts, emails, catch_all_domains=()):
+    """
+    Probes `emails` on mx_hosts (primary first) in one session, plus one random address per
+    domain in catch_all_domains. Returns ({email: smtp_result}, {domain: is_catch_all});
+    definitive catch-all verdicts are also written to the shared cache.
+    """
+    sender = prepare_smtp_sender()
+    if sender is None:
+        failed = (False, 999, "Configuration Error: No Senders", "")
+        return {email: failed for email in emails}, {}
+
+    probes = {catch_all_probe_address(dom): dom for dom in catch_all_domains}
+    results = SMTPSessionProber(mx_hosts, sender).probe(list(probes) + list(emails))
+    catch_all = {}
+    for addr, dom in probes.items():
+        if addr in results:
+            catch_all[dom] = results[addr][0]
+            store_catch_all(dom, results[addr][1])
+    return {email: results[email] for email in emails if email in results}, catch_all
+
+
+def chunk_catch_all_domains(mx_host, chunk, profiles, defer_whois, depth):
+    """Domains in chunk hosted on mx_host whose catch-all status is still unknown."""
+    domains = set()
+    for email in chunk:
+        dom = base_domain(email)
+        profile = get_domain_profile(dom, profiles, defer_whois, depth)
+        if profile.catch_all is None:
+            profile.catch_all = get_cached_catch_all(dom)
+        if (profile.catch_all is None and profile.mx_host and profile.mx_host.lower() == mx_host
+                and not is_disposable(email)):
+            domains.add(dom)
+    return domains
+
+
+def iter_session_results(emails, profiles, defer_whois=False, depth="deep", wait_throttled=True):
+    """
+    Yields (email, smtp_result) for every address, ordered so that each chunk of
+    SMTP_SESSION_CHUNK addresses on the same MX is verified in one session (with
+    that chunk's catch-all probes). smtp_result is None for addresses that never
+    reach the SMTP stage; validate_email_single handles those itself.
+
+    Sessions go through the shared per-MX/per-provider throttle: a chunk whose MX
+    is over its budget is set aside and chunks for other MX hosts run meanwhile.
+    When all of them are throttled it sleeps, or with wait_throttled=False raises
+    MXThrottled so the caller can run other work; the addresses not yet yielded
+    are left for it to retry.
+    """
+    stages = VALIDATION_DEPTHS[depth]
+    if not stages['smtp']:
+        for email in emails:
+            yield email, None
+        return
+
+    candidates = [e for e in emails if is_smtp_candidate(e)]
+    candidate_set = set(candidates)
+    groups, ungrouped = group_by_mx(candidates)
+    chunk_size = getattr(settings, 'SMTP_SESSION_CHUNK', 100)
+
+    # (not_before, mx_hosts, chunk); chunks are interleaved across MX hosts
+    pending = deque()
+    for mx_hosts, group in groups.items():
+        for i in range(0, len(group), chunk_size):
+            pending.append((0.0, mx_hosts, group[i:i + chunk_size]))
+
+    while pending:
+        now = time.monotonic()
+        ready = next((item for item in pending if item[0] <= now), None)
+        if ready is None:
+            # Every remaining MX is throttled; wait for the earliest one
+            wait = max(0.0, min(item[0] for item in pending) - now)
+            if not wait_throttled:
+                raise MXThrottled(wait)
+            time.sleep(wait)
+            continue
+        pending.remove(ready)
+        _, mx_hosts, chunk = ready
+
+        lease, wait = throttle.try_acquire(mx_hosts[0])
+        if lease is None:
+            pending.append((time.monotonic() + wait, mx_hosts, chunk))
+            continue
+        with lease:
+            catch_all_domains = set()
+            if stages['catch_all']:
+                catch_all_domains = chunk_catch_all_domains(mx_hosts[0], chunk, profiles, defer_whois, depth)
+            results, catch_all = probe_mx_group(mx_hosts, chunk, catch_all_domains)
+        for dom, is_ca in catch_all.items():
+            profiles[dom].catch_all = is_ca
+        for email in chunk:
+            yield email, results.get(email)
+
+    for email in ungrouped:
+        yield email, None
+    for email in emails:
+        if email not in candidate_set:
+            yield email, None
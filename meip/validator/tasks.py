@@ -1,22 +1,317 @@
-from celery import shared_task
-from .models import ValidationBatch, EmailResult
-from .engine import validate_email_single
+from celery import shared_task, chord
+from celery.signals import worker_ready
+from .models import ValidationBatch, EmailResult, GreylistRetry
+from .engine import (validate_email_single, base_domain, dns_cache, get_stored_whois_record,
+                     get_whois_record, is_asian_country, VALIDATION_DEPTHS, DEFAULT_VALIDATION_DEPTH)
+from .dns_async import prefetch_domains
+from .smtp_session import iter_session_results, probe_mx_group, group_by_mx, MXThrottled
+from .throttle import throttle
+from .egress import smtp_blocked, egress_status, start_preflight_loop
+from .batch_control import BatchControl, send_signal, clear_signal, PAUSE, CANCEL
+from . import progress
+from .cache import TTLCache
 import pandas as pd
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+from datetime import timedelta
 from django.conf import settings
+from django.db import connections
+from django.db.models import Count, F
+from django.utils import timezone
+
+# Guards against queueing several retry runs for the same minute
+greylist_schedule = TTLCache("greylist", max_entries=1000)
+
+
+def result_fields(res):
+    """EmailResult column values for a validate_email_single() result."""
+    return {
+        'normalized_email': res['email'],
+        'syntax_valid': res['syntax_valid'],
+        'domain_valid': res['domain_valid'],
+        'is_disposable': res['is_disposable'],
+        'is_role_based': res['is_role_based'],
+        'catch_all': res['catch_all'],
+        'domain_age_days': res['domain_age_days'],
+        'provider': res['provider'],
+        'smtp_check': res['smtp_check'],
+        'check_message': res.get('check_message', ''),
+        'has_anti_spam': res['has_anti_spam'],
+        'has_spf': res.get('has_spf', False),
+        'has_dmarc': res.get('has_dmarc', False),
+        'firewall_info': res.get('firewall_info'),
+        'is_spammy': res.get('is_spammy', False),
+        'is_asian_region': res.get('is_asian_region', False),
+        'bounce_history': res['bounce_history'],
+        'rtpc_score': res['rtpc_score'],
+        'status': res['status'],
+        'recommendation': res['recommendation'],
+        'reason': res['reason']
+    }
+
+
+def greylist_retry_delay(attempts):
+    """Seconds until the next retry: the greylist window, doubled per retry already made."""
+    window = getattr(settings, 'GREYLIST_RETRY_WINDOW', 300)
+    factor = getattr(settings, 'GREYLIST_BACKOFF_FACTOR', 2)
+    return min(getattr(settings, 'GREYLIST_MAX_DELAY', 3600), window * factor ** attempts)
+
+
+def park_greylisted(result, res, profiles):
+    """Queues a 4xx EmailResult for retry on its domain's MX. Returns False if it has no MX."""
+    profile = profiles.get(base_domain(result.email))
+    if profile is None or not profile.mx_host:
+        return False
+    code = res['smtp_check'].split('(')[-1].rstrip(')')
+    GreylistRetry.objects.update_or_create(result=result, defaults={
+        'mx_host': profile.mx_host.lower(),
+        'attempts': 0,
+        'last_code': int(code) if code.isdigit() else None,
+        'next_attempt_at': timezone.now() + timedelta(seconds=greylist_retry_delay(0)),
+    })
+    EmailResult.objects.filter(pk=result.pk).update(reason="Greylisted, retry scheduled")
+    return True
+
+
+def schedule_greylist_retries():
+    """Queues retry_greylisted_task for the earliest parked retry (at most one run per minute)."""
+    first = GreylistRetry.objects.order_by('next_attempt_at').first()
+    if first is None:
+        return
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        # A countdown would run inline right now; leave the retries for a real worker
+        print("[-] Greylist retries parked; start a Celery worker to run them")
+        return
+    countdown = max(1, (first.next_attempt_at - timezone.now()).total_seconds())
+    slot = f"eta:{int(first.next_attempt_at.timestamp() // 60)}"
+    if greylist_schedule.claim(slot, countdown + 60):
+        retry_greylisted_task.apply_async(kwargs={'slot': slot}, countdown=countdown)
+
+
+class ResultBuffer:
+    """
+    Collects a chunk's results and writes them with one bulk upsert on
+    (batch, email) per RESULT_BUFFER_SIZE results or RESULT_FLUSH_SECONDS,
+    instead of an update_or_create per address. A crash loses at most the
+    unflushed results, which resume simply validates again. Live progress goes
+    to Redis on every flush; the batch row's counters only every
+    PROGRESS_CHECKPOINT_SECONDS and on close() (every flush without Redis).
+    """
+
+    def __init__(self, batch, profiles, size=None, interval=None):
+        self.batch = batch
+        self.profiles = profiles
+        self.size = size or getattr(settings, 'RESULT_BUFFER_SIZE', 200)
+        self.interval = interval if interval is not None else getattr(settings, 'RESULT_FLUSH_SECONDS', 2)
+        self.pending = {}
+        self.flushed_at = self.checkpointed_at = time.monotonic()
+        self.parked = 0
+        # Saved but not yet added to batch.processed_emails
+        self.uncounted = 0
+        self.last_email = None
+
+    def add(self, email, res):
+        self.pending[email] = res
+        if len(self.pending) >= self.size or time.monotonic() - self.flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered results; returns how many."""
+        self.flushed_at = time.monotonic()
+        if not self.pending:
+            return 0
+        pending, self.pending = self.pending, {}
+        rows = [EmailResult(batch=self.batch, email=email, **result_fields(res)) for email, res in pending.items()]
+        EmailResult.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['batch', 'email'],
+            update_fields=list(result_fields(next(iter(pending.values()))))
+        )
+        greylisted = [row for row in rows if pending[row.email]['is_greylisted']]
+        if greylisted and any(row.pk is None for row in greylisted):
+            # Backends without RETURNING on upserts leave pk unset
+            ids = dict(EmailResult.objects.filter(batch=self.batch, email__in=[r.email for r in greylisted])
+                       .values_list('email', 'id'))
+            for row in greylisted:
+                row.pk = ids[row.email]
+        for row in greylisted:
+            if park_greylisted(row, pending[row.email], self.profiles):
+                self.parked += 1
+        self.uncounted += len(rows)
+        self.last_email = rows[-1].email
+        live = progress.record(self.batch.id, [(row.email, row.status) for row in rows])
+        if not live or time.monotonic() - self.checkpointed_at >= getattr(settings, 'PROGRESS_CHECKPOINT_SECONDS', 30):
+            self.checkpoint()
+        return len(rows)
+
+    def checkpoint(self):
+        self.checkpointed_at = time.monotonic()
+        if not self.uncounted:
+            return
+        # Other chunks add to the same counter
+        ValidationBatch.objects.filter(pk=self.batch.pk).update(
+            processed_emails=F('processed_emails') + self.uncounted, current_processing_email=self.last_email)
+        self.uncounted = 0
+
+    def close(self):
+        self.flush()
+        self.checkpoint()
+
+
+class EgressBlocked(Exception):
+    """Port 25 egress is blocked and EGRESS_BLOCKED_ACTION is 'pause'."""
+
+
+def iter_batch_results(emails, profiles, defer_whois, depth, wait_throttled=True):
+    """
+    iter_session_results() that follows the egress preflight: once port 25 is
+    reported blocked, the remaining addresses continue DNS-only (depth 'dns'),
+    or EgressBlocked is raised when EGRESS_BLOCKED_ACTION is 'pause', instead
+    of every address waiting out its SMTP timeouts. Yields (email, smtp_result, depth).
+    """
+    pending = list(emails)
+    while pending:
+        if VALIDATION_DEPTHS[depth]['smtp'] and smtp_blocked():
+            if getattr(settings, 'EGRESS_BLOCKED_ACTION', 'pause') != 'dns_only':
+                raise EgressBlocked(egress_status()['state'])
+            print("[!] SMTP egress blocked, continuing DNS-only")
+            depth = 'dns'
+        done = set()
+        interrupted = False
+        for email, smtp_result in iter_session_results(pending, profiles, defer_whois, depth, wait_throttled):
+            if VALIDATION_DEPTHS[depth]['smtp'] and smtp_blocked():
+                interrupted = True
+                break
+            done.add(email)
+            yield email, smtp_result, depth
+        if not interrupted:
+            return
+        pending = [e for e in pending if e not in done]
+
+
+def iter_validated(emails, profiles, defer_whois, depth, in_flight, stop_requested=None):
+    """
+    Validates addresses with up to `in_flight` running at once and yields
+    (email, result) as each one finishes. The unit of work is one SMTP session:
+    addresses are grouped by MX and cut into SMTP_SESSION_CHUNK pieces, which
+    pool threads take from one shared queue and run through iter_batch_results().
+    A unit whose MX is throttled goes back on the queue until its wait is over,
+    so the threads work on other MX hosts meanwhile instead of sleeping. Closing
+    the generator (pause), or stop_requested() turning true while waiting for
+    results, lets every thread finish its current session and drops the results
+    not yet yielded; they were never saved, so resume picks them up.
+    """
+    def validate(unit, stop=None, wait_throttled=True):
+        for email, smtp_result, unit_depth in iter_batch_results(unit, profiles, defer_whois, depth, wait_throttled):
+            if stop is not None and stop.is_set():
+                return
+            yield email, validate_email_single(email, profiles=profiles, defer_whois=defer_whois,
+                                               depth=unit_depth, smtp_result=smtp_result)
+
+    groups, ungrouped = group_by_mx(emails)
+    size = getattr(settings, 'SMTP_SESSION_CHUNK', 100)
+    units = [group[i:i + size] for group in groups.values() for i in range(0, len(group), size)]
+    units += [ungrouped[i:i + size] for i in range(0, len(ungrouped), size)]
+    if in_flight <= 1 or len(units) <= 1:
+        yield from validate(emails)
+        return
+
+    finished = queue.Queue()
+    stop = threading.Event()
+    # (not_before, unit) not yet taken by a thread; `running` counts the units
+    # being worked on, which may come back throttled
+    pending = deque((0.0, unit) for unit in units)
+    running = 0
+    changed = threading.Condition()
+
+    def next_unit():
+        nonlocal running
+        with changed:
+            while not stop.is_set():
+                now = time.monotonic()
+                ready = next((item for item in pending if item[0] <= now), None)
+                if ready is not None:
+                    pending.remove(ready)
+                    running += 1
+                    return ready[1]
+                if not pending and not running:
+                    return None
+                # Nothing ready: every unit left is throttled, or still running elsewhere
+                changed.wait(min((item[0] for item in pending), default=now + 1) - now)
+            return None
+
+    def work():
+        nonlocal running
+        try:
+            while True:
+                unit = next_unit()
+                if unit is None:
+                    return
+                done = set()
+                wait = None
+                try:
+                    for email, res in validate(unit, stop, wait_throttled=False):
+                        done.add(email)
+                        finished.put((email, res))
+                except MXThrottled as e:
+                    wait = e.wait
+                finally:
+                    with changed:
+                        running -= 1
+                        if wait is not None:
+                            pending.append((time.monotonic() + wait, [e for e in unit if e not in done]))
+                        changed.notify_all()
+        finally:
+            # Pool threads get their own DB connections (WHOIS records, config snapshot)
+            connections.close_all()
+
+    pool = ThreadPoolExecutor(max_workers=min(in_flight, len(units)), thread_name_prefix="batch")
+    futures = [pool.submit(work) for _ in range(min(in_flight, len(units)))]
+    try:
+        while True:
+            try:
+                yield finished.get(timeout=0.1)
+                continue
+            except queue.Empty:
+                if stop_requested is not None and stop_requested():
+                    return
+            for future in futures:
+                if future.done() and future.exception() is not None:
+                    raise future.exception()
+            if all(future.done() for future in futures) and finished.empty():
+                return
+    finally:
+        stop.set()
+        with changed:
+            changed.notify_all()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+@worker_ready.connect
+def egress_preflight_on_startup(**kwargs):
+    # Check the egress path once at startup, then periodically in the background
+    start_preflight_loop()
+
 
 @shared_task
 def process_batch_task(batch_id):
     print(f"[-] RECEIVED TASK for Batch ID: {batch_id}")
     try:
         batch = ValidationBatch.objects.get(id=batch_id)
-        batch.status = 'PROCESSING'
-        batch.save()
+        # A new run: chunks still queued from an earlier one (e.g. before a pause) become no-ops
+        ValidationBatch.objects.filter(pk=batch.pk).update(status='PROCESSING', run=F('run') + 1)
+        batch.refresh_from_db(fields=['status', 'run'])
+        run = batch.run
+        # A pause from the previous run must not stop this one
+        clear_signal(batch.id)
         
         file_path = batch.csv_file.path
         if not os.path.exists(file_path):
              batch.status = 'FAILED'
-             batch.save()
+             batch.save(update_fields=['status'])
              return "File not found"
              
         df = pd.read_csv(file_path)
@@ -27,84 +322,320 @@ def process_batch_task(batch_id):
         email_col = next((c for c in df.columns if c.lower() == 'email'), None)
         if not email_col:
             batch.status = 'FAILED'
-            batch.save()
+            batch.save(update_fields=['status'])
             return "No Email column found"
             
         emails = df[email_col].dropna().unique().tolist()
         batch.total_emails = len(emails)
-        batch.save()
+        batch.save(update_fields=['total_emails'])
         
         # RESUME LOGIC: Filter out emails already processed for this batch
         processed_emails_list = set(EmailResult.objects.filter(batch=batch).values_list('email', flat=True))
         emails_to_process = [e for e in emails if e not in processed_emails_list]
         
-        print(f"[-] Resuming Batch {batch.id}. Total: {len(emails)}. Already Done: {len(processed_emails_list)}. To Do: {len(emails_to_process)}")
+        print(f"[-] Resuming Batch {batch.id} ({batch.validation_depth}). Total: {len(emails)}. Already Done: {len(processed_emails_list)}. To Do: {len(emails_to_process)}")
         
-        processed_count = len(processed_emails_list)
-        results_objs = []
-        
-        for email in emails_to_process:
-            # CHECK PAUSE
-            batch.refresh_from_db()
-            if batch.status == 'PAUSED':
-                print(f"[-] Batch {batch.id} PAUSED by user.")
-                # Save any pending buffer
-                if results_objs:
-                    EmailResult.objects.bulk_create(results_objs)
-                return "Paused"
-
-            print(f"    > Verifying: {email}")
-            
-            # Update current email status
-            batch.current_processing_email = email
-            batch.save(update_fields=['current_processing_email'])
+        depth = batch_depth(batch)
+        if VALIDATION_DEPTHS[depth]['smtp'] and smtp_blocked() and \
+                getattr(settings, 'EGRESS_BLOCKED_ACTION', 'pause') != 'dns_only':
+            pause_for_egress(batch, egress_status()['state'])
+            return "Paused"
+
+        batch.processed_emails = len(processed_emails_list)
+        batch.save(update_fields=['processed_emails'])
+        progress.start(batch.id, len(emails), dict(
+            EmailResult.objects.filter(batch=batch).values_list('status').annotate(n=Count('id'))))
+
+        # Fan out: chunks grouped by domain, validated by as many workers as are running;
+        # finalize_batch_task runs once every chunk is done
+        chunks = chunk_by_domain(emails_to_process, getattr(settings, 'BATCH_CHUNK_SIZE', 2000))
+        if not chunks:
+            return finalize_batch_task([], batch.id, run)
+        print(f"[-] Batch {batch.id}: {len(emails_to_process)} addresses in {len(chunks)} chunks")
+        if not getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+            try:
+                chord(process_chunk_task.s(batch.id, chunk, run) for chunk in chunks)(finalize_batch_task.s(batch.id, run))
+                return f"Dispatched {len(chunks)} chunks"
+            except Exception as e:
+                print(f"[!] Chunk dispatch failed ({e}). Processing chunks synchronously.")
+        # No broker: same chunks, one after another in this process
+        return finalize_batch_task([process_chunk_task(batch.id, chunk, run) for chunk in chunks], batch.id, run)
 
-            res = validate_email_single(email)
-            
-            # Save result
-            # Save result (Idempotent)
-            er, created = EmailResult.objects.update_or_create(
-                batch=batch,
-                email=email,
-                defaults={
-                    'normalized_email': res['email'],
-                    'syntax_valid': res['syntax_valid'],
-                    'domain_valid': res['domain_valid'],
-                    'is_disposable': res['is_disposable'],
-                    'is_role_based': res['is_role_based'],
-                    'catch_all': res['catch_all'],
-                    'domain_age_days': res['domain_age_days'],
-                    'provider': res['provider'],
-                    'smtp_check': res['smtp_check'],
-                    'check_message': res.get('check_message', ''), 
-                    'has_anti_spam': res['has_anti_spam'],
-                    'has_spf': res.get('has_spf', False),
-                    'has_dmarc': res.get('has_dmarc', False),
-                    'firewall_info': res.get('firewall_info'),
-                    'is_spammy': res.get('is_spammy', False),
-                    'is_asian_region': res.get('is_asian_region', False),
-                    'bounce_history': res['bounce_history'],
-                    'rtpc_score': res['rtpc_score'],
-                    'status': res['status'],
-                    'recommendation': res['recommendation'],
-                    'reason': res['reason']
-                }
-            ) 
-            processed_count += 1
-            
-            # Update batch progress periodically
-            if processed_count % 5 == 0:
-                batch.processed_emails = processed_count
-                batch.save(update_fields=['processed_emails'])
-        
-        batch.processed_emails = processed_count
-        batch.status = 'COMPLETED'
-        batch.current_processing_email = "" # Clear on completion
-        batch.save()
-        
     except Exception as e:
         print(f"[!] BATCH TASK ERROR: {e}")
         if 'batch' in locals():
             batch.status = 'FAILED'
-            batch.save()
+            batch.save(update_fields=['status'])
         return str(e)
+
+
+def batch_depth(batch):
+    return batch.validation_depth if batch.validation_depth in VALIDATION_DEPTHS else DEFAULT_VALIDATION_DEPTH
+
+
+def pause_for_egress(batch, state):
+    print(f"[!] Batch {batch.id} PAUSED: SMTP egress {state}")
+    send_signal(batch.id, PAUSE)
+    ValidationBatch.objects.filter(pk=batch.pk).update(
+        status='PAUSED', current_processing_email="Paused: outbound SMTP (port 25) blocked, see System Health")
+
+
+def chunk_by_domain(emails, size):
+    """
+    Splits addresses into chunks of at most `size`, keeping each domain's
+    addresses together (a domain larger than `size` spans several chunks) so
+    a chunk shares domain profiles and SMTP sessions as much as possible.
+    """
+    by_domain = defaultdict(list)
+    for email in emails:
+        by_domain[base_domain(str(email)) or ""].append(email)
+    chunks, current = [], []
+    for dom in sorted(by_domain):
+        addresses = by_domain[dom]
+        if current and len(current) + len(addresses) > size:
+            chunks.append(current)
+            current = []
+        while len(addresses) > size:
+            chunks.append(addresses[:size])
+            addresses = addresses[size:]
+        current += addresses
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+@shared_task
+def process_chunk_task(batch_id, emails, run=None):
+    """
+    Validates one chunk of a batch. Returns {"status", "processed", "parked"} for
+    finalize_batch_task; status is "paused" if the batch was paused before or
+    while the chunk ran (the rest is picked up on resume), "cancelled" likewise
+    for cancel_batch, "stale" when the batch was restarted since this chunk was
+    queued (the newer run covers its addresses), "failed" on errors.
+    """
+    outcome = {"status": "done", "processed": 0, "parked": 0}
+    stopped = {PAUSE: "paused", CANCEL: "cancelled"}
+    try:
+        batch = ValidationBatch.objects.get(id=batch_id)
+        if run is not None and batch.run != run:
+            outcome["status"] = "stale"
+            return outcome
+        if batch.status in ('PAUSED', 'CANCELLED'):
+            outcome["status"] = "cancelled" if batch.status == 'CANCELLED' else "paused"
+            return outcome
+        control = BatchControl(batch.id, run=batch.run)
+
+        depth = batch_depth(batch)
+        stages = VALIDATION_DEPTHS[depth]
+
+        # Resolve DNS for every unique domain concurrently before any SMTP work
+        try:
+            prefetch_domains({base_domain(str(e)) for e in emails}, dns_security=stages['dns_security'])
+        except Exception as e:
+            print(f"[!] DNS prefetch failed ({e}). Falling back to on-demand lookups.")
+
+        # Domain profiles shared by every address of the same domain in this chunk
+        domain_profiles = {}
+        results = ResultBuffer(batch, domain_profiles)
+        # WHOIS doesn't affect the score; optionally fill it in later from the 'whois' queue
+        defer_whois = stages['whois'] and getattr(settings, 'WHOIS_DEFERRED', False)
+
+        # Addresses come grouped by MX so each group shares one SMTP session; up to
+        # in_flight sessions run at once and results are saved as they finish
+        in_flight = batch.max_in_flight or getattr(settings, 'BATCH_MAX_IN_FLIGHT', 100)
+        try:
+            for email, res in iter_validated(emails, domain_profiles, defer_whois, depth, in_flight, control.check):
+                print(f"    > Verified: {email}")
+                results.add(email, res)
+                outcome["processed"] += 1
+
+                # CHECK PAUSE / CANCEL (results still in flight are dropped and redone on resume)
+                if control.check():
+                    break
+            if control.signal and outcome["processed"] < len(emails):
+                print(f"[-] Batch {batch.id} {control.signal.upper()} requested by user.")
+                outcome["status"] = stopped[control.signal]
+        finally:
+            # Whatever was validated before a pause, egress block or error is kept
+            results.close()
+            outcome["parked"] = results.parked
+    except EgressBlocked as e:
+        pause_for_egress(batch, e)
+        outcome["status"] = "paused"
+    except Exception as e:
+        print(f"[!] CHUNK TASK ERROR (Batch {batch_id}): {e}")
+        outcome.update(status="failed", error=str(e))
+    return outcome
+
+
+@shared_task
+def finalize_batch_task(chunk_results, batch_id, run=None):
+    """
+    Chord callback once every chunk of a batch has run: COMPLETED if all chunks
+    finished, FAILED if any failed, CANCELLED if it was cancelled, otherwise
+    left PAUSED for resume_batch. Does nothing for a run that has since been
+    superseded by a resume or recheck; that run's own callback decides.
+    """
+    batch = ValidationBatch.objects.get(id=batch_id)
+    if run is not None and batch.run != run:
+        print(f"[-] Batch {batch.id}: run {run} superseded by run {batch.run}, not finalizing")
+        return batch.status
+    batch.processed_emails = EmailResult.objects.filter(batch=batch).count()
+    statuses = {r["status"] for r in chunk_results}
+    parked = sum(r["parked"] for r in chunk_results)
+
+    if "failed" in statuses:
+        errors = "; ".join(r["error"] for r in chunk_results if r.get("error"))
+        print(f"[!] Batch {batch.id} FAILED: {errors}")
+        batch.status = 'FAILED'
+    elif "cancelled" in statuses or batch.status == 'CANCELLED':
+        print(f"[-] Batch {batch.id} cancelled at {batch.processed_emails}/{batch.total_emails}")
+        batch.status = 'CANCELLED'
+    elif "paused" in statuses or batch.status == 'PAUSED':
+        print(f"[-] Batch {batch.id} paused at {batch.processed_emails}/{batch.total_emails}")
+        batch.status = 'PAUSED'
+    else:
+        batch.status = 'COMPLETED'
+        batch.current_processing_email = "" # Clear on completion
+        print(f"[-] Batch {batch.id} done. DNS cache: {dns_cache.stats()}")
+    batch.save(update_fields=['processed_emails', 'status', 'current_processing_email'])
+    progress.finish(batch.id)
+
+    if parked:
+        print(f"[-] Batch {batch.id}: {parked} greylisted results parked for retry")
+        schedule_greylist_retries()
+
+    stages = VALIDATION_DEPTHS[batch_depth(batch)]
+    if batch.status == 'COMPLETED' and stages['whois'] and getattr(settings, 'WHOIS_DEFERRED', False):
+        try:
+            enrich_whois_task.delay(batch.id)
+        except Exception as e:
+            print(f"[!] Could not queue WHOIS enrichment for Batch {batch.id}: {e}")
+    return batch.status
+
+
+def interleave_by_tld(domains):
+    """Orders domains round-robin across TLDs so consecutive lookups hit different registries."""
+    by_tld = defaultdict(deque)
+    for dom in sorted(domains):
+        by_tld[dom.rsplit('.', 1)[-1]].append(dom)
+    ordered = []
+    while by_tld:
+        for tld in list(by_tld):
+            ordered.append(by_tld[tld].popleft())
+            if not by_tld[tld]:
+                del by_tld[tld]
+    return ordered
+
+@shared_task
+def enrich_whois_task(batch_id):
+    """
+    Backfills domain_age_days / is_asian_region for a batch validated with
+    WHOIS_DEFERRED. Routed to the low-priority 'whois' queue; lookups to the
+    same TLD are spaced by WHOIS_TLD_MIN_INTERVAL seconds.
+    """
+    pending = (EmailResult.objects
+               .filter(batch_id=batch_id, domain_valid=True, domain_age_days__isnull=True)
+               .values_list('email', flat=True))
+    emails_by_domain = defaultdict(list)
+    for email in pending:
+        dom = base_domain(email)
+        if dom:
+            emails_by_domain[dom].append(email)
+
+    print(f"[-] WHOIS enrichment for Batch {batch_id}: {len(emails_by_domain)} domains")
+    min_interval = getattr(settings, 'WHOIS_TLD_MIN_INTERVAL', 2.0)
+    last_lookup = {}
+    updated = 0
+
+    for dom in interleave_by_tld(emails_by_domain):
+        record = get_stored_whois_record(dom)
+        if record is None:
+            tld = dom.rsplit('.', 1)[-1]
+            wait = last_lookup.get(tld, 0) + min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            record = get_whois_record(dom)
+            last_lookup[tld] = time.monotonic()
+        if record.age_days is None and not record.country:
+            continue
+
+        emails = emails_by_domain[dom]
+        for i in range(0, len(emails), 500):
+            updated += EmailResult.objects.filter(batch_id=batch_id, email__in=emails[i:i + 500]).update(
+                domain_age_days=record.age_days,
+                is_asian_region=is_asian_country(record.country),
+            )
+
+    print(f"[-] WHOIS enrichment for Batch {batch_id} done. Rows updated: {updated}")
+    return updated
+
+@shared_task
+def retry_greylisted_task(slot=None):
+    """
+    Re-verifies parked 4xx results that are due, one SMTP session per MX, and
+    updates their EmailResult rows in place. Results still answering 4xx, or
+    not answering at all (999), are pushed back with exponential backoff until
+    GREYLIST_MAX_ATTEMPTS, then the greylisted verdict stands. Reschedules
+    itself for the next due retry.
+    """
+    if slot:
+        # This run is under way: retries due later in the same minute need a run of their own
+        greylist_schedule.release_claim(slot)
+    if smtp_blocked():
+        # Retrying now would only turn greylisted results into timeouts
+        postponed = GreylistRetry.objects.filter(next_attempt_at__lte=timezone.now()).update(
+            next_attempt_at=timezone.now() + timedelta(seconds=getattr(settings, 'EGRESS_PREFLIGHT_INTERVAL', 300)))
+        print(f"[!] Greylist retry: SMTP egress blocked, {postponed} retries postponed")
+        schedule_greylist_retries()
+        return 0
+
+    due = (GreylistRetry.objects
+           .filter(next_attempt_at__lte=timezone.now())
+           .select_related('result', 'result__batch'))
+    retries_by_mx = defaultdict(list)
+    for retry in due:
+        retries_by_mx[retry.mx_host].append(retry)
+
+    print(f"[-] Greylist retry: {sum(map(len, retries_by_mx.values()))} results on {len(retries_by_mx)} MX hosts")
+    max_attempts = getattr(settings, 'GREYLIST_MAX_ATTEMPTS', 5)
+    profiles = {}
+    finished = 0
+
+    for mx_host, retries in retries_by_mx.items():
+        lease, wait = throttle.try_acquire(mx_host)
+        if lease is None:
+            GreylistRetry.objects.filter(pk__in=[r.pk for r in retries]).update(
+                next_attempt_at=timezone.now() + timedelta(seconds=wait))
+            continue
+        with lease:
+            smtp_results, _ = probe_mx_group(mx_host, [r.result.email for r in retries])
+
+        for retry in retries:
+            result = retry.result
+            smtp_result = smtp_results.get(result.email)
+            code = smtp_result[1] if smtp_result else 999
+            # A connection error or timeout (999) says nothing about the mailbox: back off like a 4xx
+            transient = code == 999 or 400 <= code < 500
+            if transient and retry.attempts + 1 < max_attempts:
+                retry.attempts += 1
+                if code != 999:
+                    retry.last_code = code
+                retry.next_attempt_at = timezone.now() + timedelta(seconds=greylist_retry_delay(retry.attempts))
+                retry.save()
+                continue
+            if code == 999 and retry.last_code:
+                # Out of attempts without an answer: the greylisted verdict stands
+                smtp_result = (False, retry.last_code, "Greylisted, no answer on retry", "")
+
+            depth = DEFAULT_VALIDATION_DEPTH
+            if result.batch and result.batch.validation_depth in VALIDATION_DEPTHS:
+                depth = result.batch.validation_depth
+            res = validate_email_single(result.email, profiles=profiles, depth=depth, smtp_result=smtp_result)
+            EmailResult.objects.filter(pk=result.pk).update(**result_fields(res))
+            retry.delete()
+            finished += 1
+
+    print(f"[-] Greylist retry done. Final verdicts: {finished}")
+    schedule_greylist_retries()
+    return finished
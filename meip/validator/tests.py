@@ -1,4 +1,31 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+import dns.exception
+import dns.message
+import dns.name
+import dns.rcode
+import dns.resolver
+import dns.rrset
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from . import engine, dns_async, tasks, smtp_session, smtp_async, egress, batch_control, progress
+from .throttle import SMTPThrottle, throttle_scopes
+from .mx_health import mx_breakers, mx_latency, MXLatency
+from .proxy_pool import ProxyPool, parse_proxies
+from . import proxy_pool
+from .config_snapshot import bump_config_version, get_config
+from .cache import TTLCache
+from .singleflight import SingleFlight, AsyncSingleFlight
+from .dns_pool import UpstreamPool, parse_upstreams
+from .models import SMTPSender, DisposableDomain, SystemConfig, GreylistRetry, WhoisRecord, ValidationBatch, EmailResult
 from .engine import validate_email_single, calculate_rtpc_score, is_disposable, is_role_based
 
 class ValidatorEngineTests(TestCase):
@@ -40,3 +67,1605 @@ class ValidatorEngineTests(TestCase):
         # For this environment, we'll try a known domain if safe, or skip/mock.
         # We can't easily mock here without `unittest.mock`.
         pass
+
+
+class DomainProfileTests(TestCase):
+    @mock.patch.object(engine, "check_smtp_detailed", return_value=(True, 250, "OK", "mx.acme.com ESMTP"))
+    @mock.patch.object(engine, "get_whois_info", return_value=(400, "IN"))
+    @mock.patch.object(engine, "check_dns_security", return_value=("HardFail", "Reject"))
+    @mock.patch.object(engine, "get_mx_hosts", return_value=["aspmx.l.google.com."])
+    def test_profile_shared_across_addresses(self, mx, dns_sec, whois_info, smtp):
+        profiles = {}
+        first = validate_email_single("rahul@acme.com", profiles=profiles)
+        second = validate_email_single("priya@acme.com", profiles=profiles)
+
+        self.assertEqual(mx.call_count, 1)
+        self.assertEqual(dns_sec.call_count, 1)
+        self.assertEqual(whois_info.call_count, 1)
+        self.assertEqual(list(profiles), ["acme.com"])
+        for res in (first, second):
+            self.assertEqual(res["provider"], "Google Workspace")
+            self.assertTrue(res["has_spf"] and res["has_dmarc"])
+            self.assertEqual(res["domain_age_days"], 400)
+            self.assertTrue(res["is_asian_region"])
+        # Catch-all and RCPT probes reuse the profile's MX list
+        for call in smtp.call_args_list:
+            self.assertEqual(call.kwargs["mx_hosts"], ["aspmx.l.google.com."])
+
+
+class FakeAnswer:
+    def __init__(self, name, rtype, texts, ttl=300):
+        self.rrset = dns.rrset.from_text(name, ttl, "IN", rtype, *texts)
+
+    def __iter__(self):
+        return iter(self.rrset)
+
+
+class FakeAsyncResolver:
+    """Answers from a {(name, rtype): [record text]} dict; missing names are NXDOMAIN."""
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.queries = []
+
+    async def resolve(self, name, rtype):
+        self.queries.append((name, rtype))
+        if (name, rtype) not in self.zone:
+            raise dns.resolver.NXDOMAIN()
+        return FakeAnswer(name, rtype, self.zone[(name, rtype)])
+
+
+@override_settings(CACHE_REDIS_URL='')
+class DNSPrefetchTests(TestCase):
+    def tearDown(self):
+        engine.dns_cache.clear()
+
+    def test_prefetch_serves_sync_lookups(self):
+        fake = FakeAsyncResolver({
+            ("acme.com", "MX"): ["20 mx2.acme.com.", "10 mx1.acme.com."],
+            ("acme.com", "A"): ["192.0.2.10"],
+            ("acme.com", "TXT"): ['"v=spf1 " "-all"'],
+            ("_dmarc.acme.com", "TXT"): ['"v=DMARC1; p=reject"'],
+        })
+        with mock.patch.object(dns_async, "make_async_resolver", return_value=fake):
+            dns_async.prefetch_domains(["acme.com", "ACME.com", "dead.example"], concurrency=3)
+
+        self.assertEqual(len(fake.queries), 8)
+        with mock.patch.object(engine.resolver, "resolve", side_effect=AssertionError("not prefetched")):
+            self.assertEqual(engine.get_mx_hosts("acme.com"), ["mx1.acme.com.", "mx2.acme.com."])
+            self.assertEqual(engine.check_dns_security("acme.com"), ("HardFail", "Reject"))
+            self.assertEqual(engine.get_mx_hosts("dead.example"), [])
+            self.assertFalse(engine.has_a_record("dead.example"))
+
+
+@override_settings(CACHE_REDIS_URL='')
+class TTLCacheTests(TestCase):
+    def test_expiry_eviction_and_counters(self):
+        cache = TTLCache("test", max_entries=2)
+        with mock.patch("validator.cache.time.time", return_value=1000.0):
+            cache.set("a", 1, ttl=10)
+            cache.set("b", 2, ttl=100)
+            self.assertEqual(cache.get("a"), 1)
+            cache.set("c", 3, ttl=100)  # evicts "b", the least recently used
+            self.assertIsNone(cache.get("b"))
+        with mock.patch("validator.cache.time.time", return_value=1011.0):
+            self.assertIsNone(cache.get("a"))  # expired
+            self.assertEqual(cache.get("c"), 3)
+
+        stats = cache.stats()
+        self.assertEqual((stats["l1_hits"], stats["misses"], stats["evictions"]), (2, 2, 1))
+        self.assertEqual(stats["entries"], 1)
+
+    def test_resolver_answers_cached_with_ttl(self):
+        answer = FakeAnswer("acme.com", "MX", ["10 mx1.acme.com."], ttl=3600)
+        with mock.patch.object(engine.resolver, "resolve", return_value=answer) as resolve:
+            self.assertEqual(engine.get_mx_hosts("acme.com"), ["mx1.acme.com."])
+            self.assertEqual(engine.get_provider("acme.com"), "Custom")
+        self.assertEqual(resolve.call_count, 1)
+        expires_at, _ = engine.dns_cache._l1["MX:acme.com"]
+        self.assertAlmostEqual(expires_at - time.time(), 3600, delta=5)
+        engine.dns_cache.clear()
+
+
+def nxdomain_with_soa(name, soa_ttl, soa_minimum):
+    """NXDOMAIN exception carrying a response whose authority section holds the zone SOA."""
+    query = dns.message.make_query(name, "MX")
+    response = dns.message.make_response(query)
+    response.authority.append(dns.rrset.from_text(
+        name, soa_ttl, "IN", "SOA",
+        f"ns1.example. hostmaster.example. 1 7200 3600 1209600 {soa_minimum}",
+    ))
+    qname = dns.name.from_text(name)
+    return dns.resolver.NXDOMAIN(qnames=[qname], responses={qname: response})
+
+
+@override_settings(CACHE_REDIS_URL='')
+class NegativeCacheTests(TestCase):
+    def tearDown(self):
+        engine.dns_cache.clear()
+
+    def test_nxdomain_cached_for_soa_minimum(self):
+        with mock.patch.object(engine.resolver, "resolve", side_effect=nxdomain_with_soa("typo-domain.com", 3600, 600)) as resolve:
+            profile = engine.build_domain_profile("typo-domain.com")
+            self.assertFalse(profile.has_mail_server)
+            self.assertIsNone(profile.dns_error)
+            # A lookup and later profiles are answered from the negative cache
+            engine.build_domain_profile("typo-domain.com")
+        self.assertEqual(resolve.call_count, 1)
+        expires_at, value = engine.dns_cache._l1["A:typo-domain.com"]
+        self.assertEqual(value, {"error": "NXDOMAIN"})
+        self.assertAlmostEqual(expires_at - time.time(), 600, delta=5)
+
+    def test_timeouts_are_not_cached(self):
+        with mock.patch.object(engine.resolver, "resolve", side_effect=dns.exception.Timeout()) as resolve:
+            profiles = {}
+            res = validate_email_single("lead@slow-dns.com", profiles=profiles)
+            self.assertIn("DNS lookup failed", res["reason"])
+            self.assertEqual(profiles["slow-dns.com"].dns_error, "Timeout")
+            # The next address of the domain retries instead of reusing the failure
+            validate_email_single("other@slow-dns.com", profiles=profiles)
+        self.assertEqual(resolve.call_count, 2)
+        self.assertNotIn("MX:slow-dns.com", engine.dns_cache._l1)
+
+
+class SingleFlightTests(TestCase):
+    def test_concurrent_threads_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            release.wait(2)
+            return ["mx1.gmail.com."]
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("MX:gmail.com", lookup))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        while flight.coalesced < 7:
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["mx1.gmail.com."]] * 8)
+        # Once the call finished, the next caller runs fn again
+        flight.do("MX:gmail.com", lookup)
+        self.assertEqual(len(calls), 2)
+
+    def test_errors_reach_every_waiter(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def whois_lookup():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise TimeoutError("whois rate limited")
+
+        async def burst():
+            return await asyncio.gather(*[flight.do("outlook.com", whois_lookup) for _ in range(5)], return_exceptions=True)
+
+        results = asyncio.run(burst())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(r, TimeoutError) for r in results))
+
+
+class StubDNSServer:
+    """UDP nameserver on 127.0.0.1 answering MX queries from a dict, after `delay` seconds."""
+
+    def __init__(self, zone, delay=0.0, rcode=None):
+        self.zone = zone
+        self.delay = delay
+        self.rcode = rcode
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address, self.port = self.sock.getsockname()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                data, client = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.queries += 1
+            query = dns.message.from_wire(data)
+            response = dns.message.make_response(query)
+            name = str(query.question[0].name).rstrip(".")
+            if self.rcode is not None:
+                response.set_rcode(self.rcode)
+            elif name in self.zone:
+                response.answer.append(dns.rrset.from_text(name + ".", 300, "IN", "MX", *self.zone[name]))
+            else:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            time.sleep(self.delay)
+            try:
+                self.sock.sendto(response.to_wire(), client)
+            except OSError:
+                return
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sock.close()
+
+
+class UpstreamPoolTests(TestCase):
+    zone = {"acme.com": ["10 mx1.acme.com."]}
+
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def stub(self, **kwargs):
+        server = StubDNSServer(self.zone, **kwargs)
+        self.servers.append(server)
+        return server
+
+    def test_parse_upstreams(self):
+        self.assertEqual(
+            parse_upstreams("8.8.8.8, 1.1.1.1:5353\n[2001:db8::1]:53"),
+            [("8.8.8.8", 53), ("1.1.1.1", 5353), ("2001:db8::1", 53)],
+        )
+
+    def test_prefers_fastest_upstream(self):
+        slow, fast = self.stub(delay=0.05), self.stub()
+        pool = UpstreamPool([(slow.address, slow.port), (fast.address, fast.port)], hedge_default=1.0)
+        for _ in range(6):
+            answer = pool.resolve("acme.com", "MX")
+            self.assertEqual([r.to_text() for r in answer], ["10 mx1.acme.com."])
+        self.assertEqual(pool.ranked()[0].port, fast.port)
+        self.assertLessEqual(slow.queries, 2)
+
+    def test_hedges_slow_primary(self):
+        slow, fast = self.stub(delay=0.5), self.stub()
+        pool = UpstreamPool([(slow.address, slow.port), (fast.address, fast.port)], hedge_default=0.05)
+        pool.upstreams[1].record_success(0.2)  # ranks the slow one first
+        started = time.monotonic()
+        pool.resolve("acme.com", "MX")
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(pool.hedged, 1)
+
+    def test_fails_over_on_servfail_and_keeps_nxdomain(self):
+        broken, good = self.stub(rcode=dns.rcode.SERVFAIL), self.stub()
+        pool = UpstreamPool([(broken.address, broken.port), (good.address, good.port)], hedge_default=1.0)
+        with self.assertRaises(dns.resolver.NXDOMAIN):
+            pool.resolve("dead.example", "MX")
+        self.assertEqual(pool.upstreams[0].errors, 1)
+        self.assertEqual(good.queries, 1)
+
+    def test_attempt_timeout_learned_from_p99(self):
+        pool = UpstreamPool([("127.0.0.1", 53)], timeout=2.0, timeout_factor=3, timeout_floor=0.25)
+        upstream = pool.upstreams[0]
+        self.assertEqual(pool.attempt_timeout(upstream), 2.0)
+        for _ in range(20):
+            upstream.record_success(0.01)
+        self.assertEqual(pool.attempt_timeout(upstream), 0.25)
+        for _ in range(20):
+            upstream.record_success(0.5)
+        self.assertAlmostEqual(pool.attempt_timeout(upstream), 1.5)
+
+    def test_timeout_when_all_upstreams_silent(self):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(("127.0.0.1", 0))
+        try:
+            pool = UpstreamPool([sink.getsockname()], timeout=0.1, lifetime=0.3)
+            with self.assertRaises(dns.exception.Timeout):
+                pool.resolve("acme.com", "MX")
+        finally:
+            sink.close()
+
+
+class WhoisRecordTests(TestCase):
+    def fake_whois(self):
+        return mock.Mock(creation_date=[datetime(2015, 3, 1), datetime(2016, 1, 1)], country="IN", registrar="GoDaddy")
+
+    @mock.patch.object(engine.whois, "whois")
+    def test_one_fetch_fills_age_country_registrar(self, whois_lookup):
+        whois_lookup.return_value = self.fake_whois()
+        age, country = engine.get_whois_info("Acme.com")
+        self.assertEqual(engine.get_domain_age("acme.com"), age)
+        self.assertEqual(country, "IN")
+        self.assertGreater(age, 3000)
+        self.assertEqual(whois_lookup.call_count, 1)
+        self.assertEqual(WhoisRecord.objects.get(domain="acme.com").registrar, "GoDaddy")
+
+    @mock.patch.object(engine.whois, "whois")
+    def test_stale_and_failed_records_are_refetched(self, whois_lookup):
+        whois_lookup.side_effect = Exception("rate limited")
+        record = engine.get_whois_record("acme.com")
+        self.assertFalse(record.lookup_ok)
+        # Failures expire after WHOIS_FAILURE_TTL_HOURS
+        WhoisRecord.objects.filter(domain="acme.com").update(fetched_at=timezone.now() - timedelta(hours=7))
+        whois_lookup.side_effect = None
+        whois_lookup.return_value = self.fake_whois()
+        self.assertTrue(engine.get_whois_record("acme.com").lookup_ok)
+        engine.get_whois_record("acme.com")
+        self.assertEqual(whois_lookup.call_count, 2)
+
+
+class DeferredWhoisTests(TestCase):
+    @mock.patch.object(engine, "check_smtp_detailed", return_value=(True, 250, "OK", ""))
+    @mock.patch.object(engine, "check_dns_security", return_value=("None", "None"))
+    @mock.patch.object(engine, "get_mx_hosts", return_value=["mx.acme.in."])
+    @mock.patch.object(engine.whois, "whois")
+    def test_verdict_first_whois_backfilled_later(self, whois_lookup, mx, dns_sec, smtp):
+        res = validate_email_single("lead@acme.in", profiles={}, defer_whois=True)
+        self.assertEqual(whois_lookup.call_count, 0)
+        self.assertIsNone(res["domain_age_days"])
+        self.assertEqual(res["status"], "DELIVERABLE")
+
+        batch = ValidationBatch.objects.create(csv_file="uploads/leads.csv")
+        for email in ("lead@acme.in", "cto@acme.in"):
+            EmailResult.objects.create(batch=batch, email=email, domain_valid=True, status=res["status"])
+        EmailResult.objects.create(batch=batch, email="x@no-mx.example", domain_valid=False, status="NOT DELIVERABLE")
+
+        whois_lookup.return_value = mock.Mock(creation_date=datetime(2010, 1, 1), country="IN", registrar="Registrar")
+        self.assertEqual(tasks.enrich_whois_task(batch.id), 2)
+        self.assertEqual(whois_lookup.call_count, 1)
+        self.assertEqual(batch.results.filter(is_asian_region=True, domain_age_days__gt=5000).count(), 2)
+
+    def test_interleave_by_tld(self):
+        self.assertEqual(
+            tasks.interleave_by_tld(["a.com", "b.com", "c.in", "d.io", "e.com"]),
+            ["a.com", "c.in", "d.io", "b.com", "e.com"],
+        )
+
+
+@mock.patch.object(engine, "check_smtp_detailed", return_value=(True, 250, "OK", ""))
+@mock.patch.object(engine, "get_whois_info", return_value=(900, "US"))
+@mock.patch.object(engine, "check_dns_security", return_value=("HardFail", "Reject"))
+@mock.patch.object(engine, "get_mx_hosts", return_value=["mx.acme.com."])
+@override_settings(CACHE_REDIS_URL='')
+class ValidationDepthTests(TestCase):
+    def setUp(self):
+        engine.catch_all_cache.clear()
+
+    def test_fast_runs_syntax_and_mx_only(self, mx, dns_sec, whois_info, smtp):
+        res = validate_email_single("lead@acme.com", depth="fast")
+        self.assertFalse(dns_sec.called or whois_info.called or smtp.called)
+        self.assertEqual(res["smtp_check"], "Skipped")
+        # Skipped SMTP isn't penalized like a failed one
+        self.assertEqual(res["status"], "DELIVERABLE")
+        self.assertIn("SMTP not verified", res["reason"])
+
+    def test_standard_skips_whois(self, mx, dns_sec, whois_info, smtp):
+        res = validate_email_single("lead@acme.com", depth="standard")
+        self.assertFalse(whois_info.called)
+        self.assertEqual(smtp.call_count, 2)  # catch-all + RCPT
+        self.assertTrue(res["has_spf"])
+        self.assertIsNone(res["domain_age_days"])
+
+    def test_deep_is_the_default(self, mx, dns_sec, whois_info, smtp):
+        res = validate_email_single("lead@acme.com", depth="bogus")
+        self.assertTrue(whois_info.called)
+        self.assertEqual(res["domain_age_days"], 900)
+        self.assertEqual(res["reason"], "Passed all checks")
+
+
+class FakeSMTPServer:
+    """
+    Minimal threaded SMTP server on 127.0.0.1 for prober tests. Accepts RCPT for
+    `mailboxes` (everything when catch_all), answers 451 for `greylisted`, 452 past
+    `max_rcpt` per transaction and hangs up after `drop_after` RCPTs on a connection.
+    Advertises PIPELINING when `pipelining` (EHLO is refused when not `ehlo`) and
+    waits `latency` seconds per client write, like one network round trip.
+    `max_active` is the most connections that were open at once.
+    """
+
+    def __init__(self, mailboxes=(), catch_all=False, max_rcpt=None, drop_after=None, greylisted=(),
+                 pipelining=False, ehlo=True, latency=0, banner="220 mx.fake.test ESMTP ready"):
+        self.mailboxes = set(mailboxes)
+        self.greylisted = set(greylisted)
+        self.catch_all = catch_all
+        self.max_rcpt = max_rcpt
+        self.drop_after = drop_after
+        self.pipelining = pipelining
+        self.ehlo = ehlo
+        self.latency = latency
+        self.banner = banner
+        self.connections = 0
+        self.active = self.max_active = 0
+        self.writes = 0
+        self.commands = []
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def answer(self, line):
+                """Reply to one command line; None means hang up without replying."""
+                verb = line.split(" ", 1)[0].upper()
+                fake.commands.append(verb)
+                if verb == "EHLO" and fake.ehlo:
+                    return "250-mx.fake.test\r\n250 PIPELINING" if fake.pipelining else "250 mx.fake.test"
+                if verb == "HELO":
+                    return "250 mx.fake.test"
+                if verb == "MAIL":
+                    self.rcpts_in_txn = 0
+                    return "250 OK"
+                if verb == "RCPT":
+                    if fake.drop_after is not None and self.rcpts_on_conn >= fake.drop_after:
+                        return None
+                    if fake.max_rcpt is not None and self.rcpts_in_txn >= fake.max_rcpt:
+                        return "452 4.5.3 Too many recipients"
+                    self.rcpts_in_txn += 1
+                    self.rcpts_on_conn += 1
+                    address = line.split(":", 1)[1].strip().strip("<>")
+                    if address in fake.greylisted:
+                        return "451 4.7.1 Greylisted, try again later"
+                    if fake.catch_all or address in fake.mailboxes:
+                        return "250 2.1.5 OK"
+                    return "550 5.1.1 User unknown"
+                if verb == "RSET":
+                    self.rcpts_in_txn = 0
+                    return "250 OK"
+                if verb == "QUIT":
+                    return "221 Bye"
+                return "502 Command not implemented"
+
+            def handle(self):
+                with fake.lock:
+                    fake.connections += 1
+                    fake.active += 1
+                    fake.max_active = max(fake.max_active, fake.active)
+                try:
+                    self.converse()
+                finally:
+                    with fake.lock:
+                        fake.active -= 1
+
+            def converse(self):
+                self.rcpts_in_txn = self.rcpts_on_conn = 0
+                self.request.sendall(f"{fake.banner}\r\n".encode())
+                buffer = b""
+                while True:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    with fake.lock:
+                        fake.writes += 1
+                    if fake.latency:
+                        time.sleep(fake.latency)
+                    buffer += data
+                    *lines, buffer = buffer.split(b"\r\n")
+                    replies = []
+                    for raw in lines:
+                        reply = self.answer(raw.decode().strip())
+                        if reply is None:
+                            break
+                        replies.append(reply)
+                        if reply.startswith("221"):
+                            break
+                    self.request.sendall("".join(f"{r}\r\n" for r in replies).encode())
+                    if len(replies) < len(lines) or (replies and replies[-1].startswith("221")):
+                        return
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+            request_queue_size = 256
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(CACHE_REDIS_URL='')
+class SMTPSessionTests(TestCase):
+    def setUp(self):
+        self.servers = []
+        engine.catch_all_cache.clear()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def fake(self, **kwargs):
+        server = FakeSMTPServer(**kwargs)
+        self.servers.append(server)
+        return server
+
+    def test_one_connection_for_many_recipients(self):
+        server = self.fake(mailboxes={"a@acme.com", "c@acme.com"}, max_rcpt=2)
+        prober = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com", max_rcpt=10)
+        emails = ["a@acme.com", "b@acme.com", "c@acme.com", "d@acme.com", "e@acme.com"]
+        results = prober.probe(emails)
+
+        self.assertEqual(server.connections, 1)
+        self.assertEqual([results[e][1] for e in emails], [250, 550, 250, 550, 550])
+        self.assertTrue(results["a@acme.com"][0])
+        self.assertIn("mx.fake.test", results["a@acme.com"][3])
+        # The server's 452 limit was learned and honored with RSET
+        self.assertEqual(prober.max_rcpt, 2)
+        self.assertEqual(server.commands.count("RSET"), 2)
+
+    def test_reconnects_when_server_drops_session(self):
+        server = self.fake(catch_all=True, drop_after=2)
+        prober = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com")
+        results = prober.probe([f"user{i}@acme.com" for i in range(5)])
+        self.assertTrue(all(r[0] for r in results.values()))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(server.connections, 3)
+
+    def test_batch_groups_by_mx_and_probes_catch_all_in_session(self):
+        server = self.fake(mailboxes={"a@acme.com", "b@acme.com"})
+        emails = ["a@acme.com", "bad-syntax", "b@acme.com", "x@acme.com"]
+        profiles = {}
+        with mock.patch.object(smtp_session, "get_mx_hosts", return_value=[server.address]), \
+                mock.patch.object(engine, "get_mx_hosts", return_value=[server.address]), \
+                mock.patch.object(engine, "check_dns_security", return_value=("None", "None")), \
+                mock.patch.object(engine, "get_whois_info", return_value=(None, None)), \
+                mock.patch.object(engine, "check_smtp_detailed", side_effect=AssertionError("session expected")):
+            ordered = list(smtp_session.iter_session_results(emails, profiles))
+            verdicts = {e: validate_email_single(e, profiles=profiles, smtp_result=r)["smtp_check"] for e, r in ordered}
+
+        self.assertEqual(server.connections, 1)
+        self.assertEqual([e for e, _ in ordered], ["a@acme.com", "b@acme.com", "x@acme.com", "bad-syntax"])
+        self.assertFalse(profiles["acme.com"].catch_all)
+        self.assertEqual(verdicts["a@acme.com"], "Success")
+        self.assertEqual(verdicts["x@acme.com"], "Fail (550)")
+
+
+@override_settings(CACHE_REDIS_URL='')
+class CatchAllCacheTests(TestCase):
+    def setUp(self):
+        engine.catch_all_cache.clear()
+
+    def test_verdict_probed_once_per_domain(self):
+        with mock.patch.object(engine, "check_smtp_detailed", return_value=(True, 250, "OK", "")) as smtp:
+            self.assertTrue(engine.check_catch_all("acme.com", ["mx.acme.com"]))
+            self.assertTrue(engine.check_catch_all("ACME.com", ["mx.acme.com"]))
+        self.assertEqual(smtp.call_count, 1)
+        self.assertIs(engine.get_cached_catch_all("acme.com"), True)
+
+    def test_inconclusive_probe_not_cached(self):
+        with mock.patch.object(engine, "check_smtp_detailed", return_value=(False, 451, "Greylisted", "")) as smtp:
+            self.assertFalse(engine.check_catch_all("acme.com"))
+            self.assertFalse(engine.check_catch_all("acme.com"))
+        self.assertEqual(smtp.call_count, 2)
+        self.assertIsNone(engine.get_cached_catch_all("acme.com"))
+
+    def test_inconclusive_probe_releases_claim(self):
+        with mock.patch.object(engine.catch_all_cache, "claim", return_value=True), \
+                mock.patch.object(engine.catch_all_cache, "release_claim") as release, \
+                mock.patch.object(engine, "check_smtp_detailed", return_value=(False, 999, "timed out", "")):
+            self.assertFalse(engine.check_catch_all("acme.com"))
+        release.assert_called_once_with("acme.com")
+
+    @override_settings(CATCH_ALL_CLAIM_WAIT=15)
+    def test_waiter_takes_over_released_claim(self):
+        # Another worker holds the claim, then gives it up without a verdict
+        with mock.patch.object(engine.catch_all_cache, "claim", side_effect=[False, True]), \
+                mock.patch.object(engine.catch_all_cache, "release_claim"), \
+                mock.patch.object(engine, "check_smtp_detailed", return_value=(False, 550, "No", "")) as smtp:
+            started = time.monotonic()
+            self.assertFalse(engine.check_catch_all("acme.com"))
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(smtp.call_count, 1)
+
+    def test_session_skips_probe_for_cached_domain(self):
+        server = FakeSMTPServer(mailboxes={"a@acme.com"})
+        self.addCleanup(server.stop)
+        engine.store_catch_all("acme.com", 550)
+        profiles = {}
+        with mock.patch.object(smtp_session, "get_mx_hosts", return_value=[server.address]), \
+                mock.patch.object(engine, "get_mx_hosts", return_value=[server.address]), \
+                mock.patch.object(engine, "check_dns_security", return_value=("None", "None")), \
+                mock.patch.object(engine, "get_whois_info", return_value=(None, None)):
+            list(smtp_session.iter_session_results(["a@acme.com", "b@acme.com"], profiles))
+        self.assertEqual(server.commands.count("RCPT"), 2)
+        self.assertIs(profiles["acme.com"].catch_all, False)
+
+
+@override_settings(SMTP_LIST=["dev@meta-insyt.com"], SMTP_THROTTLE_ENABLED=False, CACHE_REDIS_URL='')
+class PipeliningTests(TestCase):
+    def fake(self, **kwargs):
+        server = FakeSMTPServer(**kwargs)
+        self.addCleanup(server.stop)
+        return server
+
+    def test_session_sends_rcpts_in_one_write(self):
+        server = self.fake(mailboxes={"a@acme.com", "c@acme.com"}, pipelining=True)
+        prober = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com")
+        emails = ["a@acme.com", "b@acme.com", "c@acme.com", "d@acme.com"]
+        results = prober.probe(emails)
+
+        self.assertEqual([results[e][1] for e in emails], [250, 550, 250, 550])
+        # EHLO, then MAIL FROM + 4 RCPTs, then QUIT
+        self.assertEqual(server.writes, 3)
+        self.assertIn("EHLO", server.commands)
+
+    def test_pipeline_depth_bounds_each_write(self):
+        server = self.fake(catch_all=True, pipelining=True)
+        prober = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com", pipeline_depth=2)
+        results = prober.probe([f"user{i}@acme.com" for i in range(5)])
+        self.assertTrue(all(r[0] for r in results.values()))
+        self.assertEqual(server.writes, 1 + 3 + 1)
+
+    def test_pipelined_batches_learn_recipient_limit(self):
+        server = self.fake(mailboxes={"a@acme.com", "c@acme.com"}, max_rcpt=2, pipelining=True)
+        prober = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com", max_rcpt=10)
+        emails = ["a@acme.com", "b@acme.com", "c@acme.com", "d@acme.com", "e@acme.com"]
+        results = prober.probe(emails)
+
+        self.assertEqual([results[e][1] for e in emails], [250, 550, 250, 550, 550])
+        self.assertEqual(prober.max_rcpt, 2)
+        self.assertEqual(server.commands.count("RSET"), 2)
+        self.assertEqual(server.connections, 1)
+
+    def test_pipelined_batch_keeps_answers_when_server_drops(self):
+        server = self.fake(catch_all=True, drop_after=2, pipelining=True)
+        prober = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com")
+        results = prober.probe([f"user{i}@acme.com" for i in range(5)])
+        self.assertTrue(all(r[0] for r in results.values()))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(server.connections, 3)
+
+    def test_falls_back_to_helo_and_lockstep(self):
+        server = self.fake(mailboxes={"a@acme.com"}, ehlo=False)
+        prober = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com")
+        results = prober.probe(["a@acme.com", "b@acme.com"])
+
+        self.assertEqual((results["a@acme.com"][1], results["b@acme.com"][1]), (250, 550))
+        self.assertEqual(server.commands[:2], ["EHLO", "HELO"])
+        # Greeting x2, MAIL, RCPT x2, QUIT: one write per command
+        self.assertEqual(server.writes, 6)
+
+    @override_settings(SMTP_PIPELINING=False)
+    def test_setting_disables_pipelining(self):
+        server = self.fake(catch_all=True, pipelining=True)
+        smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com").probe(["a@acme.com", "b@acme.com"])
+        self.assertEqual(server.writes, 5)
+
+    def test_single_probes_pipeline_mail_and_rcpt(self):
+        server = self.fake(mailboxes={"a@acme.com"}, pipelining=True)
+        self.assertEqual(engine.check_smtp_detailed("a@acme.com", mx_hosts=[server.address])[:2], (True, 250))
+        # EHLO, MAIL + RCPT, QUIT
+        self.assertEqual(server.writes, 3)
+
+        server = self.fake(mailboxes={"a@acme.com"}, pipelining=True)
+        with mock.patch.object(engine, "get_mx_hosts", return_value=[server.address]):
+            results = smtp_async.check_smtp_many(["a@acme.com", "b@acme.com"])
+        self.assertEqual((results["a@acme.com"][:2], results["b@acme.com"][:2]), ((True, 250), (False, 550)))
+        # Per session: EHLO, then MAIL + RCPT + QUIT
+        self.assertEqual(server.writes, 4)
+
+
+@override_settings(SMTP_LIST=["dev@meta-insyt.com"], SMTP_THROTTLE_ENABLED=False)
+class AsyncSMTPTests(TestCase):
+    def test_many_concurrent_sessions_same_contract_as_sync(self):
+        server = FakeSMTPServer(mailboxes={f"user{i}@acme.com" for i in range(0, 200, 2)})
+        self.addCleanup(server.stop)
+        emails = [f"user{i}@acme.com" for i in range(200)]
+        with mock.patch.object(engine, "get_mx_hosts", return_value=[server.address]):
+            results = smtp_async.check_smtp_many(emails, concurrency=100)
+            sync_result = engine.check_smtp_detailed("user0@acme.com", mx_hosts=[server.address])
+
+        self.assertEqual(server.connections, 201)
+        self.assertEqual(results["user0@acme.com"], sync_result)
+        self.assertEqual(results["user1@acme.com"][:2], (False, 550))
+        self.assertEqual(sum(r[0] for r in results.values()), 100)
+
+    def test_silent_server_hits_session_timeout(self):
+        silent = socket.socket()
+        silent.bind(("127.0.0.1", 0))
+        silent.listen(8)
+        self.addCleanup(silent.close)
+        address = "%s:%d" % silent.getsockname()
+        with mock.patch.object(engine, "get_mx_hosts", return_value=[address]):
+            started = time.monotonic()
+            results = smtp_async.check_smtp_many(["a@acme.com", "b@acme.com"], timeout=5, session_timeout=0.3)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(results["a@acme.com"], (False, 999, "session timed out", ""))
+
+    def test_no_mx_fails_without_connecting(self):
+        with mock.patch.object(engine, "get_mx_hosts", return_value=[]):
+            results = smtp_async.check_smtp_many(["a@nomail.test"])
+        self.assertEqual(results["a@nomail.test"][:2], (False, 999))
+
+    @override_settings(SMTP_THROTTLE_ENABLED=True, SMTP_THROTTLE_MX={"rate": 0, "burst": 1, "max_sessions": 0})
+    def test_throttle_leases_taken_off_loop_inside_concurrency_slot(self):
+        server = FakeSMTPServer(catch_all=True)
+        self.addCleanup(server.stop)
+        real_acquire = smtp_async.throttle.try_acquire
+        held, calls = [], []
+
+        def try_acquire(mx_host):
+            try:
+                asyncio.get_running_loop()
+                calls.append("loop")
+            except RuntimeError:
+                calls.append("executor")
+            lease, wait = real_acquire(mx_host)
+            real_release = lease.release
+
+            def release():
+                held.remove(lease)
+                real_release()
+            lease.release = release
+            held.append(lease)
+            # Never more leases than concurrency slots
+            self.assertLessEqual(len(held), 1)
+            return lease, wait
+
+        with mock.patch.object(engine, "get_mx_hosts", return_value=[server.address]), \
+                mock.patch.object(smtp_async.throttle, "try_acquire", side_effect=try_acquire):
+            results = smtp_async.check_smtp_many(["a@acme.com", "b@acme.com", "c@acme.com"], concurrency=1)
+        self.assertEqual(calls, ["executor"] * 3)
+        self.assertEqual(held, [])
+        self.assertTrue(all(r[0] for r in results.values()))
+
+    @override_settings(SMTP_THROTTLE_ENABLED=True, SMTP_THROTTLE_MAX_WAIT=1.5)
+    def test_throttled_mx_waits_outside_session_timeout_and_slot(self):
+        busy = FakeSMTPServer(catch_all=True)
+        free = FakeSMTPServer(catch_all=True)
+        self.addCleanup(busy.stop)
+        self.addCleanup(free.stop)
+        real_acquire = smtp_async.throttle.try_acquire
+        started = time.monotonic()
+        granted = {}
+
+        def try_acquire(mx_host):
+            if mx_host == busy.address:
+                return None, 0.2
+            granted.setdefault(mx_host, time.monotonic() - started)
+            return real_acquire(mx_host)
+
+        mx_by_domain = {"bigcorp.com": [busy.address], "other.com": [free.address]}
+        with mock.patch.object(engine, "get_mx_hosts", side_effect=mx_by_domain.get), \
+                mock.patch.object(smtp_async.throttle, "try_acquire", side_effect=try_acquire):
+            results = smtp_async.check_smtp_many(
+                ["a@bigcorp.com", "b@bigcorp.com", "x@other.com"], concurrency=1, session_timeout=1)
+        # Past the session timeout, yet a local 421 (retried later), never dialed
+        self.assertEqual(results["a@bigcorp.com"][:2], (False, 421))
+        self.assertEqual(results["b@bigcorp.com"][:2], (False, 421))
+        self.assertEqual(busy.connections, 0)
+        # The waiting addresses didn't keep the only slot from other.com
+        self.assertTrue(results["x@other.com"][0])
+        self.assertLess(granted[free.address], 0.5)
+
+    def test_mx_addresses_resolved_outside_event_loop(self):
+        server = FakeSMTPServer(catch_all=True)
+        self.addCleanup(server.stop)
+        real_addresses = engine.mx_addresses
+        on_loop = []
+
+        def addresses(mx_host):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(mx_host)
+            except RuntimeError:
+                pass
+            return real_addresses(mx_host)
+
+        with mock.patch.object(engine, "get_mx_hosts", return_value=[server.address]), \
+                mock.patch.object(engine, "mx_addresses", side_effect=addresses):
+            results = smtp_async.check_smtp_many(["a@acme.com", "b@acme.com"])
+        self.assertEqual(on_loop, [])
+        self.assertTrue(all(r[0] for r in results.values()))
+
+
+@override_settings(
+    CACHE_REDIS_URL='',
+    SMTP_THROTTLE_MX={"rate": 5.0, "burst": 2, "max_sessions": 0},
+    SMTP_THROTTLE_PROVIDERS={"google": {"rate": 0, "burst": 1, "max_sessions": 1}},
+)
+class SMTPThrottleTests(TestCase):
+    def test_token_bucket_per_mx(self):
+        throttle = SMTPThrottle()
+        self.assertIsNotNone(throttle.try_acquire("mx1.acme.com")[0])
+        self.assertIsNotNone(throttle.try_acquire("MX1.acme.com.")[0])
+        lease, wait = throttle.try_acquire("mx1.acme.com")
+        self.assertIsNone(lease)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.2)
+        # Other hosts have their own budget
+        self.assertIsNotNone(throttle.try_acquire("mx2.acme.com")[0])
+        time.sleep(wait)
+        self.assertIsNotNone(throttle.try_acquire("mx1.acme.com")[0])
+
+    def test_provider_session_cap_spans_mx_hosts(self):
+        self.assertEqual([s for s, _ in throttle_scopes("aspmx.l.google.com.")],
+                         ["mx:aspmx.l.google.com", "provider:google"])
+        throttle = SMTPThrottle()
+        lease, _ = throttle.try_acquire("aspmx.l.google.com")
+        self.assertIsNone(throttle.try_acquire("alt1.aspmx.l.google.com")[0])
+        lease.release()
+        self.assertIsNotNone(throttle.try_acquire("alt1.aspmx.l.google.com")[0])
+
+    @override_settings(SMTP_SESSION_CHUNK=1, SMTP_LIST=["dev@meta-insyt.com"])
+    def test_scheduler_works_on_other_mx_while_throttled(self):
+        servers = {dom: FakeSMTPServer(catch_all=True) for dom in ("a.com", "b.com")}
+        for server in servers.values():
+            self.addCleanup(server.stop)
+        engine.catch_all_cache.clear()
+        engine.store_catch_all("a.com", 550)
+        engine.store_catch_all("b.com", 550)
+
+        def mx_for(domain):
+            return [servers[domain].address]
+
+        emails = ["1@a.com", "2@a.com", "3@a.com", "1@b.com"]
+        with override_settings(SMTP_THROTTLE_MX={"rate": 5.0, "burst": 1, "max_sessions": 0}), \
+                mock.patch.object(smtp_session, "throttle", SMTPThrottle()), \
+                mock.patch.object(smtp_session, "get_mx_hosts", side_effect=mx_for), \
+                mock.patch.object(engine, "get_mx_hosts", side_effect=mx_for), \
+                mock.patch.object(engine, "check_dns_security", return_value=("None", "None")):
+            order = [email for email, _ in smtp_session.iter_session_results(emails, {}, depth="standard")]
+
+        self.assertEqual(sorted(order), sorted(emails))
+        # b.com doesn't wait behind a.com's throttled chunks
+        self.assertLess(order.index("1@b.com"), order.index("2@a.com"))
+
+
+    @override_settings(SMTP_LIST=["dev@meta-insyt.com"], SMTP_THROTTLE_MX={"rate": 0, "burst": 1, "max_sessions": 1})
+    def test_failover_lease_is_for_the_host_connected(self):
+        server = FakeSMTPServer(catch_all=True)
+        self.addCleanup(server.stop)
+        dead = closed_port_address()
+        mx_breakers.reset()
+        self.addCleanup(mx_breakers.reset)
+
+        for prober in ("sync", "async"):
+            limiter = SMTPThrottle()
+            acquired = []
+            real_acquire = limiter.try_acquire
+
+            def try_acquire(mx_host):
+                acquired.append(mx_host)
+                return real_acquire(mx_host)
+
+            with mock.patch.object(limiter, "try_acquire", side_effect=try_acquire), \
+                    mock.patch("validator.throttle.throttle", limiter), \
+                    mock.patch.object(smtp_async, "throttle", limiter), \
+                    mock.patch.object(engine, "get_mx_hosts", return_value=[dead, server.address]):
+                if prober == "sync":
+                    result = engine.check_smtp_detailed("a@acme.com", mx_hosts=[dead, server.address])
+                else:
+                    result = smtp_async.check_smtp_many(["a@acme.com"])["a@acme.com"]
+            self.assertEqual(result[:2], (True, 250))
+            self.assertEqual(acquired, [dead, server.address])
+            # Both leases were given back
+            self.assertIsNotNone(limiter.try_acquire(dead)[0])
+            self.assertIsNotNone(limiter.try_acquire(server.address)[0])
+
+
+@override_settings(CACHE_REDIS_URL='', SMTP_LIST=["dev@meta-insyt.com"], SMTP_THROTTLE_ENABLED=False)
+class GreylistRetryTests(TestCase):
+    def setUp(self):
+        engine.catch_all_cache.clear()
+        engine.store_catch_all("acme.com", 550)
+        self.server = FakeSMTPServer(mailboxes={"a@acme.com", "b@acme.com"}, greylisted={"a@acme.com", "b@acme.com"})
+        self.addCleanup(self.server.stop)
+        patches = [
+            mock.patch.object(smtp_session, "get_mx_hosts", return_value=[self.server.address]),
+            mock.patch.object(engine, "get_mx_hosts", return_value=[self.server.address]),
+            mock.patch.object(engine, "check_dns_security", return_value=("None", "None")),
+            mock.patch.object(tasks, "prefetch_domains", return_value=0),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_override = override_settings(MEDIA_ROOT=media)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        os.makedirs(os.path.join(media, "uploads"))
+        with open(os.path.join(media, "uploads", "leads.csv"), "w") as f:
+            f.write("Email\na@acme.com\nb@acme.com\n")
+        self.batch = ValidationBatch.objects.create(csv_file="uploads/leads.csv", validation_depth="standard")
+
+    def make_due(self):
+        GreylistRetry.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    def test_4xx_parked_then_updated_in_place(self):
+        tasks.process_batch_task(self.batch.id)
+        self.assertEqual(self.batch.results.get(email="a@acme.com").smtp_check, "Greylisted (451)")
+        retry = GreylistRetry.objects.get(result__email="a@acme.com")
+        self.assertEqual((retry.attempts, retry.last_code), (0, 451))
+        self.assertAlmostEqual((retry.next_attempt_at - timezone.now()).total_seconds(), 300, delta=5)
+
+        self.server.greylisted.clear()
+        self.server.connections = 0
+        self.make_due()
+        self.assertEqual(tasks.retry_greylisted_task(), 2)
+
+        # One session re-verified every parked address on that MX
+        self.assertEqual(self.server.connections, 1)
+        self.assertFalse(GreylistRetry.objects.exists())
+        result = self.batch.results.get(email="a@acme.com")
+        self.assertEqual((result.smtp_check, result.status), ("Success", "DELIVERABLE"))
+        self.assertEqual(self.batch.results.count(), 2)
+
+    @override_settings(GREYLIST_MAX_ATTEMPTS=2)
+    def test_backoff_then_final_verdict(self):
+        tasks.process_batch_task(self.batch.id)
+        self.make_due()
+        self.assertEqual(tasks.retry_greylisted_task(), 0)
+        retry = GreylistRetry.objects.get(result__email="a@acme.com")
+        self.assertEqual(retry.attempts, 1)
+        self.assertAlmostEqual((retry.next_attempt_at - timezone.now()).total_seconds(), 600, delta=5)
+
+        self.make_due()
+        self.assertEqual(tasks.retry_greylisted_task(), 2)
+        self.assertFalse(GreylistRetry.objects.exists())
+        result = self.batch.results.get(email="a@acme.com")
+        self.assertEqual(result.smtp_check, "Greylisted (451)")
+        self.assertEqual(result.reason, "Server Busy/Greylisted (Retry Later)")
+
+    @override_settings(GREYLIST_MAX_ATTEMPTS=2)
+    def test_connection_error_backs_off_instead_of_final(self):
+        tasks.process_batch_task(self.batch.id)
+        # The MX stops answering at all
+        GreylistRetry.objects.update(mx_host=closed_port_address())
+        self.make_due()
+        self.assertEqual(tasks.retry_greylisted_task(), 0)
+        retry = GreylistRetry.objects.get(result__email="a@acme.com")
+        self.assertEqual((retry.attempts, retry.last_code), (1, 451))
+        self.assertAlmostEqual((retry.next_attempt_at - timezone.now()).total_seconds(), 600, delta=5)
+
+        # Still no answer once attempts run out: the greylisted verdict stands, not a 999
+        self.make_due()
+        self.assertEqual(tasks.retry_greylisted_task(), 2)
+        self.assertFalse(GreylistRetry.objects.exists())
+        self.assertEqual(self.batch.results.get(email="a@acme.com").smtp_check, "Greylisted (451)")
+
+    def test_retry_due_later_in_same_minute_is_rescheduled(self):
+        tasks.process_batch_task(self.batch.id)
+        minute = (timezone.now() + timedelta(minutes=5)).replace(second=0, microsecond=0)
+        GreylistRetry.objects.filter(result__email="a@acme.com").update(next_attempt_at=minute + timedelta(seconds=1))
+        GreylistRetry.objects.filter(result__email="b@acme.com").update(next_attempt_at=minute + timedelta(seconds=40))
+
+        # Shared claim store as Redis would hold it
+        claims = set()
+
+        def claim(key, ttl):
+            if key in claims:
+                return False
+            claims.add(key)
+            return True
+
+        with override_settings(CELERY_TASK_ALWAYS_EAGER=False), \
+                mock.patch.object(tasks.greylist_schedule, "claim", side_effect=claim), \
+                mock.patch.object(tasks.greylist_schedule, "release_claim", side_effect=claims.discard), \
+                mock.patch.object(tasks.retry_greylisted_task, "apply_async") as apply_async:
+            tasks.schedule_greylist_retries()
+            tasks.schedule_greylist_retries()
+            self.assertEqual(apply_async.call_count, 1)
+            slot = apply_async.call_args.kwargs["kwargs"]["slot"]
+
+            # The run for a@ finds b@ not yet due and must still get it a run
+            GreylistRetry.objects.filter(result__email="a@acme.com").update(
+                next_attempt_at=timezone.now() - timedelta(seconds=1))
+            tasks.retry_greylisted_task(slot=slot)
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertAlmostEqual(apply_async.call_args.kwargs["countdown"],
+                               (minute + timedelta(seconds=40) - timezone.now()).total_seconds(), delta=5)
+
+
+def closed_port_address():
+    """host:port on 127.0.0.1 that refuses connections."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    address = "%s:%d" % sock.getsockname()
+    sock.close()
+    return address
+
+
+@override_settings(CACHE_REDIS_URL='', SMTP_LIST=["dev@meta-insyt.com"], SMTP_THROTTLE_ENABLED=False,
+                   MX_BREAKER_FAILURES=2, MX_BREAKER_COOLDOWN=60)
+class MXFailoverTests(TestCase):
+    def setUp(self):
+        mx_breakers.reset()
+        self.addCleanup(mx_breakers.reset)
+        self.server = FakeSMTPServer(mailboxes={"a@acme.com"})
+        self.addCleanup(self.server.stop)
+        self.dead = closed_port_address()
+
+    def test_fails_over_to_lower_priority_mx(self):
+        ok, code, _, banner = engine.check_smtp_detailed("a@acme.com", mx_hosts=[self.dead, self.server.address])
+        self.assertEqual((ok, code), (True, 250))
+        self.assertIn("mx.fake.test", banner)
+
+        with mock.patch.object(engine, "get_mx_hosts", return_value=[self.dead, self.server.address]):
+            results = smtp_async.check_smtp_many(["a@acme.com", "b@acme.com"])
+        self.assertEqual([results[e][:2] for e in ("a@acme.com", "b@acme.com")], [(True, 250), (False, 550)])
+
+        session = smtp_session.SMTPSessionProber([self.dead, self.server.address], "dev@meta-insyt.com")
+        self.assertEqual(session.probe(["a@acme.com"])["a@acme.com"][1], 250)
+
+    def test_breaker_opens_and_fails_fast(self):
+        for _ in range(2):
+            self.assertEqual(engine.check_smtp_detailed("a@acme.com", mx_hosts=[self.dead])[1], 999)
+        stats = {row["address"]: row for row in mx_breakers.stats()}
+        self.assertEqual(stats[self.dead]["state"], "open")
+        self.assertEqual(stats[self.dead]["failures"], 2)
+
+        _, code, msg, _ = engine.check_smtp_detailed("a@acme.com", mx_hosts=[self.dead])
+        self.assertEqual(code, 999)
+        self.assertIn("circuit open", msg)
+        stats = {row["address"]: row for row in mx_breakers.stats()}
+        self.assertEqual((stats[self.dead]["failures"], stats[self.dead]["fast_failed"]), (2, 1))
+        # The healthy backup is still used while the primary's breaker is open
+        self.assertTrue(engine.check_smtp_detailed("a@acme.com", mx_hosts=[self.dead, self.server.address])[0])
+
+    @override_settings(MX_BREAKER_COOLDOWN=0.1)
+    def test_half_open_allows_one_trial(self):
+        for _ in range(2):
+            mx_breakers.record_failure("10.0.0.1:25", "mx.acme.com", "refused")
+        self.assertFalse(mx_breakers.allow("10.0.0.1:25", "mx.acme.com"))
+        time.sleep(0.15)
+        self.assertTrue(mx_breakers.allow("10.0.0.1:25", "mx.acme.com"))
+        self.assertFalse(mx_breakers.allow("10.0.0.1:25", "mx.acme.com"))
+        mx_breakers.record_success("10.0.0.1:25", "mx.acme.com", 0.05)
+        self.assertEqual(mx_breakers.stats()[0]["state"], "closed")
+
+
+@override_settings(SMTP_TIMEOUT=1, SMTP_TIMEOUT_FACTOR=3, SMTP_TIMEOUT_FLOOR=0.1, SMTP_TIMEOUT_CEILING=5,
+                   SMTP_TIMEOUT_MIN_SAMPLES=5, CACHE_REDIS_URL='')
+class MXLatencyTests(TestCase):
+    def setUp(self):
+        mx_latency.reset()
+        self.addCleanup(mx_latency.reset)
+
+    def test_timeout_is_p99_times_factor_within_bounds(self):
+        latency = MXLatency()
+        self.assertEqual(latency.timeout_for("mx.acme.com"), 1)  # unknown host: SMTP_TIMEOUT
+        for _ in range(50):
+            latency.record("mx.acme.com", 0.2)
+        self.assertAlmostEqual(latency.timeout_for("mx.acme.com"), 0.6)
+        for _ in range(50):
+            latency.record("fast.acme.com", 0.005)
+            latency.record("tarpit.acme.com", 20)
+        self.assertEqual(latency.timeout_for("fast.acme.com"), 0.1)
+        self.assertEqual(latency.timeout_for("tarpit.acme.com"), 5)
+
+    def test_timeouts_fall_back_to_fixed_timeout_not_ceiling(self):
+        latency = MXLatency()
+        for _ in range(50):
+            latency.record("mx.acme.com", 0.05)
+        self.assertAlmostEqual(latency.timeout_for("mx.acme.com"), 0.15)
+        latency.record_timeout("mx.acme.com", 0.15)
+        self.assertEqual(latency.timeout_for("mx.acme.com"), 1)
+        # A dead host keeps timing out but never climbs past SMTP_TIMEOUT
+        for _ in range(50):
+            latency.record_timeout("mx.acme.com", 1)
+            latency.record_timeout("dead.acme.com", 1)
+        self.assertEqual(latency.timeout_for("mx.acme.com"), 1)
+        self.assertEqual(latency.timeout_for("dead.acme.com"), 1)
+        # Answering again restores the learned timeout
+        latency.record("mx.acme.com", 0.05)
+        self.assertAlmostEqual(latency.timeout_for("mx.acme.com"), 0.15)
+        self.assertEqual({r["mx_host"]: r["timeouts"] for r in latency.stats()}, {"mx.acme.com": 51, "dead.acme.com": 50})
+
+    def test_session_learns_fast_host(self):
+        server = FakeSMTPServer(catch_all=True)
+        self.addCleanup(server.stop)
+        smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com").probe(
+            [f"user{i}@acme.com" for i in range(10)]
+        )
+        self.assertEqual(mx_latency.timeout_for(server.address), 0.1)
+
+    def test_slow_host_is_not_failed_by_fixed_timeout(self):
+        server = FakeSMTPServer(catch_all=True, latency=0.2)
+        self.addCleanup(server.stop)
+        with override_settings(SMTP_ADAPTIVE_TIMEOUTS=False, SMTP_TIMEOUT=0.1):
+            fixed = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com", max_reconnects=0).probe(["a@acme.com"])
+        adaptive = smtp_session.SMTPSessionProber(server.address, "dev@meta-insyt.com").probe(["a@acme.com"])
+        self.assertEqual(fixed["a@acme.com"][1], 999)
+        self.assertEqual(adaptive["a@acme.com"][:2], (True, 250))
+
+
+@override_settings(CACHE_REDIS_URL='', SMTP_LIST=["dev@meta-insyt.com"], SMTP_THROTTLE_ENABLED=False, BATCH_CHUNK_SIZE=2)
+class BatchFanOutTests(TestCase):
+    def setUp(self):
+        engine.catch_all_cache.clear()
+        self.server = FakeSMTPServer(mailboxes={"a@acme.com", "c@beta.com"})
+        self.addCleanup(self.server.stop)
+        patches = [
+            mock.patch.object(smtp_session, "get_mx_hosts", return_value=[self.server.address]),
+            mock.patch.object(engine, "get_mx_hosts", return_value=[self.server.address]),
+            mock.patch.object(engine, "check_dns_security", return_value=("None", "None")),
+            mock.patch.object(tasks, "prefetch_domains", return_value=0),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_override = override_settings(MEDIA_ROOT=media)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        os.makedirs(os.path.join(media, "uploads"))
+        with open(os.path.join(media, "uploads", "leads.csv"), "w") as f:
+            f.write("Email\na@acme.com\nc@beta.com\nb@acme.com\nd@beta.com\ne@gamma.com\n")
+        self.batch = ValidationBatch.objects.create(csv_file="uploads/leads.csv", validation_depth="standard")
+
+    def test_chunk_by_domain(self):
+        emails = ["a@x.com", "b@y.com", "c@x.com", "d@z.com", "e@x.com", "f@x.com", "g@x.com"]
+        chunks = tasks.chunk_by_domain(emails, 3)
+        self.assertEqual(chunks, [["a@x.com", "c@x.com", "e@x.com"], ["f@x.com", "g@x.com", "b@y.com"], ["d@z.com"]])
+        self.assertEqual(tasks.chunk_by_domain([], 3), [])
+
+    def test_chunks_aggregate_into_completed_batch(self):
+        with mock.patch.object(tasks, "process_chunk_task", wraps=tasks.process_chunk_task) as chunk_task:
+            self.assertEqual(tasks.process_batch_task(self.batch.id), "COMPLETED")
+        self.assertEqual([c.args[1] for c in chunk_task.call_args_list],
+                         [["a@acme.com", "b@acme.com"], ["c@beta.com", "d@beta.com"], ["e@gamma.com"]])
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.status, self.batch.processed_emails), ("COMPLETED", 5))
+        self.assertEqual(self.batch.results.get(email="c@beta.com").smtp_check, "Success")
+
+    def test_pause_stops_remaining_chunks_and_resume_finishes(self):
+        real_validate = tasks.validate_email_single
+
+        def validate_then_pause(email, **kwargs):
+            ValidationBatch.objects.filter(pk=self.batch.pk).update(status='PAUSED')
+            return real_validate(email, **kwargs)
+
+        with mock.patch.object(tasks, "validate_email_single", side_effect=validate_then_pause):
+            self.assertEqual(tasks.process_batch_task(self.batch.id), "PAUSED")
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.status, self.batch.processed_emails), ("PAUSED", 1))
+
+        self.assertEqual(tasks.process_batch_task(self.batch.id), "COMPLETED")
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.results.count(), 5)
+        self.assertEqual(self.batch.processed_emails, 5)
+
+    def test_failed_chunk_fails_batch(self):
+        with mock.patch.object(tasks, "validate_email_single", side_effect=RuntimeError("boom")):
+            self.assertEqual(tasks.process_batch_task(self.batch.id), "FAILED")
+
+    def test_superseded_run_does_not_finalize(self):
+        # The batch was resumed while chunks of its first run were still queued
+        ValidationBatch.objects.filter(pk=self.batch.pk).update(status='PROCESSING', run=2)
+        done = {"status": "done", "processed": 0, "parked": 0}
+        self.assertEqual(tasks.process_chunk_task(self.batch.id, ["a@acme.com"], 1)["status"], "stale")
+        self.assertEqual(tasks.finalize_batch_task([done], self.batch.id, 1), "PROCESSING")
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.status, self.batch.results.count()), ("PROCESSING", 0))
+
+        self.assertEqual(tasks.finalize_batch_task([done], self.batch.id, 2), "COMPLETED")
+
+    @override_settings(SMTP_SESSION_CHUNK=1)
+    def test_throttled_mx_does_not_hold_pool_threads(self):
+        other = FakeSMTPServer(catch_all=True)
+        self.addCleanup(other.stop)
+        mx_by_domain = {"bigcorp.com": [self.server.address], "other.com": [other.address]}
+        real_acquire = smtp_session.throttle.try_acquire
+        started = time.monotonic()
+
+        def try_acquire(mx_host):
+            if mx_host == self.server.address and time.monotonic() - started < 1.5:
+                return None, 0.2
+            return real_acquire(mx_host)
+
+        finished_at = {}
+        with mock.patch.object(smtp_session, "get_mx_hosts", side_effect=mx_by_domain.get), \
+                mock.patch.object(engine, "get_mx_hosts", side_effect=mx_by_domain.get), \
+                mock.patch.object(smtp_session.throttle, "try_acquire", side_effect=try_acquire):
+            emails = ["a@bigcorp.com", "b@bigcorp.com", "c@bigcorp.com", "x@other.com"]
+            for email, res in tasks.iter_validated(emails, {}, False, "standard", 3):
+                finished_at[email] = time.monotonic() - started
+        self.assertEqual(set(finished_at), set(emails))
+        # All three threads first got a throttled bigcorp unit; other.com still ran meanwhile
+        self.assertLess(finished_at["x@other.com"], 1)
+        self.assertGreaterEqual(min(finished_at[e] for e in emails[:3]), 1.5)
+
+    def test_result_buffer_flushes_by_size_and_upserts(self):
+        res = engine.validate_email_single("a@acme.com")
+        buffer = tasks.ResultBuffer(self.batch, {}, size=2, interval=60)
+        buffer.add("a@acme.com", res)
+        self.assertEqual(self.batch.results.count(), 0)
+        buffer.add("b@acme.com", dict(res, email="b@acme.com"))
+        self.assertEqual(self.batch.results.count(), 2)
+
+        # Re-validating an address overwrites its row instead of adding one
+        buffer.add("a@acme.com", dict(res, status="RISKY"))
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.batch.results.count(), 2)
+        self.assertEqual(self.batch.results.get(email="a@acme.com").status, "RISKY")
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.processed_emails, self.batch.current_processing_email), (3, "a@acme.com"))
+
+    def test_result_buffer_flushes_by_time(self):
+        res = engine.validate_email_single("a@acme.com")
+        buffer = tasks.ResultBuffer(self.batch, {}, size=100, interval=0)
+        buffer.add("a@acme.com", res)
+        self.assertEqual(self.batch.results.count(), 1)
+
+    def test_live_progress_only_checkpoints_batch_row(self):
+        res = engine.validate_email_single("a@acme.com")
+        buffer = tasks.ResultBuffer(self.batch, {}, size=1, interval=60)
+        with mock.patch.object(progress, "record", return_value=True) as record:
+            buffer.add("a@acme.com", res)
+            buffer.add("b@acme.com", dict(res, email="b@acme.com"))
+            self.batch.refresh_from_db()
+            self.assertEqual(self.batch.processed_emails, 0)
+            buffer.close()
+        self.assertEqual(record.call_args_list[-1].args, (self.batch.id, [("b@acme.com", res["status"])]))
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.processed_emails, self.batch.current_processing_email), (2, "b@acme.com"))
+
+    def test_status_api_prefers_live_progress(self):
+        live = {"processed": 3, "total": 5, "current_email": "c@beta.com", "per_status": {"DELIVERABLE": 2},
+                "emails_per_sec": 1.5, "eta_seconds": 1}
+        with mock.patch.object(progress, "read", return_value=live):
+            data = self.client.get(f"/api/batch/{self.batch.id}/status/").json()
+        self.assertEqual((data["processed"], data["progress_percent"], data["eta_seconds"]), (3, 60, 1))
+        self.assertEqual(data["per_status"], {"DELIVERABLE": 2})
+
+        # No Redis: the batch row's checkpoint
+        data = self.client.get(f"/api/batch/{self.batch.id}/status/").json()
+        self.assertEqual((data["processed"], data["emails_per_sec"]), (0, None))
+
+    @override_settings(BATCH_CHUNK_SIZE=5, SMTP_SESSION_CHUNK=1)
+    def test_sessions_run_concurrently_within_chunk(self):
+        self.server.latency = 0.05
+        self.assertEqual(tasks.process_batch_task(self.batch.id), "COMPLETED")
+        self.assertGreater(self.server.max_active, 1)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.processed_emails, 5)
+        self.assertEqual(
+            dict(self.batch.results.values_list("email", "smtp_check")),
+            {"a@acme.com": "Success", "c@beta.com": "Success", "b@acme.com": "Fail (550)",
+             "d@beta.com": "Fail (550)", "e@gamma.com": "Fail (550)"},
+        )
+
+    @override_settings(BATCH_CHUNK_SIZE=5, SMTP_SESSION_CHUNK=1)
+    def test_in_flight_limit_per_batch(self):
+        self.server.latency = 0.05
+        self.batch.max_in_flight = 1
+        self.batch.save()
+        self.assertEqual(tasks.process_batch_task(self.batch.id), "COMPLETED")
+        self.assertEqual(self.server.max_active, 1)
+
+    @override_settings(BATCH_CHUNK_SIZE=5, SMTP_SESSION_CHUNK=1)
+    def test_pause_under_concurrency_resumes_unsaved(self):
+        self.server.latency = 0.05
+        real_add = tasks.ResultBuffer.add
+
+        def add_then_pause(buffer, email, res):
+            # Results are collected on the task's own thread while sessions are still in flight
+            ValidationBatch.objects.filter(pk=self.batch.pk).update(status='PAUSED')
+            batch_control.send_signal(self.batch.id, batch_control.PAUSE)
+            return real_add(buffer, email, res)
+
+        with mock.patch.object(tasks.ResultBuffer, "add", autospec=True, side_effect=add_then_pause):
+            self.assertEqual(tasks.process_batch_task(self.batch.id), "PAUSED")
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.results.count(), self.batch.processed_emails), (1, 1))
+
+        self.assertEqual(tasks.process_batch_task(self.batch.id), "COMPLETED")
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.results.count(), self.batch.processed_emails), (5, 5))
+
+
+    @override_settings(BATCH_CHUNK_SIZE=5, SMTP_SESSION_CHUNK=1)
+    def test_cancel_stops_batch_and_keeps_results(self):
+        self.server.latency = 0.05
+        self.addCleanup(batch_control.clear_signal, self.batch.id)
+        real_add = tasks.ResultBuffer.add
+
+        def add_then_cancel(buffer, email, res):
+            batch_control.send_signal(self.batch.id, batch_control.CANCEL)
+            return real_add(buffer, email, res)
+
+        with mock.patch.object(tasks.ResultBuffer, "add", autospec=True, side_effect=add_then_cancel):
+            self.assertEqual(tasks.process_batch_task(self.batch.id), "CANCELLED")
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.results.count(), self.batch.processed_emails), (1, 1))
+
+    def test_pause_view_signals_running_chunks(self):
+        self.addCleanup(batch_control.clear_signal, self.batch.id)
+        ValidationBatch.objects.filter(pk=self.batch.pk).update(status='PROCESSING')
+        self.client.post(f"/batch/{self.batch.id}/pause/")
+        self.assertEqual(batch_control.BatchControl(self.batch.id).check(), batch_control.PAUSE)
+        self.assertEqual(tasks.process_chunk_task(self.batch.id, ["a@acme.com"])["status"], "paused")
+
+        self.client.post(f"/batch/{self.batch.id}/cancel/")
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, "CANCELLED")
+        self.assertEqual(batch_control.BatchControl(self.batch.id).check(), batch_control.CANCEL)
+
+
+@override_settings(CACHE_REDIS_URL='')
+class BatchControlTests(TestCase):
+    def setUp(self):
+        self.batch = ValidationBatch.objects.create(csv_file="uploads/leads.csv", status="PROCESSING")
+        self.addCleanup(batch_control.clear_signal, self.batch.id)
+
+    def test_local_signal_is_seen_immediately(self):
+        control = batch_control.BatchControl(self.batch.id, interval_ms=60000)
+        self.assertIsNone(control.check())
+        batch_control.send_signal(self.batch.id, batch_control.PAUSE)
+        self.assertEqual(control.check(), batch_control.PAUSE)
+        # Sticky, even once the signal is cleared for the next run
+        batch_control.clear_signal(self.batch.id)
+        self.assertEqual(control.check(), batch_control.PAUSE)
+
+    def test_newer_run_drops_signal_left_in_this_process(self):
+        batch_control.BatchControl(self.batch.id, run=1)
+        batch_control.send_signal(self.batch.id, batch_control.PAUSE)
+        self.assertEqual(batch_control.BatchControl(self.batch.id, run=1).check(), batch_control.PAUSE)
+        # Resumed from another process, whose clear_signal never reached this one
+        self.assertIsNone(batch_control.BatchControl(self.batch.id, run=2).check())
+
+    def test_signal_stays_out_of_process_memory_with_redis(self):
+        r = mock.Mock()
+        with mock.patch.object(batch_control, "get_redis", return_value=r):
+            batch_control.send_signal(self.batch.id, batch_control.PAUSE)
+        r.setex.assert_called_once()
+        self.assertNotIn(self.batch.id, batch_control._local)
+
+    def test_status_fallback_is_read_at_most_every_interval(self):
+        control = batch_control.BatchControl(self.batch.id, interval_ms=60000)
+        self.assertIsNone(control.check())
+        ValidationBatch.objects.filter(pk=self.batch.pk).update(status='CANCELLED')
+        with self.assertNumQueries(0):
+            self.assertIsNone(control.check())
+        control.checked_at -= 60
+        self.assertEqual(control.check(), batch_control.CANCEL)
+
+
+@override_settings(CACHE_REDIS_URL='', SMTP_LIST=["dev@meta-insyt.com"], SMTP_THROTTLE_ENABLED=False)
+class EgressPreflightTests(TestCase):
+    def setUp(self):
+        egress.reset_egress_status()
+        self.addCleanup(egress.reset_egress_status)
+        engine.catch_all_cache.clear()
+        self.server = FakeSMTPServer(mailboxes={"a@acme.com"})
+        self.addCleanup(self.server.stop)
+        patches = [
+            mock.patch.object(smtp_session, "get_mx_hosts", return_value=[self.server.address]),
+            mock.patch.object(engine, "get_mx_hosts", return_value=[self.server.address]),
+            mock.patch.object(engine, "check_dns_security", return_value=("None", "None")),
+            mock.patch.object(tasks, "prefetch_domains", return_value=0),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_override = override_settings(MEDIA_ROOT=media)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        os.makedirs(os.path.join(media, "uploads"))
+        with open(os.path.join(media, "uploads", "leads.csv"), "w") as f:
+            f.write("Email\na@acme.com\nb@acme.com\n")
+
+    def make_batch(self):
+        return ValidationBatch.objects.create(csv_file="uploads/leads.csv", validation_depth="standard")
+
+    def test_preflight_states(self):
+        self.assertEqual(egress.run_preflight([self.server.address], timeout=2)["state"], egress.OK)
+        self.assertFalse(egress.smtp_blocked())
+
+        status = egress.run_preflight([closed_port_address()], timeout=2)
+        self.assertEqual(status["state"], egress.BLOCKED)
+        self.assertTrue(egress.smtp_blocked())
+
+        listed = FakeSMTPServer(banner="554 5.7.1 Client host blocked using zen.spamhaus.org")
+        self.addCleanup(listed.stop)
+        status = egress.run_preflight([closed_port_address(), listed.address], timeout=2)
+        self.assertEqual(status["state"], egress.BLACKLISTED)
+        self.assertIn("spamhaus", status["details"][1])
+
+        # One working host is enough
+        self.assertEqual(egress.run_preflight([listed.address, self.server.address], timeout=2)["state"], egress.OK)
+
+        with mock.patch.object(engine, "mx_addresses", side_effect=dns.resolver.NXDOMAIN):
+            self.assertEqual(egress.run_preflight(["mx.nowhere.test"], timeout=2)["state"], egress.UNKNOWN)
+        self.assertFalse(egress.smtp_blocked())
+
+    def test_blocked_egress_pauses_batch_without_smtp(self):
+        egress.run_preflight([closed_port_address()], timeout=2)
+        batch = self.make_batch()
+        self.assertEqual(tasks.process_batch_task(batch.id), "Paused")
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, "PAUSED")
+        self.assertFalse(batch.results.exists())
+        self.assertEqual(self.server.connections, 0)
+
+    @override_settings(EGRESS_BLOCKED_ACTION="dns_only")
+    def test_blocked_egress_falls_back_to_dns_only(self):
+        egress.run_preflight([closed_port_address()], timeout=2)
+        batch = self.make_batch()
+        tasks.process_batch_task(batch.id)
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, "COMPLETED")
+        self.assertEqual(set(batch.results.values_list("smtp_check", flat=True)), {"Skipped"})
+        self.assertEqual(self.server.connections, 0)
+        # Single checks skip SMTP too instead of waiting out timeouts
+        self.assertEqual(validate_email_single("a@acme.com", depth="standard")["smtp_check"], "Skipped")
+
+    @override_settings(EGRESS_BLOCKED_ACTION="dns_only")
+    def test_switches_to_dns_only_mid_batch(self):
+        states = iter([False, False] + [True] * 10)
+        with mock.patch.object(tasks, "smtp_blocked", side_effect=lambda: next(states)):
+            rows = list(tasks.iter_batch_results(["a@acme.com", "b@acme.com"], {}, False, "standard"))
+        self.assertEqual([(email, depth) for email, _, depth in rows], [("a@acme.com", "standard"), ("b@acme.com", "dns")])
+        self.assertEqual(rows[0][1][:2], (True, 250))
+
+    def test_greylist_retries_wait_for_egress(self):
+        batch = self.make_batch()
+        result = EmailResult.objects.create(batch=batch, email="a@acme.com", status="RISKY")
+        GreylistRetry.objects.create(result=result, mx_host=self.server.address, next_attempt_at=timezone.now())
+        egress.run_preflight([closed_port_address()], timeout=2)
+        self.assertEqual(tasks.retry_greylisted_task(), 0)
+        self.assertGreater(GreylistRetry.objects.get().next_attempt_at, timezone.now() + timedelta(seconds=200))
+        self.assertEqual(self.server.connections, 0)
+
+
+class FakeSOCKS5Server:
+    """No-auth SOCKS5 CONNECT relay on 127.0.0.1 that counts the tunnels it opens."""
+
+    def __init__(self):
+        self.tunnels = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                client = self.request
+                greeting = client.recv(2)
+                client.recv(greeting[1])
+                client.sendall(b"\x05\x00")
+                head = client.recv(4)
+                if head[3] == 1:
+                    host = socket.inet_ntoa(client.recv(4))
+                else:
+                    host = client.recv(client.recv(1)[0]).decode()
+                port = int.from_bytes(client.recv(2), "big")
+                try:
+                    upstream = socket.create_connection((host, port), timeout=5)
+                except OSError:
+                    client.sendall(b"\x05\x05\x00\x01" + bytes(6))
+                    return
+                with fake.lock:
+                    fake.tunnels += 1
+                client.sendall(b"\x05\x00\x00\x01" + bytes(6))
+                with upstream:
+                    relay = threading.Thread(target=self.pipe, args=(upstream, client), daemon=True)
+                    relay.start()
+                    self.pipe(client, upstream)
+                    relay.join(5)
+
+            @staticmethod
+            def pipe(src, dst):
+                try:
+                    while True:
+                        data = src.recv(65536)
+                        if not data:
+                            break
+                        dst.sendall(data)
+                except OSError:
+                    pass
+                try:
+                    dst.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+            request_queue_size = 64
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.address = "%s:%d" % self.server.server_address
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(CACHE_REDIS_URL='', SMTP_LIST=["dev@meta-insyt.com"], SMTP_THROTTLE_ENABLED=False)
+class ProxyPoolTests(TestCase):
+    def setUp(self):
+        mx_breakers.reset()
+        proxy_pool.reset_proxy_pool()
+        self.addCleanup(proxy_pool.reset_proxy_pool)
+        self.addCleanup(bump_config_version)
+
+    def test_parse_proxies(self):
+        self.assertEqual(parse_proxies("socks5://u:p@10.0.0.1:1080, 10.0.0.2:1081\nbogus"),
+                         [("10.0.0.1", 1080, "u", "p"), ("10.0.0.2", 1081, None, None)])
+
+    def test_least_loaded_with_concurrency_cap(self):
+        pool = ProxyPool([("10.0.0.1", 1080, None, None), ("10.0.0.2", 1080, None, None)], max_concurrent=1)
+        first, second = pool.try_acquire(), pool.try_acquire()
+        self.assertNotEqual(first.address, second.address)
+        self.assertIsNone(pool.try_acquire())
+        pool.release(first)
+        self.assertEqual(pool.acquire(timeout=0.1).address, first.address)
+
+    def test_failing_proxy_is_skipped(self):
+        pool = ProxyPool([("10.0.0.1", 1080, None, None), ("10.0.0.2", 1080, None, None)], strategy="round_robin")
+        bad = pool.proxies[0]
+        for _ in range(proxy_pool.MAX_CONSECUTIVE_ERRORS):
+            pool.record(bad)
+        self.assertEqual({pool.try_acquire().address for _ in range(4)}, {"10.0.0.2:1080"})
+
+    def test_probes_dial_through_pool_without_patching_socket(self):
+        smtp = FakeSMTPServer(mailboxes={"a@acme.com"})
+        socks_server = FakeSOCKS5Server()
+        self.addCleanup(smtp.stop)
+        self.addCleanup(socks_server.stop)
+        dead_proxy = closed_port_address()
+        SystemConfig.objects.create(key="PROXY_URL", value=f"socks5://{dead_proxy}, socks5://{socks_server.address}")
+        bump_config_version()
+        original_socket = socket.socket
+
+        for _ in range(3):
+            self.assertEqual(engine.check_smtp_detailed("a@acme.com", mx_hosts=[smtp.address])[:2], (True, 250))
+        self.assertIs(socket.socket, original_socket)
+        with mock.patch.object(engine, "get_mx_hosts", return_value=[smtp.address]):
+            results = smtp_async.check_smtp_many(["a@acme.com", "b@acme.com"])
+        self.assertEqual([results[e][1] for e in ("a@acme.com", "b@acme.com")], [250, 550])
+
+        stats = {p["address"]: p for p in proxy_pool.get_proxy_pool().stats()["proxies"]}
+        self.assertEqual(socks_server.tunnels, 5)
+        self.assertFalse(stats[dead_proxy]["healthy"])
+        self.assertEqual(stats[socks_server.address]["in_flight"], 0)
+        # The dead proxy was never blamed on the MX
+        self.assertEqual(mx_breakers.stats()[0]["failures"], 0)
+
+
+@override_settings(CACHE_REDIS_URL='', SMTP_LIST=[], CONFIG_VERSION_CHECK_SECONDS=60, CONFIG_SNAPSHOT_MAX_AGE=60)
+class ConfigSnapshotTests(TestCase):
+    def setUp(self):
+        bump_config_version()
+        self.addCleanup(bump_config_version)
+
+    def test_snapshot_served_from_memory_until_bumped(self):
+        self.assertTrue(is_disposable("x@mailinator.com"))
+        SMTPSender.objects.create(email="ops@acme.com")
+        DisposableDomain.objects.create(domain="Throwaway.io")
+
+        with self.assertNumQueries(0):
+            self.assertFalse(is_disposable("x@throwaway.io"))
+            self.assertEqual(engine.get_smtp_senders(), [])
+            self.assertIsNone(proxy_pool.get_proxy_pool())
+
+        bump_config_version()
+        self.assertTrue(is_disposable("x@throwaway.io"))
+        self.assertEqual(engine.get_smtp_senders(), ["ops@acme.com"])
+
+    def test_management_edit_invalidates_snapshot(self):
+        get_config()
+        self.client.post("/management/", {"action": "update_proxy", "proxy_url": "socks5://10.0.0.9:1080"})
+        self.assertEqual(get_config().system_config["PROXY_URL"], "socks5://10.0.0.9:1080")
+        self.assertEqual(proxy_pool.get_proxy_pool().proxies[0].address, "10.0.0.9:1080")
+
+    @override_settings(CONFIG_SNAPSHOT_MAX_AGE=0)
+    def test_reloads_by_age_without_redis(self):
+        get_config()
+        DisposableDomain.objects.create(domain="burner.io")
+        with override_settings(CONFIG_VERSION_CHECK_SECONDS=0):
+            self.assertTrue(is_disposable("x@burner.io"))
@@ -0,0 +1,208 @@
+import threading
+import time
+import uuid
+from django.conf import settings
+from .redis_client import get_redis, mark_redis_down
+from .engine import detect_spam_filter, provider_from_mx
+
+# Checks every scope's token bucket and session cap, and only if all of them
+# have room takes one token and one session slot from each. Returns "0" on
+# success or the seconds to wait (as a string, Lua numbers lose the fraction).
+# KEYS: bucket, sessions per scope. ARGV: lease id, lease ttl, then rate, burst, max_sessions per scope.
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local lease, ttl = ARGV[1], tonumber(ARGV[2])
+local n = #KEYS / 2
+local wait = 0
+local tokens = {}
+for i = 1, n do
+  local rate, burst, cap = tonumber(ARGV[3 * i]), tonumber(ARGV[3 * i + 1]), tonumber(ARGV[3 * i + 2])
+  if rate > 0 then
+    local state = redis.call('HMGET', KEYS[2 * i - 1], 'tokens', 'ts')
+    local level = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    level = math.min(burst, level + math.max(0, now - ts) * rate)
+    tokens[i] = level
+    if level < 1 then wait = math.max(wait, (1 - level) / rate) end
+  end
+  if cap > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2 * i], '-inf', now)
+    if redis.call('ZCARD', KEYS[2 * i]) >= cap then wait = math.max(wait, tonumber(ARGV[#ARGV])) end
+  end
+end
+if wait > 0 then return tostring(wait) end
+for i = 1, n do
+  local rate, burst, cap = tonumber(ARGV[3 * i]), tonumber(ARGV[3 * i + 1]), tonumber(ARGV[3 * i + 2])
+  if rate > 0 then
+    redis.call('HSET', KEYS[2 * i - 1], 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('EXPIRE', KEYS[2 * i - 1], math.ceil(burst / rate) + 60)
+  end
+  if cap > 0 then
+    redis.call('ZADD', KEYS[2 * i], now + ttl, lease)
+    redis.call('EXPIRE', KEYS[2 * i], ttl + 60)
+  end
+end
+return "0"
+"""
+
+
+def provider_key(mx_host):
+    """Throttling provider for an MX: the filtering gateway if any, else the mailbox provider."""
+    gateway = detect_spam_filter(mx_host)
+    if gateway:
+        return gateway.split()[0].split("/")[0].lower()
+    provider = provider_from_mx(mx_host)
+    if provider in ("Custom", "Unknown"):
+        return None
+    return provider.split()[0].lower()
+
+
+def throttle_scopes(mx_host):
+    """[(scope, limits)] an SMTP session to mx_host counts against: the host and its provider."""
+    host = mx_host.lower().rstrip(".")
+    scopes = [(f"mx:{host}", getattr(settings, 'SMTP_THROTTLE_MX', {}))]
+    provider = provider_key(host)
+    limits = getattr(settings, 'SMTP_THROTTLE_PROVIDERS', {}).get(provider) if provider else None
+    if limits:
+        scopes.append((f"provider:{provider}", limits))
+    return scopes
+
+
+class Lease:
+    """One granted SMTP session; release() it when the session ends."""
+
+    def __init__(self, throttle, scopes):
+        self.throttle = throttle
+        self.scopes = scopes
+        self.id = uuid.uuid4().hex
+
+    def release(self):
+        if self.throttle is not None:
+            self.throttle.release(self)
+            self.throttle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SMTPThrottle:
+    """
+    Token-bucket session rates and concurrent-session caps per MX host and per
+    provider. State lives in Redis so every worker shares the same budget; without
+    Redis the same limits are enforced per process. Callers that get a wait
+    instead of a lease should work on another MX rather than sleep.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}   # scope -> [tokens, ts]
+        self._sessions = {}  # scope -> {lease id: expires_at}
+        self._script = None
+        self.granted = 0
+        self.throttled = 0
+
+    @property
+    def lease_ttl(self):
+        return getattr(settings, 'SMTP_THROTTLE_LEASE_TTL', 300)
+
+    @property
+    def cap_retry(self):
+        return getattr(settings, 'SMTP_THROTTLE_CAP_RETRY', 0.25)
+
+    def try_acquire(self, mx_host):
+        """Returns (Lease, 0) when a session may start now, else (None, seconds to wait)."""
+        if not getattr(settings, 'SMTP_THROTTLE_ENABLED', True):
+            return Lease(None, []), 0
+        scopes = throttle_scopes(mx_host)
+        lease = Lease(self, scopes)
+        wait = self._acquire_redis(lease)
+        if wait is None:
+            wait = self._acquire_local(lease)
+        with self._lock:
+            if wait > 0:
+                self.throttled += 1
+            else:
+                self.granted += 1
+        return (None, wait) if wait > 0 else (lease, 0)
+
+    def acquire(self, mx_host, timeout=None):
+        """Blocking acquire for one-off probes; returns None if timeout passes first."""
+        deadline = time.monotonic() + (timeout if timeout is not None else self.lease_ttl)
+        while True:
+            lease, wait = self.try_acquire(mx_host)
+            if lease is not None:
+                return lease
+            if time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+
+    def _acquire_redis(self, lease):
+        r = get_redis()
+        if r is None:
+            return None
+        keys, args = [], [lease.id, self.lease_ttl]
+        for scope, limits in lease.scopes:
+            keys += [f"meip:throttle:bucket:{scope}", f"meip:throttle:sessions:{scope}"]
+            args += [limits.get("rate", 0), limits.get("burst", 1), limits.get("max_sessions", 0)]
+        args.append(self.cap_retry)
+        try:
+            if self._script is None:
+                self._script = r.register_script(ACQUIRE_SCRIPT)
+            return float(self._script(keys=keys, args=args, client=r))
+        except Exception:
+            mark_redis_down()
+            return None
+
+    def _acquire_local(self, lease):
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            levels = {}
+            for scope, limits in lease.scopes:
+                rate, burst, cap = limits.get("rate", 0), limits.get("burst", 1), limits.get("max_sessions", 0)
+                if rate > 0:
+                    level, ts = self._buckets.get(scope, (burst, now))
+                    level = min(burst, level + max(0.0, now - ts) * rate)
+                    levels[scope] = level
+                    if level < 1:
+                        wait = max(wait, (1 - level) / rate)
+                if cap > 0:
+                    sessions = self._sessions.setdefault(scope, {})
+                    for lease_id, expires_at in list(sessions.items()):
+                        if expires_at <= now:
+                            del sessions[lease_id]
+                    if len(sessions) >= cap:
+                        wait = max(wait, self.cap_retry)
+            if wait > 0:
+                return wait
+            for scope, limits in lease.scopes:
+                if scope in levels:
+                    self._buckets[scope] = (levels[scope] - 1, now)
+                if limits.get("max_sessions", 0) > 0:
+                    self._sessions[scope][lease.id] = now + self.lease_ttl
+            return 0.0
+
+    def release(self, lease):
+        with self._lock:
+            for scope, _ in lease.scopes:
+                self._sessions.get(scope, {}).pop(lease.id, None)
+        r = get_redis()
+        if r is not None and lease.scopes:
+            try:
+                pipe = r.pipeline(transaction=False)
+                for scope, _ in lease.scopes:
+                    pipe.zrem(f"meip:throttle:sessions:{scope}", lease.id)
+                pipe.execute()
+            except Exception:
+                mark_redis_down()
+
+    def stats(self):
+        with self._lock:
+            return {"granted": self.granted, "throttled": self.throttled}
+
+
+throttle = SMTPThrottle()
@@ -7,6 +7,10 @@ from rest_framework.permissions import AllowAny
 from django.db import connections
 from django.conf import settings
 from .models import SystemConfig
+from .dns_pool import get_upstream_pool
+from .mx_health import mx_breakers, mx_latency
+from .proxy_pool import get_proxy_pool
+from .egress import refresh_if_stale, BLOCKED, BLACKLISTED
 
 class SystemHealthView(APIView):
     permission_classes = [AllowAny]
@@ -76,5 +80,27 @@ class SystemHealthView(APIView):
             for name, host in bls.items():
                 is_listed = self.check_dnsbl(ip, host)
                 health_data['ip_reputation'][name] = "LISTED (BAD)" if is_listed else "CLEAN"
+
+        # 5. DNS upstream pool (this process)
+        pool = get_upstream_pool()
+        health_data['dns_upstreams'] = pool.stats() if pool else "system_resolver"
+
+        # 6. SMTP gateways seen by this process: circuit state and connect latency per MX address
+        health_data['mx_hosts'] = mx_breakers.stats()
+        # Reply latency and the timeout learned from it, per MX host
+        health_data['mx_timeouts'] = mx_latency.stats()
+
+        # 7. Outgoing SOCKS proxies (this process)
+        proxy_pool = get_proxy_pool()
+        health_data['proxies'] = proxy_pool.stats() if proxy_pool else "direct"
+
+        # 8. Outbound SMTP egress (port 25), as last seen by the workers' preflight
+        try:
+            egress = refresh_if_stale()
+            health_data['smtp_egress'] = egress
+            if egress['state'] in (BLOCKED, BLACKLISTED):
+                health_data['status'] = "degraded"
+        except Exception as e:
+            health_data['smtp_egress'] = f"error: {str(e)}"
         
         return Response(health_data)
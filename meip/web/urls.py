@@ -12,6 +12,7 @@ urlpatterns = [
     path('batch/<int:batch_id>/delete/', views.delete_batch, name='delete_batch'),
     path('batch/<int:batch_id>/pause/', views.pause_batch, name='pause_batch'),
     path('batch/<int:batch_id>/resume/', views.resume_batch, name='resume_batch'),
+    path('batch/<int:batch_id>/cancel/', views.cancel_batch, name='cancel_batch'),
     path('api/batch/<int:batch_id>/status/', views.batch_status_api, name='batch_status_api'),
     path('batch/bulk-action/', views.batch_bulk_action, name='batch_bulk_action'),
     path('management/', views.management, name='management'),
@@ -4,8 +4,11 @@ from django.contrib import messages
 from django.http import JsonResponse, HttpResponse
 from django.db.models import Count, Avg
 from validator.models import ValidationBatch, EmailResult, SMTPSender, DisposableDomain, SystemConfig
-from validator.engine import validate_email_single
+from validator.engine import validate_email_single, VALIDATION_DEPTHS, DEFAULT_VALIDATION_DEPTH
 from validator.tasks import process_batch_task
+from validator.config_snapshot import bump_config_version
+from validator.batch_control import send_signal, clear_signal, PAUSE, CANCEL
+from validator import progress
 import csv
 from django.conf import settings
 import json
@@ -26,12 +29,17 @@ def dashboard(request):
 
 def manual_validate(request):
     result = None
+    depth = request.POST.get('validation_depth', DEFAULT_VALIDATION_DEPTH)
     if request.method == 'POST':
         email = request.POST.get('email')
         if email:
-            result = validate_email_single(email)
+            result = validate_email_single(email, depth=depth)
     
-    return render(request, 'web/manual.html', {'result': result})
+    return render(request, 'web/manual.html', {
+        'result': result,
+        'depth_choices': ValidationBatch._meta.get_field('validation_depth').choices,
+        'validation_depth': depth
+    })
 
 def batch_list(request):
     batches = ValidationBatch.objects.order_by('-created_at')
@@ -58,7 +66,8 @@ def upload_batch(request):
             return render(request, 'web/upload_preview.html', {
                 'batch': batch, 
                 'header': header, 
-                'rows': preview_rows
+                'rows': preview_rows,
+                'depth_choices': ValidationBatch._meta.get_field('validation_depth').choices
             })
         
         elif 'confirm_batch_id' in request.POST:
@@ -66,6 +75,9 @@ def upload_batch(request):
             batch_id = request.POST.get('confirm_batch_id')
             batch = get_object_or_404(ValidationBatch, id=batch_id)
             batch.status = 'PENDING'
+            depth = request.POST.get('validation_depth')
+            if depth in VALIDATION_DEPTHS:
+                batch.validation_depth = depth
             batch.save()
             try:
                 print(f"[-] Dispatching Async Task for Batch {batch.id}")
@@ -81,6 +93,7 @@ def management(request):
     smtp_senders = SMTPSender.objects.all().order_by('-created_at')
     disposable_domains = DisposableDomain.objects.all().order_by('-created_at')
     proxy_config = SystemConfig.objects.filter(key='PROXY_URL').first()
+    dns_config = SystemConfig.objects.filter(key='DNS_UPSTREAMS').first()
     
     if request.method == 'POST':
         action = request.POST.get('action')
@@ -99,13 +112,19 @@ def management(request):
         elif action == 'update_proxy':
             url = request.POST.get('proxy_url')
             SystemConfig.objects.update_or_create(key='PROXY_URL', defaults={'value': url})
-            
+        elif action == 'update_dns_upstreams':
+            upstreams = request.POST.get('dns_upstreams', '')
+            SystemConfig.objects.update_or_create(key='DNS_UPSTREAMS', defaults={'value': upstreams})
+
+        # Workers reload senders, proxies, upstreams and disposable domains on their next check
+        bump_config_version()
         return redirect('management')
         
     return render(request, 'web/management.html', {
         'smtp_senders': smtp_senders,
         'disposable_domains': disposable_domains,
-        'proxy_url': proxy_config.value if proxy_config else ''
+        'proxy_url': proxy_config.value if proxy_config else '',
+        'dns_upstreams': dns_config.value if dns_config else ''
     })
 
 def batch_detail(request, batch_id):
@@ -169,6 +188,7 @@ def recheck_batch(request, batch_id):
     batch.total_emails = 0
     batch.status = 'PENDING'
     batch.save()
+    clear_signal(batch.id)
     
     # Trigger task with fallback
     try:
@@ -186,6 +206,8 @@ def pause_batch(request, batch_id):
     if batch.status == 'PROCESSING' or batch.status == 'PENDING':
         batch.status = 'PAUSED'
         batch.save()
+        # Running chunks stop within BATCH_SIGNAL_CHECK_MS
+        send_signal(batch.id, PAUSE)
     return redirect('batch_detail', batch_id=batch.id)
 
 @require_POST
@@ -194,20 +216,38 @@ def resume_batch(request, batch_id):
     if batch.status == 'PAUSED':
         batch.status = 'PENDING'
         batch.save()
+        clear_signal(batch.id)
         try:
             process_batch_task.delay(batch.id)
         except:
             process_batch_task(batch.id)
     return redirect('batch_detail', batch_id=batch.id)
 
-def batch_status_api(request, batch_id):
+@require_POST
+def cancel_batch(request, batch_id):
     batch = get_object_or_404(ValidationBatch, id=batch_id)
+    if batch.status in ['PROCESSING', 'PENDING', 'PAUSED']:
+        batch.status = 'CANCELLED'
+        batch.save()
+        # Results so far are kept; recheck starts the batch over
+        send_signal(batch.id, CANCEL)
+    return redirect('batch_detail', batch_id=batch.id)
+
+def batch_status_api(request, batch_id):
+    # Counters come from the workers' live progress in Redis; the row only has checkpoints
+    batch = get_object_or_404(ValidationBatch.objects.only('status', 'processed_emails', 'total_emails', 'current_processing_email'), id=batch_id)
+    live = progress.read(batch.id) or {}
+    processed = live.get('processed', batch.processed_emails)
+    total = live.get('total') or batch.total_emails
     return JsonResponse({
         'status': batch.status,
-        'processed': batch.processed_emails,
-        'total': batch.total_emails,
-        'current_email': batch.current_processing_email or 'Initializing...',
-        'progress_percent': (batch.processed_emails / batch.total_emails * 100) if batch.total_emails > 0 else 0
+        'processed': processed,
+        'total': total,
+        'current_email': live.get('current_email') or batch.current_processing_email or 'Initializing...',
+        'progress_percent': (processed / total * 100) if total > 0 else 0,
+        'per_status': live.get('per_status', {}),
+        'emails_per_sec': live.get('emails_per_sec'),
+        'eta_seconds': live.get('eta_seconds'),
     })
 
 @require_POST
@@ -246,6 +286,13 @@ def batch_bulk_action(request):
                     pause_batch(request, batch.id)
                     count += 1
             messages.success(request, f"Paused {count} batches.")
+
+        elif action == 'cancel':
+            for batch in batches:
+                if batch.status in ['PROCESSING', 'PENDING', 'PAUSED']:
+                    cancel_batch(request, batch.id)
+                    count += 1
+            messages.success(request, f"Cancelled {count} batches.")
             
     return redirect('batch_list')
 